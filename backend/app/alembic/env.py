@@ -4,7 +4,9 @@ from alembic import context
 from sqlalchemy import engine_from_config, pool
 from sqlmodel import SQLModel
 
+from app.alembic.helpers import BACKFILL_TABLE
 from app.core.config import settings
+from app.core.partitions import is_partition
 from app.models import *  # noqa: F403
 
 # this is the Alembic Config object, which provides
@@ -13,7 +15,10 @@ config = context.config
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
-if config.config_file_name is not None:
+# app.utils.migrate_shards runs this once per shard and configures its own
+if config.config_file_name is not None and config.attributes.get(
+    "configure_logger", True
+):
     fileConfig(config.config_file_name)
 
 # add your model's MetaData object here
@@ -28,8 +33,27 @@ target_metadata = SQLModel.metadata
 # ... etc.
 
 
+def include_object(object, name, type_, reflected, compare_to) -> bool:
+    if type_ != "table":
+        return True
+    # progress table of app.alembic.helpers.backfill, not part of the models
+    if name == BACKFILL_TABLE:
+        return False
+    # partitions are created along with their partitioned table
+    return not (reflected and is_partition(name, set(target_metadata.tables)))
+
+
+# applied to every migration so DDL waiting for a lock fails instead of
+# blocking all traffic queued behind it, run again after a lock timeout
+TIMEOUTS = (
+    f"SET lock_timeout = {settings.MIGRATION_LOCK_TIMEOUT_MS}",
+    f"SET statement_timeout = {settings.MIGRATION_STATEMENT_TIMEOUT_MS}",
+)
+
+
 def get_url() -> str:
-    url = str(settings.SQLALCHEMY_DATABASE_URI)
+    # a shard's DSN, passed by app.utils.migrate_shards
+    url = config.attributes.get("url") or str(settings.SQLALCHEMY_DATABASE_URI)
     return url.replace("postgresql+asyncpg://", "postgresql://")
 
 
@@ -51,9 +75,13 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         compare_type=True,
+        include_object=include_object,
+        transaction_per_migration=True,
         dialect_opts={"paramstyle": "named"},
     )
 
+    for statement in TIMEOUTS:
+        context.execute(statement)
     with context.begin_transaction():
         context.run_migrations()
 
@@ -74,10 +102,18 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
+        for statement in TIMEOUTS:
+            connection.exec_driver_sql(statement)
+        connection.commit()
+
+        # each revision commits on its own, which lets helpers such as
+        # create_index_concurrently step out of the transaction
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
             compare_type=True,
+            include_object=include_object,
+            transaction_per_migration=True,
             dialect_opts={"paramstyle": "named"},
         )
 
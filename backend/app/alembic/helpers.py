@@ -0,0 +1,213 @@
+"""helpers for migrations that run while the app keeps serving traffic
+
+env.py runs every revision in its own transaction with `lock_timeout` and
+`statement_timeout` set, these helpers step out of that transaction for work
+that must not hold locks for long.
+"""
+
+import logging
+import time
+from collections.abc import Generator, Sequence
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+from alembic import op
+from psycopg.pq import TransactionStatus
+from sqlalchemy import text
+
+from app.core.config import settings
+
+logger = logging.getLogger("alembic.helpers")
+
+# progress of batched backfills, ignored by autogenerate in env.py
+BACKFILL_TABLE = "alembic_backfill"
+
+
+def on_shard() -> bool:
+    """whether app.utils.migrate_shards runs the revision on a shard"""
+    config = op.get_context().config
+    return config is not None and bool(config.attributes.get("shard"))
+
+
+def users_fk(column: str = "owner_id") -> list[sa.ForeignKeyConstraint]:
+    """`column` referencing auth.users, except on shards, which have no users"""
+    if on_shard():
+        return []
+    return [sa.ForeignKeyConstraint([column], ["auth.users.id"], ondelete="CASCADE")]
+
+
+@contextmanager
+def _no_statement_timeout() -> Generator[None, None]:
+    """lift statement_timeout for long running work, restored even if it fails"""
+    op.execute("SET statement_timeout = 0")
+    try:
+        yield
+    finally:
+        # a failed transaction can't run the SET, its rollback reverts it
+        if op.get_context().as_sql or (
+            op.get_bind().connection.driver_connection.info.transaction_status
+            is not TransactionStatus.INERROR
+        ):
+            op.execute(
+                f"SET statement_timeout = {settings.MIGRATION_STATEMENT_TIMEOUT_MS}"
+            )
+
+
+def create_index_concurrently(
+    index_name: str,
+    table_name: str,
+    columns: Sequence[str],
+    *,
+    unique: bool = False,
+    **kw: object,
+) -> None:
+    """CREATE INDEX CONCURRENTLY outside the migration transaction
+
+    an interrupted concurrent build leaves an INVALID index behind, it is
+    dropped first so the revision can simply be rerun
+    """
+    with op.get_context().autocommit_block():
+        if not op.get_context().as_sql:
+            invalid = op.get_bind().execute(
+                text(
+                    "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE c.relname = :name AND NOT i.indisvalid"
+                ),
+                {"name": index_name},
+            )
+            if invalid.first():
+                logger.warning("dropping invalid index %s", index_name)
+                op.drop_index(
+                    index_name, table_name, postgresql_concurrently=True, if_exists=True
+                )
+        # the build can take long, but it does not block reads or writes
+        with _no_statement_timeout():
+            op.create_index(
+                index_name,
+                table_name,
+                list(columns),
+                unique=unique,
+                postgresql_concurrently=True,
+                if_not_exists=True,
+                **kw,
+            )
+
+
+def drop_index_concurrently(index_name: str, table_name: str) -> None:
+    """DROP INDEX CONCURRENTLY outside the migration transaction"""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            index_name, table_name, postgresql_concurrently=True, if_exists=True
+        )
+
+
+def backfill(
+    name: str,
+    table_name: str,
+    set_clause: str,
+    *,
+    where: str = "true",
+    key: str = "id",
+    key_type: str = "uuid",
+    batch_size: int = 1000,
+    pause: float = 0.1,
+) -> int:
+    """UPDATE `table_name` in keyset ordered batches, each committed on its own
+
+    every batch and its progress row in `alembic_backfill` are written by one
+    statement, so a rerun after an interruption resumes after the last batch.
+    the row is deleted once done, so an upgrade after a downgrade runs it again.
+    `pause` seconds between batches leave room for replication and traffic.
+    rows inserted behind the cursor meanwhile are skipped, so the app should
+    already write the new value before the backfill starts.
+
+        backfill("item_external_key", "item", "external_key = id::text",
+                 where="external_key IS NULL")
+    """
+    if op.get_context().as_sql:
+        op.execute(f"UPDATE {table_name} SET {set_clause} WHERE {where}")
+        return 0
+
+    batch = text(
+        f"WITH progress AS ("
+        f"  SELECT last_key FROM {BACKFILL_TABLE} WHERE name = :name"
+        f"), batch AS ("
+        f"  SELECT {key} FROM {table_name} WHERE ({where}) AND ("
+        f"    NOT EXISTS (SELECT 1 FROM progress)"
+        f"    OR {key} > (SELECT CAST(last_key AS {key_type}) FROM progress))"
+        f"  ORDER BY {key} LIMIT :batch_size"
+        f"), updated AS ("
+        f"  UPDATE {table_name} SET {set_clause} FROM batch"
+        f"  WHERE {table_name}.{key} = batch.{key} RETURNING {table_name}.{key}"
+        f"), saved AS ("
+        f"  INSERT INTO {BACKFILL_TABLE} (name, last_key, rows)"
+        f"  SELECT :name, (SELECT {key}::text FROM updated ORDER BY {key} DESC LIMIT 1),"
+        f"  count(*) FROM updated HAVING count(*) > 0"
+        f"  ON CONFLICT (name) DO UPDATE SET last_key = excluded.last_key,"
+        f"  rows = {BACKFILL_TABLE}.rows + excluded.rows, updated_at = now()"
+        f") SELECT count(*) FROM updated"
+    )
+    total = 0
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        conn.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {BACKFILL_TABLE} ("
+                "name text PRIMARY KEY, last_key text, rows bigint NOT NULL DEFAULT 0, "
+                "updated_at timestamptz NOT NULL DEFAULT now())"
+            )
+        )
+        done = conn.execute(
+            text(f"SELECT rows FROM {BACKFILL_TABLE} WHERE name = :name"),
+            {"name": name},
+        ).scalar()
+        if done:
+            logger.info("resuming backfill %s after %d rows", name, done)
+        started = time.monotonic()
+        while rows := conn.execute(
+            batch, {"name": name, "batch_size": batch_size}
+        ).scalar_one():
+            total += rows
+            logger.info(
+                "backfill %s: %d rows, %.0f rows/s",
+                name,
+                total,
+                total / (time.monotonic() - started),
+            )
+            time.sleep(pause)
+        conn.execute(
+            text(f"DELETE FROM {BACKFILL_TABLE} WHERE name = :name"), {"name": name}
+        )
+    logger.info("backfill %s done, %d rows updated", name, total)
+    return total
+
+
+def rebuild_table(
+    table_name: str,
+    *,
+    partition_by: str | None = None,
+    partitions: Sequence[str] = (),
+) -> None:
+    """rebuild `table_name` with its rows, `PARTITION BY partition_by` if given
+
+    the new table is created LIKE the old one as `<table_name>_new`, then the
+    `partitions` DDL is run and the rows are copied while a SHARE lock keeps
+    writes waiting and reads going. from the swap on reads wait too, until the
+    revision commits. constraints and indexes are not copied, the revision
+    creates them on the new table. writes wait for the whole copy, so a
+    revision rebuilding a table with more than a few thousand rows needs a
+    maintenance window, and says so in its docstring.
+    """
+    new = f"{table_name}_new"
+    op.execute(f"LOCK TABLE {table_name} IN SHARE MODE")
+    op.execute(
+        f"CREATE TABLE {new} (LIKE {table_name} INCLUDING DEFAULTS)"
+        + (f" PARTITION BY {partition_by}" if partition_by else "")
+    )
+    for statement in partitions:
+        op.execute(statement)
+    with _no_statement_timeout():
+        # LIKE keeps the column order
+        op.execute(f"INSERT INTO {new} SELECT * FROM {table_name}")
+    op.drop_table(table_name)
+    op.rename_table(new, table_name)
@@ -11,6 +11,8 @@ from alembic import op
 import sqlmodel
 import sqlalchemy as sa
 
+from app.alembic.helpers import users_fk
+
 
 # revision identifiers, used by Alembic.
 revision: str = '2c0516590c18'
@@ -32,7 +34,7 @@ def upgrade() -> None:
     sa.Column('description', sqlmodel.sql.sqltypes.AutoString(length=255), nullable=True),
     sa.Column('id', sa.Uuid(), nullable=False),
     sa.Column('owner_id', sa.Uuid(), nullable=False),
-    sa.ForeignKeyConstraint(['owner_id'], ['auth.users.id'], ondelete='CASCADE'),
+    *users_fk(),
     sa.PrimaryKeyConstraint('id')
     )
     # ### end Alembic commands ###
@@ -0,0 +1,44 @@
+"""partition item by owner_id
+
+needs a maintenance window: rebuild_table copies every item while writes to
+item wait, and from the swap on reads wait too, until the revision commits.
+stop the writers, or run it while item is still small.
+
+Revision ID: 3b9d7e1f0a64
+Revises: 8f3a1c2d4e5b
+Create Date: 2026-10-18 16:40:21.503127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+from app.alembic.helpers import on_shard, rebuild_table
+from app.core.config import settings
+from app.core.partitions import hash_partitions_ddl
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9d7e1f0a64'
+down_revision: Union[str, None] = '8f3a1c2d4e5b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def create_constraints(primary_key: list[str]) -> None:
+    op.create_primary_key('item_pkey', 'item', primary_key)
+    if not on_shard():
+        op.create_foreign_key('item_owner_id_fkey', 'item', 'users', ['owner_id'], ['id'], referent_schema='auth', ondelete='CASCADE')
+    op.create_index('ix_item_owner_id_external_key', 'item', ['owner_id', 'external_key'], unique=True)
+
+
+def upgrade() -> None:
+    # the primary key of a partitioned table must include the partition key
+    partitions = hash_partitions_ddl('item', settings.ITEM_PARTITIONS, parent='item_new')
+    rebuild_table('item', partition_by='HASH (owner_id)', partitions=partitions)
+    create_constraints(['id', 'owner_id'])
+
+
+def downgrade() -> None:
+    rebuild_table('item')
+    create_constraints(['id'])
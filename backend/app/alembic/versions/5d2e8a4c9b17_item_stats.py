@@ -0,0 +1,48 @@
+"""item_stats kept by triggers on item
+
+Revision ID: 5d2e8a4c9b17
+Revises: 3b9d7e1f0a64
+Create Date: 2026-10-18 18:05:47.220913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.alembic.helpers import users_fk
+
+from app.models.item_stats import ITEM_STATS_DDL
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2e8a4c9b17'
+down_revision: Union[str, None] = '3b9d7e1f0a64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('item_stats',
+    sa.Column('item_count', sa.BigInteger(), nullable=False),
+    sa.Column('last_activity_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('owner_id', sa.Uuid(), nullable=False),
+    *users_fk(),
+    sa.PrimaryKeyConstraint('owner_id')
+    )
+    # writes wait until the counts are in, so none is missed between the two
+    op.execute('LOCK TABLE item IN SHARE MODE')
+    for statement in ITEM_STATS_DDL:
+        op.execute(statement)
+    # items have no timestamps, last_activity_at starts as the recount time
+    op.execute(
+        'INSERT INTO item_stats (owner_id, item_count, last_activity_at) '
+        'SELECT owner_id, count(*), now() FROM item GROUP BY owner_id'
+    )
+
+
+def downgrade() -> None:
+    for event in ('insert', 'update', 'delete'):
+        op.execute(f'DROP TRIGGER item_stats_{event} ON item')
+    op.execute('DROP FUNCTION item_stats_apply()')
+    op.drop_table('item_stats')
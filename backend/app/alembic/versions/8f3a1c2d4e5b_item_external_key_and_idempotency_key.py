@@ -0,0 +1,45 @@
+"""item external_key and idempotency_key
+
+Revision ID: 8f3a1c2d4e5b
+Revises: 2c0516590c18
+Create Date: 2026-10-18 10:12:40.118512
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from sqlalchemy.dialects import postgresql
+
+from app.alembic.helpers import create_index_concurrently, drop_index_concurrently, users_fk
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f3a1c2d4e5b'
+down_revision: Union[str, None] = '2c0516590c18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # nullable without default, no table rewrite
+    op.add_column('item', sa.Column('external_key', sqlmodel.sql.sqltypes.AutoString(length=255), nullable=True))
+    op.create_table('idempotency_key',
+    sa.Column('owner_id', sa.Uuid(), nullable=False),
+    sa.Column('key', sqlmodel.sql.sqltypes.AutoString(length=255), nullable=False),
+    sa.Column('request_hash', sqlmodel.sql.sqltypes.AutoString(length=64), nullable=False),
+    sa.Column('status_code', sa.Integer(), nullable=False),
+    sa.Column('response', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    *users_fk(),
+    sa.PrimaryKeyConstraint('owner_id', 'key')
+    )
+    # NULL keys do not conflict, so existing items need no backfill
+    create_index_concurrently('ix_item_owner_id_external_key', 'item', ['owner_id', 'external_key'], unique=True)
+
+
+def downgrade() -> None:
+    drop_index_concurrently('ix_item_owner_id_external_key', 'item')
+    op.drop_table('idempotency_key')
+    op.drop_column('item', 'external_key')
@@ -1,13 +1,33 @@
 from typing import Annotated
 
-from fastapi import Depends
+from fastapi import Depends, HTTPException, Request
 from sqlmodel import Session
 
 from app.core.auth import get_current_user
-from app.core.db import get_db
+from app.core.config import settings
+from app.core.db import get_db, get_read_db
+from app.core.profiling import profiling_allowed
+from app.core.write_buffer import WriteBuffer, get_item_buffer
+from app.models.item import Item
 from app.schemas.auth import UserIn
 
 CurrentUser = Annotated[UserIn, Depends(get_current_user)]
 
 
 SessionDep = Annotated[Session, Depends(get_db)]
+# for read-only routes, served by a read replica when one is configured
+ReadSessionDep = Annotated[Session, Depends(get_read_db)]
+# group commit for item creates, None unless WRITE_BUFFER_ENABLED
+ItemBufferDep = Annotated[WriteBuffer[Item] | None, Depends(get_item_buffer)]
+
+
+async def check_profile_access(request: Request) -> None:
+    """signed X-Profile header or superuser token required"""
+    if not await profiling_allowed(request.headers):
+        raise HTTPException(status_code=403, detail="Not allowed to read profiles")
+
+
+def check_superuser(user: CurrentUser) -> None:
+    """token of FIRST_SUPERUSER required"""
+    if user.email != settings.FIRST_SUPERUSER:
+        raise HTTPException(status_code=403, detail="Superuser required")
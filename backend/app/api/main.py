@@ -1,7 +1,10 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 
-from app.api.routes import items, utils
+from app.api.routes import attachments, items, utils
+from app.core.deadline import route_deadline
 
-api_router = APIRouter()
+# before the other dependencies, so it also bounds auth and session checkout
+api_router = APIRouter(dependencies=[Depends(route_deadline)])
 api_router.include_router(items.router)
+api_router.include_router(attachments.router)
 api_router.include_router(utils.router)
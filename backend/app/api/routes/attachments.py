@@ -0,0 +1,109 @@
+from typing import Annotated
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+
+from app.api.deps import CurrentUser, SessionDep
+from app.core.config import settings
+from app.core.deadline import transfer_deadline
+from app.crud import item
+from app.schemas.attachment import Attachment, SignedURL
+from app.services.storage import Storage, get_storage, limit_size
+
+router = APIRouter(prefix="/items", tags=["attachments"])
+
+StorageDep = Annotated[Storage, Depends(get_storage)]
+
+
+def attachments_prefix(id: str, user: CurrentUser, session: SessionDep) -> str:
+    """storage folder of an item owned by the current user
+
+    the session is closed right away, so no pooled connection is held while
+    a transfer runs
+    """
+    try:
+        db_item = item.get(session, id=UUID(id), owner_id=UUID(user.id))
+    except ValueError:
+        db_item = None
+    finally:
+        session.close()
+    if db_item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    return f"{db_item.owner_id}/{db_item.id}"
+
+
+PrefixDep = Annotated[str, Depends(attachments_prefix)]
+
+
+def attachment_path(prefix: str, name: str) -> str:
+    if not name or name.startswith(".") or "/" in name:
+        raise HTTPException(status_code=400, detail="Invalid attachment name")
+    return f"{prefix}/{name}"
+
+
+@router.put("/{id}/attachments/{name}", dependencies=[Depends(transfer_deadline)])
+async def upload_attachment(
+    name: str, request: Request, prefix: PrefixDep, storage: StorageDep
+) -> Attachment:
+    """stream the request body to storage, at most one chunk is held in memory"""
+    content_length = request.headers.get("content-length")
+    size = int(content_length) if content_length else None
+    if size is not None and size > settings.STORAGE_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Attachment too large")
+    content_type = request.headers.get("content-type", "application/octet-stream")
+    uploaded = await storage.upload(
+        attachment_path(prefix, name),
+        limit_size(request.stream(), settings.STORAGE_MAX_UPLOAD_BYTES),
+        content_type=content_type,
+        size=size,
+    )
+    return Attachment(name=name, size=uploaded, content_type=content_type)
+
+
+@router.get("/{id}/attachments")
+async def list_attachments(prefix: PrefixDep, storage: StorageDep) -> list[Attachment]:
+    return await storage.list(prefix)
+
+
+@router.get("/{id}/attachments/{name}", dependencies=[Depends(transfer_deadline)])
+async def download_attachment(
+    name: str, request: Request, prefix: PrefixDep, storage: StorageDep
+) -> StreamingResponse:
+    """stream the attachment, a single `Range: bytes=start-end` is honoured"""
+    download = await storage.download(
+        attachment_path(prefix, name), range=request.headers.get("range")
+    )
+    return StreamingResponse(
+        download.chunks,
+        status_code=download.status_code,
+        headers=download.headers,
+        media_type=download.headers.get("content-type"),
+    )
+
+
+@router.delete("/{id}/attachments/{name}", status_code=204)
+async def delete_attachment(
+    name: str, prefix: PrefixDep, storage: StorageDep
+) -> Response:
+    await storage.delete(attachment_path(prefix, name))
+    return Response(status_code=204)
+
+
+@router.post("/{id}/attachments/{name}/upload-url")
+async def create_upload_url(
+    name: str, prefix: PrefixDep, storage: StorageDep
+) -> SignedURL:
+    """URL the client uploads to directly, bypassing the API"""
+    url = await storage.signed_upload_url(attachment_path(prefix, name))
+    return SignedURL(url=url)
+
+
+@router.get("/{id}/attachments/{name}/download-url")
+async def create_download_url(
+    name: str, prefix: PrefixDep, storage: StorageDep
+) -> SignedURL:
+    """URL the client downloads from directly, bypassing the API"""
+    expires_in = settings.STORAGE_SIGNED_URL_SECONDS
+    url = await storage.signed_download_url(attachment_path(prefix, name), expires_in)
+    return SignedURL(url=url, expires_in=expires_in)
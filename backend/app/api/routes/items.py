@@ -1,38 +1,161 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+from functools import partial
+from typing import Annotated
 from uuid import UUID
 
-from fastapi import APIRouter
+import anyio
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import JSONResponse
+from psycopg.errors import UniqueViolation
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
 
-from app.api.deps import CurrentUser, SessionDep
+from app import crud
+from app.api.deps import (
+    CurrentUser,
+    ItemBufferDep,
+    ReadSessionDep,
+    SessionDep,
+    check_superuser,
+)
+from app.core.write_buffer import WriteBuffer
 from app.crud import item
+from app.models.idempotency import IdempotencyKey
 from app.models.item import Item, ItemCreate, ItemUpdate
+from app.models.item_stats import ItemStatsPublic
 
+# routes doing only database work are sync, they run in the threadpool so the
+# event loop stays free to enforce deadlines and notice disconnects
 router = APIRouter(prefix="/items", tags=["items"])
 
 
+def replay(stored: IdempotencyKey, request_hash: str) -> JSONResponse:
+    if stored.request_hash != request_hash:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key was already used with a different request",
+        )
+    return JSONResponse(
+        stored.response,
+        status_code=stored.status_code,
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+@contextmanager
+def external_key_conflict(session: Session) -> Iterator[None]:
+    """409 when the owner already has an item with the `external_key`"""
+    try:
+        yield
+    except IntegrityError as e:
+        session.rollback()
+        if isinstance(e.orig, UniqueViolation):
+            raise HTTPException(
+                status_code=409, detail="An item with this external_key already exists"
+            ) from e
+        raise
+
+
 @router.post("/create-item")
-async def create_item(
-    item_in: ItemCreate, user: CurrentUser, session: SessionDep
+def create_item(
+    item_in: ItemCreate,
+    user: CurrentUser,
+    session: SessionDep,
+    buffer: ItemBufferDep,
+    idempotency_key: Annotated[str | None, Header(max_length=255)] = None,
 ) -> Item:
-    return item.create(session, owner_id=UUID(user.id), obj_in=item_in)
+    """with an Idempotency-Key header, retries replay the first response"""
+    with external_key_conflict(session):
+        return _create_item(item_in, UUID(user.id), session, buffer, idempotency_key)
+
+
+def _create_item(
+    item_in: ItemCreate,
+    owner_id: UUID,
+    session: Session,
+    buffer: WriteBuffer[Item] | None,
+    idempotency_key: str | None,
+) -> Item:
+    if idempotency_key is None:
+        if buffer is not None:
+            # the buffer lives on the event loop, this route in the threadpool
+            return anyio.from_thread.run(
+                partial(buffer.create, owner_id=owner_id, obj_in=item_in)
+            )
+        return item.create(session, owner_id=owner_id, obj_in=item_in)
+
+    body_hash = crud.request_hash(item_in)
+    stored = crud.idempotency_key.get(session, owner_id=owner_id, key=idempotency_key)
+    if stored is not None:
+        return replay(stored, body_hash)  # type: ignore[return-value]
 
+    # the item and its stored response are committed together
+    db_item = item.create(session, owner_id=owner_id, obj_in=item_in, commit=False)
+    if not crud.idempotency_key.create(
+        session,
+        owner_id=owner_id,
+        key=idempotency_key,
+        request_hash=body_hash,
+        status_code=200,
+        response=db_item.model_dump(mode="json"),
+    ):
+        # a concurrent retry stored its response first
+        session.rollback()
+        stored = crud.idempotency_key.get(
+            session, owner_id=owner_id, key=idempotency_key
+        )
+        if stored is None:
+            raise HTTPException(status_code=409, detail="Idempotency-Key conflict")
+        return replay(stored, body_hash)  # type: ignore[return-value]
+    session.expunge(db_item)
+    session.commit()
+    return db_item
 
+
+@router.put("/upsert-item")
+def upsert_item(item_in: ItemCreate, user: CurrentUser, session: SessionDep) -> Item:
+    """create or update the item with `external_key`, in a single statement"""
+    if item_in.external_key is None:
+        raise HTTPException(status_code=422, detail="external_key is required")
+    return item.upsert(session, owner_id=UUID(user.id), obj_in=item_in)
+
+
+# scoped to the user's items, which also prunes the other partitions of item
 @router.get("/get-item/{id}")
-async def read_item_by_id(id: str, session: SessionDep) -> Item | None:
-    return item.get(session, id=UUID(id))
+def read_item_by_id(id: str, user: CurrentUser, session: ReadSessionDep) -> Item | None:
+    return item.get(session, id=UUID(id), owner_id=UUID(user.id))
 
 
 @router.get("/get-items")
-async def read_items(
-    session: SessionDep, skip: int = 0, limit: int = 100
+def read_items(
+    user: CurrentUser, session: ReadSessionDep, skip: int = 0, limit: int = 100
+) -> list[Item]:
+    return list(item.get_multi(session, owner_id=UUID(user.id), skip=skip, limit=limit))
+
+
+@router.get("/get-all-items", dependencies=[Depends(check_superuser)])
+def read_all_items(
+    session: ReadSessionDep, skip: int = 0, limit: int = 100
 ) -> list[Item]:
+    """items of every owner by id, gathered from all shards when sharded"""
     return list(item.get_multi(session, skip=skip, limit=limit))
 
 
+@router.get("/stats")
+def read_item_stats(user: CurrentUser, session: ReadSessionDep) -> ItemStatsPublic:
+    """item count and last change of the user, kept up to date on every write"""
+    return crud.item_stats.get(session, owner_id=UUID(user.id))
+
+
 @router.put("/update-item/{id}")
-async def update_item(id: str, item_in: ItemUpdate, session: SessionDep) -> Item | None:
-    return item.update(session, id=UUID(id), obj_in=item_in)
+def update_item(
+    id: str, item_in: ItemUpdate, user: CurrentUser, session: SessionDep
+) -> Item | None:
+    with external_key_conflict(session):
+        return item.update(session, id=UUID(id), obj_in=item_in, owner_id=UUID(user.id))
 
 
 @router.delete("/delete/{id}")
-async def delete_item(id: str, session: SessionDep) -> Item | None:
-    return item.remove(session, id=UUID(id))
+def delete_item(id: str, user: CurrentUser, session: SessionDep) -> Item | None:
+    return item.remove(session, id=UUID(id), owner_id=UUID(user.id))
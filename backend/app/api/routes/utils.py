@@ -1,4 +1,11 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException, Response
+
+from app.api.deps import check_profile_access, check_superuser
+from app.core import warmup
+from app.core.profiling import get_profile, profiles
+from app.core.write_buffer import item_buffer
+from app.schemas.profile import ProfileSummary
+from app.schemas.write_buffer import WriteBufferStats
 
 router = APIRouter(prefix="/utils", tags=["utils"])
 
@@ -6,3 +13,44 @@ router = APIRouter(prefix="/utils", tags=["utils"])
 @router.get("/health-check/")
 async def health_check() -> bool:
     return True
+
+
+@router.get("/ready")
+async def readiness() -> bool:
+    """503 until the startup warm-up finished"""
+    if not warmup.state.ready:
+        raise HTTPException(status_code=503, detail="Warming up")
+    return True
+
+
+@router.get("/write-buffer", dependencies=[Depends(check_superuser)])
+async def write_buffer_stats() -> WriteBufferStats:
+    """batch sizes of the item write buffer"""
+    stats = item_buffer.stats
+    return WriteBufferStats(
+        running=item_buffer.running,
+        batches=stats.batches,
+        rows=stats.rows,
+        retried=stats.retried,
+        mean_batch_size=stats.mean,
+        batch_sizes=dict(sorted(stats.sizes.items())),
+    )
+
+
+@router.get("/profile", dependencies=[Depends(check_profile_access)])
+async def list_profiles() -> list[ProfileSummary]:
+    """recent request profiles, newest first"""
+    return [summary for summary, _ in reversed(profiles)]
+
+
+@router.get("/profile/{id}", dependencies=[Depends(check_profile_access)])
+async def read_profile(id: str) -> Response:
+    """speedscope JSON of a profile, open it at https://www.speedscope.app"""
+    speedscope = get_profile(id)
+    if speedscope is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return Response(
+        content=speedscope,
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="{id}.speedscope.json"'},
+    )
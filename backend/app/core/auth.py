@@ -1,27 +1,86 @@
+import base64
+import hashlib
+import json
 import logging
-from typing import Annotated
+import math
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from functools import partial
+from typing import Annotated, TypeVar
 
-from fastapi import Depends, HTTPException
+import anyio
+import httpx
+from fastapi import Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordBearer
-from supabase import AsyncClientOptions
+from gotrue.errors import AuthApiError, AuthRetryableError  # type: ignore
+from supabase import ASupabaseAuthClient, AsyncClientOptions
 from supabase._async.client import AsyncClient, create_client
+from tenacity import (
+    AsyncRetrying,
+    RetryCallState,
+    retry_if_exception,
+    wait_random_exponential,
+)
 
+from app.core.breaker import CircuitBreaker, CircuitOpenError, RetryBudget
 from app.core.config import settings
+from app.core.deadline import fail_at_deadline
+from app.core.log import set_user_id
+from app.core.tracing import TracingTransport, tracer
 from app.schemas.auth import UserIn
 
+T = TypeVar("T")
+
+_super_client: AsyncClient | None = None
+_auth_http_client: httpx.AsyncClient | None = None
+
+
+def get_auth_http_client() -> httpx.AsyncClient:
+    """traced client of the super client's auth requests, warmed up at startup"""
+    global _auth_http_client
+    if _auth_http_client is None or _auth_http_client.is_closed:
+        _auth_http_client = httpx.AsyncClient(
+            transport=TracingTransport(httpx.AsyncHTTPTransport(http2=True)),
+            follow_redirects=True,
+        )
+    return _auth_http_client
+
 
 async def get_super_client() -> AsyncClient:
-    """for validation access_token init at life span event"""
-    super_client = await create_client(
-        settings.SUPABASE_URL,
-        settings.SUPABASE_KEY,
-        options=AsyncClientOptions(
-            postgrest_client_timeout=10, storage_client_timeout=10
-        ),
-    )
-    if not super_client:
-        raise HTTPException(status_code=500, detail="Super client not initialized")
-    return super_client
+    """service role client, created once and shared by all requests"""
+    global _super_client
+    if _super_client is None:
+        super_client = await create_client(
+            settings.SUPABASE_URL,
+            settings.SUPABASE_KEY,
+            options=AsyncClientOptions(
+                postgrest_client_timeout=10, storage_client_timeout=10
+            ),
+        )
+        if not super_client:
+            raise HTTPException(status_code=500, detail="Super client not initialized")
+        # the options take no http client, so auth gets one of ours that is traced
+        await super_client.auth.close()
+        options = super_client.options
+        super_client.auth = ASupabaseAuthClient(
+            url=super_client.auth_url,
+            headers=options.headers,
+            auto_refresh_token=options.auto_refresh_token,
+            persist_session=options.persist_session,
+            storage=options.storage,
+            flow_type=options.flow_type,
+            http_client=get_auth_http_client(),
+        )
+        _super_client = super_client
+    return _super_client
+
+
+async def close_super_client() -> None:
+    global _super_client
+    if _super_client is not None:
+        await _super_client.auth.close()
+        _super_client = None
 
 
 SuperClient = Annotated[AsyncClient, Depends(get_super_client)]
@@ -34,10 +93,161 @@ reusable_oauth2 = OAuth2PasswordBearer(
 TokenDep = Annotated[str, Depends(reusable_oauth2)]
 
 
-async def get_current_user(token: TokenDep, super_client: SuperClient) -> UserIn:
-    """get current user from token and  validate same time"""
-    user_rsp = await super_client.auth.get_user(jwt=token)
+def is_outage(e: BaseException) -> bool:
+    """Supabase Auth unreachable, too slow or failing, unlike a rejected token"""
+    if isinstance(e, AuthApiError):
+        return bool(e.status >= 500 or e.status == 429)
+    return isinstance(e, AuthRetryableError | TimeoutError)
+
+
+auth_breaker = CircuitBreaker(
+    "supabase-auth",
+    failure_rate=settings.AUTH_BREAKER_FAILURE_RATE,
+    min_calls=settings.AUTH_BREAKER_MIN_CALLS,
+    window=settings.AUTH_BREAKER_WINDOW,
+    open_seconds=settings.AUTH_BREAKER_OPEN_SECONDS,
+    half_open_probes=settings.AUTH_BREAKER_HALF_OPEN_PROBES,
+    is_failure=is_outage,
+)
+auth_retry_budget = RetryBudget(ratio=settings.AUTH_RETRY_BUDGET_RATIO)
+
+
+def stop_retrying(retry_state: RetryCallState) -> bool:
+    """after AUTH_RETRY_ATTEMPTS, or earlier when the retry budget is spent"""
+    return (
+        retry_state.attempt_number >= settings.AUTH_RETRY_ATTEMPTS
+        or not auth_retry_budget.withdraw()
+    )
+
+
+async def call_auth(func: Callable[[], Awaitable[T]]) -> T:
+    """call Supabase Auth through the breaker, outages are retried with jitter
+
+    every attempt is bounded by AUTH_ATTEMPT_TIMEOUT_SECONDS instead of the
+    client's 10s, an open breaker raises CircuitOpenError without a call
+    """
+
+    async def attempt() -> T:
+        with anyio.fail_after(settings.AUTH_ATTEMPT_TIMEOUT_SECONDS):
+            return await func()
+
+    auth_retry_budget.deposit()
+    retrying = AsyncRetrying(
+        retry=retry_if_exception(is_outage),
+        stop=stop_retrying,
+        wait=wait_random_exponential(multiplier=0.05, max=1),
+        reraise=True,
+    )
+    return await retrying(auth_breaker.call, attempt)
+
+
+def token_expiry(token: str) -> float | None:
+    """`exp` of a JWT as a unix time, without checking its signature"""
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(
+            base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        )
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class GraceCache:
+    """users of recently validated tokens, by a hash of the token
+
+    a token is served until AUTH_GRACE_SECONDS after its validation, but never
+    after its own `exp`, tokens without one are not kept
+    """
+
+    def __init__(
+        self,
+        seconds: float,
+        max_tokens: int,
+        clock: Callable[[], float] = time.monotonic,
+        wall_clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.seconds = seconds
+        self.max_tokens = max_tokens
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.users: OrderedDict[bytes, tuple[float, float, UserIn]] = OrderedDict()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def put(self, token: str, user: UserIn) -> None:
+        expires_at = token_expiry(token)
+        if self.seconds <= 0 or expires_at is None:
+            return
+        key = self._key(token)
+        self.users[key] = (self.clock(), expires_at, user)
+        self.users.move_to_end(key)
+        while len(self.users) > self.max_tokens:
+            self.users.popitem(last=False)
+
+    def get(self, token: str) -> UserIn | None:
+        key = self._key(token)
+        validated = self.users.get(key)
+        if validated is None:
+            return None
+        validated_at, expires_at, user = validated
+        if (
+            self.clock() - validated_at > self.seconds
+            or self.wall_clock() >= expires_at
+        ):
+            del self.users[key]
+            return None
+        return user
+
+
+grace_cache = GraceCache(settings.AUTH_GRACE_SECONDS, settings.AUTH_GRACE_MAX_TOKENS)
+
+
+def auth_unavailable() -> HTTPException:
+    retry_after = max(1, math.ceil(auth_breaker.retry_after()))
+    return HTTPException(
+        status_code=503,
+        detail="Authentication unavailable",
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+async def validate_token(
+    token: str, super_client: AsyncClient, *, grace: bool = False
+) -> UserIn:
+    """the user of `token`, validated by Supabase Auth
+
+    while Auth is unavailable it is a 503, or with `grace` the user of the
+    token if it was validated within AUTH_GRACE_SECONDS
+    """
+    with tracer.start_as_current_span("get_current_user"), fail_at_deadline():
+        try:
+            user_rsp = await call_auth(partial(super_client.auth.get_user, jwt=token))
+        except Exception as e:
+            if not (isinstance(e, CircuitOpenError) or is_outage(e)):
+                raise
+            user = grace_cache.get(token) if grace else None
+            if user is None:
+                logging.warning("Supabase Auth unavailable: %r", e)
+                raise auth_unavailable() from e
+            set_user_id(user.id)
+            return user
     if not user_rsp:
         logging.error("User not found")
         raise HTTPException(status_code=404, detail="User not found")
-    return UserIn(**user_rsp.user.model_dump(), access_token=token)
+    set_user_id(user_rsp.user.id)
+    user = UserIn(**user_rsp.user.model_dump(), access_token=token)
+    grace_cache.put(token, user)
+    return user
+
+
+async def get_current_user(
+    request: Request, token: TokenDep, super_client: SuperClient
+) -> UserIn:
+    """get current user from token and  validate same time"""
+    # reads may be served during short auth outages, writes are not
+    return await validate_token(
+        token, super_client, grace=request.method in ("GET", "HEAD")
+    )
@@ -0,0 +1,133 @@
+"""circuit breaker and retry budget for calls to a remote service
+
+the breaker opens when the failure rate of the last `window` calls reaches
+`failure_rate`, after at least `min_calls` of them. while open, calls fail at
+once with `CircuitOpenError` instead of waiting on a service that is down.
+after `open_seconds` it is half-open: `half_open_probes` calls at a time are
+let through, a success closes it and a failure opens it again.
+
+the retry budget lets retries add at most `ratio` of the calls on top, so
+retries can't multiply the load on a service that is struggling already.
+both are used on the event loop only and need no locks.
+"""
+
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from enum import Enum
+from typing import TypeVar
+
+T = TypeVar("T")
+
+
+class State(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """the breaker is open, the call was not made"""
+
+    def __init__(self, name: str, retry_after: float) -> None:
+        super().__init__(f"{name} circuit is open, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        *,
+        failure_rate: float = 0.5,
+        min_calls: int = 20,
+        window: int = 100,
+        open_seconds: float = 10,
+        half_open_probes: int = 1,
+        is_failure: Callable[[BaseException], bool] = lambda _: True,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.is_failure = is_failure
+        self.clock = clock
+        # True for a failed call
+        self.outcomes: deque[bool] = deque(maxlen=window)
+        self.opened_at: float | None = None
+        self.probes = 0
+
+    @property
+    def state(self) -> State:
+        if self.opened_at is None:
+            return State.CLOSED
+        if self.clock() - self.opened_at < self.open_seconds:
+            return State.OPEN
+        return State.HALF_OPEN
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.open_seconds - self.clock())
+
+    def _open(self) -> None:
+        self.opened_at = self.clock()
+        self.outcomes.clear()
+
+    def _record(self, failed: bool, probe: bool) -> None:
+        if probe:
+            if failed:
+                self._open()
+            else:
+                self.opened_at = None
+            return
+        self.outcomes.append(failed)
+        calls = len(self.outcomes)
+        if (
+            failed
+            and self.opened_at is None
+            and calls >= self.min_calls
+            and sum(self.outcomes) / calls >= self.failure_rate
+        ):
+            self._open()
+
+    async def call(self, func: Callable[[], Awaitable[T]]) -> T:
+        """await `func()`, or raise CircuitOpenError while the breaker is open"""
+        state = self.state
+        probe = state is State.HALF_OPEN
+        if state is State.OPEN or (probe and self.probes >= self.half_open_probes):
+            raise CircuitOpenError(self.name, self.retry_after())
+        if probe:
+            self.probes += 1
+        try:
+            result = await func()
+        except Exception as e:
+            # errors of the caller, e.g. a rejected token, count as answers
+            self._record(self.is_failure(e), probe)
+            raise
+        else:
+            self._record(False, probe)
+            return result
+        finally:
+            if probe:
+                self.probes -= 1
+
+
+class RetryBudget:
+    """every call deposits `ratio` retries, up to `max_tokens`, each retry takes one"""
+
+    def __init__(self, *, ratio: float = 0.1, max_tokens: float = 10) -> None:
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
@@ -1,3 +1,5 @@
+import json
+import re
 import secrets
 import warnings
 from typing import Annotated, Any, Literal, Self
@@ -10,7 +12,7 @@ from pydantic import (
     model_validator,
 )
 from pydantic_core import MultiHostUrl
-from pydantic_settings import BaseSettings, SettingsConfigDict
+from pydantic_settings import BaseSettings, NoDecode, SettingsConfigDict
 
 
 def parse_cors(v: Any) -> list[str] | str:
@@ -21,6 +23,48 @@ def parse_cors(v: Any) -> list[str] | str:
     raise ValueError(v)
 
 
+_MULTI_HOST_DSN = re.compile(
+    r"^(?P<scheme>[\w+]+)://(?:(?P<userinfo>[^@/]*)@)?"
+    r"(?P<hosts>[^/?]*,[^/?]*)(?P<path>/[^?]*)?(?:\?(?P<query>.*))?$"
+)
+
+
+def parse_dsn_list(v: Any) -> list[str]:
+    """JSON list or whitespace separated DSNs, see `normalize_dsn`
+
+    not split on commas, which separate the hosts of a multi-host DSN, e.g.
+    postgresql://user@replica1:5432,replica2:5432/app
+    """
+    if isinstance(v, str):
+        v = json.loads(v) if v.lstrip().startswith("[") else v.split()
+    if isinstance(v, list) and all(isinstance(dsn, str) for dsn in v):
+        return [normalize_dsn(dsn) for dsn in v]
+    raise ValueError(v)
+
+
+def normalize_dsn(dsn: str) -> str:
+    """a DSN SQLAlchemy can build an engine from
+
+    postgresql:// uses psycopg 3 like the primary, and the hosts of a multi-host
+    DSN move to libpq's `?host=replica1:5432&host=replica2:5432` form, which
+    SQLAlchemy can parse
+    """
+    dsn = dsn.strip()
+    if dsn.startswith("postgresql://"):
+        dsn = f"postgresql+psycopg://{dsn.removeprefix('postgresql://')}"
+    match = _MULTI_HOST_DSN.match(dsn)
+    if match is None:
+        return dsn
+    userinfo = f"{match['userinfo']}@" if match["userinfo"] is not None else ""
+    query = [f"host={host}" for host in match["hosts"].split(",")]
+    if match["query"]:
+        query.append(match["query"])
+    return f"{match['scheme']}://{userinfo}{match['path'] or '/'}?{'&'.join(query)}"
+
+
+DSNList = Annotated[list[str], NoDecode, BeforeValidator(parse_dsn_list)]
+
+
 class Settings(BaseSettings):
     """auto load config from .env and validate settings"""
 
@@ -75,6 +119,134 @@ class Settings(BaseSettings):
             path=self.POSTGRES_DB,
         )
 
+    ## Migrations
+    # fail fast instead of queueing traffic behind a migration waiting for a lock
+    MIGRATION_LOCK_TIMEOUT_MS: int = 3000
+    MIGRATION_STATEMENT_TIMEOUT_MS: int = 60_000
+
+    ## Read replicas
+    # DSNs as a JSON list or separated by whitespace, read-only routes use the
+    # primary when empty
+    POSTGRES_REPLICA_URIS: DSNList = []
+    REPLICA_SELECTION: Literal["round_robin", "least_loaded"] = "round_robin"
+    # replicas further behind the primary are skipped until they catch up
+    REPLICA_MAX_LAG_SECONDS: float = 10
+    # how often replica health and lag are re-checked
+    REPLICA_CHECK_INTERVAL_SECONDS: float = 5
+    # keep a client's reads on the primary this long after it commits a write
+    READ_YOUR_WRITES_SECONDS: float = 5
+    # read-only connections to the primary, next to the read-write pool
+    READ_POOL_SIZE: int = 5
+
+    ## Sharding
+    # DSNs of the databases items are spread over by owner_id, like
+    # POSTGRES_REPLICA_URIS, items stay on the primary when empty
+    POSTGRES_SHARD_URIS: DSNList = []
+    # points per shard on the hash ring, more spread owners more evenly
+    SHARD_VIRTUAL_NODES: int = 64
+
+    ## Partitioning
+    # hash partitions of the item table by owner_id, fixed when the table is
+    # created, changing it later needs a migration that rebuilds the table
+    ITEM_PARTITIONS: int = 16
+
+    ## Query instrumentation
+    # statements slower than this are logged with their normalized SQL
+    SLOW_QUERY_THRESHOLD_MS: float = 200
+    # also log `EXPLAIN (ANALYZE, BUFFERS)` of slow SELECTs, which runs them twice
+    SLOW_QUERY_EXPLAIN: bool = False
+    # warn when a request runs the same SELECT this many times
+    N_PLUS_ONE_THRESHOLD: int = 10
+
+    ## Profiling
+    # sample requests sent with a signed X-Profile header or by the superuser
+    PROFILING_ENABLED: bool = True
+    PROFILE_INTERVAL_SECONDS: float = 0.001
+    # profiles kept in memory for /utils/profile
+    PROFILE_HISTORY: int = 20
+
+    ## Attachments
+    # "local" keeps objects under STORAGE_LOCAL_PATH instead of Supabase Storage
+    STORAGE_BACKEND: Literal["supabase", "local"] = "supabase"
+    STORAGE_BUCKET: str = "attachments"
+    STORAGE_LOCAL_PATH: str = "storage"
+    STORAGE_TIMEOUT_SECONDS: float = 30
+    # memory held per transfer, and the part size of resumable uploads
+    STORAGE_CHUNK_SIZE: int = 6 * 1024 * 1024
+    # uploads with a larger Content-Length use the resumable endpoint
+    STORAGE_RESUMABLE_THRESHOLD: int = 6 * 1024 * 1024
+    STORAGE_MAX_UPLOAD_BYTES: int = 1024 * 1024 * 1024
+    STORAGE_SIGNED_URL_SECONDS: int = 3600
+
+    ## Write buffer
+    # batch creates of concurrent requests into one INSERT and commit
+    WRITE_BUFFER_ENABLED: bool = False
+    WRITE_BUFFER_MAX_BATCH_SIZE: int = 100
+    # longest a create waits for other rows to join its batch
+    WRITE_BUFFER_MAX_WAIT_MS: float = 5
+
+    ## Logging
+    LOG_LEVEL: Literal["DEBUG", "INFO", "WARNING", "ERROR"] = "INFO"
+    LOG_FORMAT: Literal["json", "text"] = "json"
+    # share of successful requests with an access log record
+    ACCESS_LOG_SAMPLE_RATE: float = 1.0
+    # requests at least this slow are always logged
+    ACCESS_LOG_SLOW_MS: float = 500
+
+    ## Tracing
+    # "memory" keeps spans in app.core.tracing.memory_exporter, "file" appends
+    # them as JSON lines to TRACE_FILE_PATH
+    TRACE_EXPORTER: Literal["none", "console", "file", "memory"] = "none"
+    # share of new traces recorded, requests with a sampled traceparent always are
+    TRACE_SAMPLE_RATE: float = 1.0
+    TRACE_FILE_PATH: str = "traces.jsonl"
+
+    ## Deadlines
+    # longest a request may run, also the statement_timeout of pooled connections
+    REQUEST_TIMEOUT_SECONDS: float = 30
+    # tighter deadlines by operation id, e.g. {"items-read_items": 5}, applied to
+    # the route's transactions with `SET LOCAL statement_timeout`
+    ROUTE_TIMEOUT_SECONDS: dict[str, float] = {}
+    # uploads and downloads of attachments, a response that started streaming
+    # is never cut off by a deadline
+    TRANSFER_TIMEOUT_SECONDS: float = 3600
+    # waiting longer than this for a pooled connection returns a 503
+    DB_POOL_TIMEOUT_SECONDS: float = 5
+
+    ## Warm-up
+    # pooled connections opened at startup, at most the pool size
+    WARMUP_POOL_CONNECTIONS: int = 5
+    WARMUP_STEP_TIMEOUT_SECONDS: float = 10
+
+    ## Item stats
+    # how often the per-owner item stats are recounted, 0 disables it
+    ITEM_STATS_RECONCILE_INTERVAL_SECONDS: float = 3600
+    # owners recounted per transaction
+    ITEM_STATS_RECONCILE_BATCH_SIZE: int = 1000
+
+    ## Auth resilience
+    # the auth breaker opens at this share of failed Supabase Auth calls among
+    # the last AUTH_BREAKER_WINDOW, once there were AUTH_BREAKER_MIN_CALLS
+    AUTH_BREAKER_FAILURE_RATE: float = 0.5
+    AUTH_BREAKER_MIN_CALLS: int = 20
+    AUTH_BREAKER_WINDOW: int = 100
+    # requests get a 503 this long, then single probe calls are let through
+    AUTH_BREAKER_OPEN_SECONDS: float = 10
+    AUTH_BREAKER_HALF_OPEN_PROBES: int = 1
+    # an attempt taking longer counts as failed
+    AUTH_ATTEMPT_TIMEOUT_SECONDS: float = 3
+    AUTH_RETRY_ATTEMPTS: int = 3
+    # retries on top of the calls, at most this share of them
+    AUTH_RETRY_BUDGET_RATIO: float = 0.1
+    # GET and HEAD requests with a token validated this recently are served
+    # while Supabase Auth is unavailable, 0 disables it
+    AUTH_GRACE_SECONDS: float = 0
+    AUTH_GRACE_MAX_TOKENS: int = 10_000
+
+    ## Idempotency
+    # stored responses for Idempotency-Key headers are replayed this long
+    IDEMPOTENCY_KEY_TTL_HOURS: int = 24
+
     FIRST_SUPERUSER: str
     FIRST_SUPERUSER_PASSWORD: str
 
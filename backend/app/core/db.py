@@ -1,23 +1,136 @@
 from collections.abc import Generator
+from typing import Any
 
+from fastapi import Request
+from sqlalchemy import Connection, Engine, event
+from sqlalchemy.exc import DBAPIError
 from sqlmodel import Session, create_engine, select
 from supabase import create_client
 
 from app.core.config import settings
+from app.core.deadline import current_deadline, statement_timeout_options
+from app.core.instrumentation import instrument_engine
+from app.core.replica import ReplicaRouter, client_key
+from app.core.shard import ShardMap
+from app.core.tracing import TracedQueuePool
 from app.models import User
 
 # make sure all SQLModel models are imported (app.models) before initializing DB
 # otherwise, SQLModel might fail to initialize relationships properly
 # for more details: https://github.com/fastapi/full-stack-fastapi-template/issues/28
 
-engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI))
+engine = create_engine(
+    str(settings.SQLALCHEMY_DATABASE_URI),
+    poolclass=TracedQueuePool,
+    pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+    connect_args={"options": statement_timeout_options()},
+)
+instrument_engine(engine)
 
+# for ReadSessionDep, autocommit saves the BEGIN and ROLLBACK round trips and
+# the server rejects writes, in a pool of its own as both are per connection
+read_engine = create_engine(
+    str(settings.SQLALCHEMY_DATABASE_URI),
+    poolclass=TracedQueuePool,
+    pool_size=settings.READ_POOL_SIZE,
+    pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+    isolation_level="AUTOCOMMIT",
+    connect_args={
+        "options": f"{statement_timeout_options()} -c default_transaction_read_only=on"
+    },
+)
+instrument_engine(read_engine)
 
-def get_db() -> Generator[Session, None]:
-    with Session(engine) as session:
+replicas = ReplicaRouter(
+    settings.POSTGRES_REPLICA_URIS,
+    selection=settings.REPLICA_SELECTION,
+    max_lag=settings.REPLICA_MAX_LAG_SECONDS,
+    check_interval=settings.REPLICA_CHECK_INTERVAL_SECONDS,
+    pin_seconds=settings.READ_YOUR_WRITES_SECONDS,
+)
+
+shards = ShardMap(
+    settings.POSTGRES_SHARD_URIS, virtual_nodes=settings.SHARD_VIRTUAL_NODES
+)
+
+# session.info key of the client a primary session writes for
+CLIENT_KEY = "client_key"
+
+
+@event.listens_for(Session, "after_commit")
+def _pin_writer(session: Session) -> None:
+    """keep a client that just wrote on the primary so it reads its own writes"""
+    key = session.info.get(CLIENT_KEY)
+    if key is not None:
+        replicas.pin(key)
+
+
+@event.listens_for(Session, "after_begin")
+def _apply_deadline(session: Session, transaction: Any, connection: Connection) -> None:
+    """let the request deadline cancel this transaction's queries"""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return
+    driver_connection: Any = connection.connection.driver_connection
+    # a sharded session has a connection per shard it touched
+    deadline.connections[id(session), id(driver_connection)] = driver_connection
+    # the connection's own statement_timeout is REQUEST_TIMEOUT_SECONDS already,
+    # without a transaction to scope SET LOCAL the cancel at the deadline is left
+    if (
+        deadline.timeout < settings.REQUEST_TIMEOUT_SECONDS
+        and not driver_connection.autocommit
+    ):
+        timeout_ms = max(int(deadline.remaining() * 1000), 1)
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {timeout_ms}")
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _release_deadline(session: Session, transaction: Any) -> None:
+    deadline = current_deadline.get()
+    if deadline is not None and transaction.parent is None:
+        for key in [key for key in deadline.connections if key[0] == id(session)]:
+            del deadline.connections[key]
+
+
+def get_db(request: Request) -> Generator[Session, None]:
+    """read-write session, spanning the shards when items are sharded"""
+    with shards.session() if shards else Session(engine) as session:
+        if replicas:
+            session.info[CLIENT_KEY] = client_key(request)
         yield session
 
 
+def read_session(bind: Engine) -> Session:
+    """session without autoflush or expiry, for autocommit read-only engines"""
+    return Session(bind, autoflush=False, expire_on_commit=False)
+
+
+def get_read_db(request: Request) -> Generator[Session, None]:
+    """read-only session, served by a replica when one is usable
+
+    a connection is only checked out by the first query, with shards it is a
+    sharded session over their primaries
+    """
+    if shards:
+        with shards.session(autoflush=False, expire_on_commit=False) as session:
+            yield session
+        return
+
+    replica = replicas.choose(client_key(request)) if replicas else None
+    if replica is None:
+        with read_session(read_engine) as session:
+            yield session
+        return
+
+    with read_session(replica.engine) as session:
+        try:
+            yield session
+        except DBAPIError as e:
+            if e.connection_invalidated:
+                replica.eject(e)
+            raise
+
+
 def init_db(session: Session) -> None:
     # Tables should be created with Alembic migrations
     # But if you don't want to use migrations, create
@@ -0,0 +1,239 @@
+"""per-request deadlines
+
+`DeadlineMiddleware` gives every request REQUEST_TIMEOUT_SECONDS, routes can
+tighten it through ROUTE_TIMEOUT_SECONDS. when the deadline passes or the
+client disconnects, the request is cancelled together with the Postgres
+queries it is running, so a stuck query does not hold a pooled connection.
+"""
+
+import asyncio
+import contextlib
+import logging
+import time
+from collections.abc import Generator
+from contextvars import ContextVar
+from typing import Any
+
+import anyio
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+from psycopg.errors import QueryCanceled
+from sqlalchemy.exc import OperationalError
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Deadline:
+    """when the request must be done, and the connections running its queries"""
+
+    def __init__(self, timeout: float) -> None:
+        self.timeout = timeout
+        self.at = time.monotonic() + timeout
+        # (session id, connection id) -> psycopg connection inside a
+        # transaction of the request
+        self.connections: dict[tuple[int, int], Any] = {}
+        self.cancelled = False
+
+    def tighten(self, timeout: float) -> None:
+        if timeout < self.timeout:
+            self.at -= self.timeout - timeout
+            self.timeout = timeout
+
+    def extend(self, timeout: float) -> None:
+        if timeout > self.timeout:
+            self.at += timeout - self.timeout
+            self.timeout = timeout
+
+    def remaining(self) -> float:
+        return self.at - time.monotonic()
+
+    def cancel(self) -> None:
+        """cancel the queries running on the request's connections, from any thread"""
+        self.cancelled = True
+        for connection in list(self.connections.values()):
+            try:
+                connection.cancel_safe()
+            except Exception as e:
+                logger.debug("cancelling query failed: %s", e)
+
+
+current_deadline: ContextVar[Deadline | None] = ContextVar(
+    "current_deadline", default=None
+)
+
+
+def statement_timeout_options() -> str:
+    """libpq options bounding every statement by REQUEST_TIMEOUT_SECONDS"""
+    return f"-c statement_timeout={int(settings.REQUEST_TIMEOUT_SECONDS * 1000)}"
+
+
+def route_deadline(request: Request) -> None:
+    """tighten the deadline to the route's ROUTE_TIMEOUT_SECONDS entry"""
+    deadline = current_deadline.get()
+    route = request.scope.get("route")
+    timeout = settings.ROUTE_TIMEOUT_SECONDS.get(getattr(route, "unique_id", ""))
+    if deadline is not None and timeout is not None:
+        deadline.tighten(timeout)
+
+
+def transfer_deadline() -> None:
+    """give routes streaming a request or response body TRANSFER_TIMEOUT_SECONDS"""
+    deadline = current_deadline.get()
+    if deadline is not None:
+        deadline.extend(settings.TRANSFER_TIMEOUT_SECONDS)
+
+
+@contextlib.contextmanager
+def fail_at_deadline() -> Generator[None, None, None]:
+    """bound an awaited call by the request deadline, 504 when it passes"""
+    deadline = current_deadline.get()
+    if deadline is None:
+        yield
+        return
+    try:
+        with anyio.fail_after(max(deadline.remaining(), 0)):
+            yield
+    except TimeoutError as e:
+        raise HTTPException(status_code=504, detail="Request timed out") from e
+
+
+class DeadlineMiddleware:
+    """cancel requests past their deadline or whose client went away
+
+    requests that timed out before responding get a 504, once the response
+    started only a disconnect stops it
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        deadline = Deadline(settings.REQUEST_TIMEOUT_SECONDS)
+        token = current_deadline.set(deadline)
+        # one body message at a time, the next is only read once the app took
+        # it, so uploads keep the server's backpressure
+        body: asyncio.Queue[Message] = asyncio.Queue(maxsize=1)
+        disconnected = asyncio.Event()
+        started = finished = False
+        # an anyio scope rather than Task.cancel, so a route blocked in the
+        # threadpool is waited for and its connection is back in the pool
+        cancel_scope = anyio.CancelScope()
+
+        async def pump() -> None:
+            """pass the body on, once it is all read wait for the disconnect"""
+            more_body = True
+            while more_body:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    return
+                await body.put(message)
+                more_body = message.get("more_body", False)
+            await receive()
+            disconnected.set()
+
+        async def receive_queued() -> Message:
+            if body.empty() and disconnected.is_set():
+                return {"type": "http.disconnect"}
+            get = asyncio.ensure_future(body.get())
+            gone = asyncio.ensure_future(disconnected.wait())
+            await asyncio.wait({get, gone}, return_when=asyncio.FIRST_COMPLETED)
+            # a cancelled get leaves its message in the queue
+            gone.cancel()
+            if get.done():
+                return get.result()
+            get.cancel()
+            return {"type": "http.disconnect"}
+
+        async def send_tracked(message: Message) -> None:
+            nonlocal started, finished
+            if cancel_scope.cancel_called:
+                # nothing from a cancelled request goes out
+                await anyio.lowlevel.checkpoint()
+            if message["type"] == "http.response.start":
+                started = True
+            elif message["type"] == "http.response.body":
+                finished = not message.get("more_body", False)
+            await send(message)
+
+        async def call_app() -> None:
+            with cancel_scope:
+                await self.app(scope, receive_queued, send_tracked)
+
+        app = asyncio.create_task(call_app())
+        reader = asyncio.create_task(pump())
+        gone = asyncio.create_task(disconnected.wait())
+        try:
+            reason = None
+            waiting: set[asyncio.Task[Any]] = {app, gone}
+            while not app.done():
+                await asyncio.wait(
+                    waiting,
+                    # a started response is streamed to the end
+                    timeout=None if started else max(deadline.remaining(), 0),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if app.done():
+                    break
+                if gone.done():
+                    if not finished:
+                        reason = "client disconnected"
+                        break
+                    # background tasks after the response are left alone
+                    waiting.discard(gone)
+                if not started and deadline.remaining() <= 0:
+                    reason = "deadline exceeded"
+                    break
+            if reason:
+                logger.warning(
+                    "cancelling %s %s after %.1fs: %s",
+                    scope["method"],
+                    scope["path"],
+                    deadline.timeout - deadline.remaining(),
+                    reason,
+                )
+                deadline.cancel()
+                cancel_scope.cancel()
+                await app
+                if reason == "deadline exceeded" and not started:
+                    await send_timeout(send)
+                return
+            await app
+        finally:
+            for task in (app, reader, gone):
+                task.cancel()
+            current_deadline.reset(token)
+
+
+async def send_timeout(send: Send) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 504,
+            "headers": [(b"content-type", b"application/json")],
+        }
+    )
+    await send(
+        {"type": "http.response.body", "body": b'{"detail":"Request timed out"}'}
+    )
+
+
+async def query_canceled_handler(request: Request, exc: Exception) -> JSONResponse:
+    """504 for statements stopped by statement_timeout or a cancel"""
+    if isinstance(exc, OperationalError) and isinstance(exc.orig, QueryCanceled):
+        return JSONResponse({"detail": "Request timed out"}, status_code=504)
+    raise exc
+
+
+async def pool_timeout_handler(request: Request, exc: Exception) -> JSONResponse:
+    """503 when no pooled connection was free within DB_POOL_TIMEOUT_SECONDS"""
+    return JSONResponse(
+        {"detail": "Database busy"}, status_code=503, headers={"Retry-After": "1"}
+    )
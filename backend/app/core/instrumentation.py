@@ -0,0 +1,174 @@
+import logging
+import re
+import time
+from collections import Counter
+from collections.abc import Generator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any
+
+from sqlalchemy import Connection, Engine, event
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.tracing import trace_engine
+
+logger = logging.getLogger(__name__)
+
+_START_TIMES = "query_start_times"
+
+_WHITESPACE = re.compile(r"\s+")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PARAMS = re.compile(r"%\(\w+\)s|%s|\$\d+")
+_IN_LISTS = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_VALUES_LISTS = re.compile(
+    r"\bVALUES\s*(\([^()]*\))(?:\s*,\s*\([^()]*\))+", re.IGNORECASE
+)
+
+
+def normalize_sql(statement: str) -> str:
+    """collapse literals, bind params and whitespace so statements group by shape"""
+    statement = _WHITESPACE.sub(" ", statement).strip()
+    statement = _PARAMS.sub("?", statement)
+    statement = _LITERALS.sub("?", statement)
+    statement = _IN_LISTS.sub("IN (...)", statement)
+    return _VALUES_LISTS.sub(r"VALUES \1, ...", statement)
+
+
+@dataclass
+class QueryStats:
+    """statements executed within one unit of work, usually a request"""
+
+    count: int = 0
+    duration: float = 0.0
+    statements: Counter[str] = field(default_factory=Counter)
+
+    def record(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        """SELECTs of the same shape executed at least `threshold` times"""
+        return [
+            (statement, count)
+            for statement, count in self.statements.most_common()
+            if count >= threshold and statement.upper().startswith("SELECT")
+        ]
+
+
+# stats of the request being served, set by QueryStatsMiddleware
+query_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+def _explain(conn: Connection, statement: str, parameters: Any) -> str | None:
+    """run EXPLAIN (ANALYZE, BUFFERS) for a slow SELECT on the same connection
+
+    wrapped in a savepoint so a failing plan never aborts the caller's transaction
+    """
+    if not statement.lstrip().upper().startswith("SELECT"):
+        return None
+    dbapi_conn: Any = conn.connection.dbapi_connection
+    in_transaction = not getattr(dbapi_conn, "autocommit", False)
+    cursor = dbapi_conn.cursor()
+    try:
+        if in_transaction:
+            cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+            return "\n".join(row[0] for row in cursor.fetchall())
+        finally:
+            if in_transaction:
+                cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+    except Exception as e:
+        logger.debug("EXPLAIN failed: %s", e)
+        return None
+    finally:
+        cursor.close()
+
+
+def _before_cursor_execute(conn: Connection, *_: Any) -> None:
+    conn.info.setdefault(_START_TIMES, []).append(time.perf_counter())
+
+
+def _after_cursor_execute(
+    conn: Connection,
+    cursor: Any,
+    statement: str,
+    parameters: Any,
+    context: Any,
+    executemany: bool,
+) -> None:
+    duration = time.perf_counter() - conn.info[_START_TIMES].pop()
+    stats = query_stats.get()
+    normalized = None
+    if stats is not None:
+        normalized = normalize_sql(statement)
+        stats.record(normalized, duration)
+
+    if duration * 1000 < settings.SLOW_QUERY_THRESHOLD_MS:
+        return
+    normalized = normalized or normalize_sql(statement)
+    plan = None
+    if settings.SLOW_QUERY_EXPLAIN and not executemany:
+        plan = _explain(conn, statement, parameters)
+    if plan:
+        logger.warning("slow query (%.1fms): %s\n%s", duration * 1000, normalized, plan)
+    else:
+        logger.warning("slow query (%.1fms): %s", duration * 1000, normalized)
+
+
+def instrument_engine(engine: Engine) -> None:
+    """time every statement executed by the engine, log the slow ones and trace them"""
+    trace_engine(engine)
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+@contextmanager
+def count_queries(engine: Engine) -> Generator[QueryStats, None, None]:
+    """count every statement the engine executes inside the block, from any thread"""
+    stats = QueryStats()
+
+    def _count(conn: Connection, cursor: Any, statement: str, *_: Any) -> None:
+        stats.record(normalize_sql(statement), 0.0)
+
+    event.listen(engine, "after_cursor_execute", _count)
+    try:
+        yield stats
+    finally:
+        event.remove(engine, "after_cursor_execute", _count)
+
+
+class QueryStatsMiddleware:
+    """count statements per request and flag N+1 patterns"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = query_stats.set(stats)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            query_stats.reset(token)
+            self.report(f"{scope['method']} {scope['path']}", stats)
+
+    @staticmethod
+    def report(request: str, stats: QueryStats) -> None:
+        if not stats.count:
+            return
+        logger.debug(
+            "%s ran %d queries in %.1fms", request, stats.count, stats.duration * 1000
+        )
+        for statement, count in stats.repeated(settings.N_PLUS_ONE_THRESHOLD):
+            logger.warning("possible N+1 in %s: %d x %s", request, count, statement)
@@ -0,0 +1,67 @@
+"""periodic reconcile of the per-owner item stats
+
+triggers on item keep item_stats current, the reconcile recounts every owner
+now and then to correct drift, e.g. from rows changed with the triggers
+disabled. one worker at a time runs it per database, the others skip the round.
+the same rounds purge expired idempotency keys, which lookups ignore already.
+"""
+
+import asyncio
+import logging
+
+import anyio
+from sqlalchemy import Engine, text
+from sqlmodel import Session
+
+from app import crud
+from app.core.config import settings
+from app.core.db import engine, shards
+
+logger = logging.getLogger(__name__)
+
+# pg_try_advisory_lock key of the reconcile
+RECONCILE_LOCK = 0x17E5_7A75
+
+
+def reconcile(engine: Engine) -> int | None:
+    """reconcile the stats of one database, None when another worker is at it"""
+    with engine.connect() as connection:
+        locked = connection.execute(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": RECONCILE_LOCK}
+        ).scalar_one()
+        connection.commit()
+        if not locked:
+            return None
+        try:
+            with Session(bind=connection) as session:
+                return crud.item_stats.reconcile(
+                    session, batch_size=settings.ITEM_STATS_RECONCILE_BATCH_SIZE
+                )
+        finally:
+            connection.execute(
+                text("SELECT pg_advisory_unlock(:key)"), {"key": RECONCILE_LOCK}
+            )
+            connection.commit()
+
+
+def purge_idempotency_keys(engine: Engine) -> int:
+    """delete the expired idempotency keys of one database"""
+    with Session(engine) as session:
+        return crud.idempotency_key.purge(session)
+
+
+async def reconcile_periodically() -> None:
+    """reconcile the databases holding items every ITEM_STATS_RECONCILE_INTERVAL_SECONDS"""
+    # with shards the items are only on them
+    engines = [shard.engine for shard in shards] or [engine]
+    while True:
+        await asyncio.sleep(settings.ITEM_STATS_RECONCILE_INTERVAL_SECONDS)
+        for database in engines:
+            try:
+                await anyio.to_thread.run_sync(reconcile, database)
+            except Exception:
+                logger.exception("item stats reconcile failed")
+            try:
+                await anyio.to_thread.run_sync(purge_idempotency_keys, database)
+            except Exception:
+                logger.exception("idempotency key purge failed")
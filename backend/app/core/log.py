@@ -0,0 +1,201 @@
+"""structured logging with formatting and I/O off the event loop
+
+records are handed to a `QueueHandler`, a `QueueListener` thread formats
+them as JSON and writes them. `AccessLogMiddleware` replaces uvicorn's access
+log and tags every record of a request with its id, user and operation id.
+"""
+
+import json
+import logging
+import queue
+import random
+import sys
+import time
+import traceback
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any
+
+from opentelemetry import trace
+from opentelemetry.trace import format_span_id, format_trace_id
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+
+REQUEST_ID_HEADER = "x-request-id"
+_REQUEST_ID = REQUEST_ID_HEADER.encode()
+
+# per request, a dict so values set deeper down, e.g. the user id by the auth
+# dependency, are seen by the middleware even from a copied context
+request_context: ContextVar[dict[str, Any] | None] = ContextVar(
+    "request_context", default=None
+)
+
+access_logger = logging.getLogger("app.access")
+
+# attributes every LogRecord has, anything else was passed as `extra`
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def set_user_id(user_id: str) -> None:
+    context = request_context.get()
+    if context is not None:
+        context["user_id"] = user_id
+
+
+def _operation_id(scope: Scope) -> str | None:
+    route = scope.get("route")
+    return getattr(route, "unique_id", None) or getattr(route, "name", None)
+
+
+class RequestContextFilter(logging.Filter):
+    """copy the request context onto records, before they are queued"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = request_context.get()
+        if context is not None:
+            record.request_id = context["request_id"]
+            record.user_id = context.get("user_id")
+            record.operation_id = _operation_id(context["scope"])
+        span_context = trace.get_current_span().get_span_context()
+        if span_context.is_valid:
+            record.trace_id = format_trace_id(span_context.trace_id)
+            record.span_id = format_span_id(span_context.span_id)
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data: dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        data.update(
+            (key, value)
+            for key, value in vars(record).items()
+            if key not in _RECORD_ATTRS and value is not None
+        )
+        if record.exc_info:
+            data["exc_info"] = "".join(traceback.format_exception(*record.exc_info))
+        elif record.exc_text:
+            data["exc_info"] = record.exc_text
+        return json.dumps(data, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """only render the message here, formatting is left to the listener"""
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info))
+            record.exc_info = None
+        return record
+
+
+_listener: QueueListener | None = None
+
+
+def setup_logging() -> None:
+    """route the root and uvicorn loggers through a queue to a JSON stream handler"""
+    global _listener
+    if _listener is not None:
+        return
+    stream = logging.StreamHandler(sys.stdout)
+    if settings.LOG_FORMAT == "json":
+        stream.setFormatter(JSONFormatter())
+    else:
+        stream.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s")
+        )
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(settings.LOG_LEVEL)
+    # uvicorn logs through the root, its access log is replaced by ours
+    for name in ("uvicorn", "uvicorn.error"):
+        logging.getLogger(name).handlers.clear()
+        logging.getLogger(name).propagate = True
+    logging.getLogger("uvicorn.access").disabled = True
+
+    _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    logging.getLogger("uvicorn.access").disabled = False
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        if isinstance(handler, _QueueHandler):
+            root.removeHandler(handler)
+    _listener = None
+
+
+class AccessLogMiddleware:
+    """one access record per request, with a request id
+
+    successful requests faster than ACCESS_LOG_SLOW_MS are sampled at
+    ACCESS_LOG_SAMPLE_RATE, errors and slow requests are always logged
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = next(
+            (v.decode("latin-1") for k, v in scope["headers"] if k == _REQUEST_ID), None
+        )
+        if request_id is None:
+            # not a secret, uuid4 would cost a urandom syscall per request
+            request_id = f"{random.getrandbits(128):032x}"
+        context = {"request_id": request_id, "scope": scope}
+        token = request_context.set(context)
+        status_code = 500
+
+        async def send_with_id(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message).append(REQUEST_ID_HEADER, request_id)
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            if (
+                status_code >= 400
+                or duration_ms >= settings.ACCESS_LOG_SLOW_MS
+                or random.random() < settings.ACCESS_LOG_SAMPLE_RATE
+            ):
+                access_logger.info(
+                    "%s %s %d",
+                    scope["method"],
+                    scope["path"],
+                    status_code,
+                    extra={
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "status_code": status_code,
+                        "duration_ms": round(duration_ms, 3),
+                        "client": scope["client"][0] if scope.get("client") else None,
+                    },
+                )
+            request_context.reset(token)
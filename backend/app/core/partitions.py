@@ -0,0 +1,35 @@
+"""declarative hash partitioning of large tables
+
+hash partitions split a table by a key its queries filter on, e.g. owner_id,
+into a fixed number of partitions all created with the table. they are named
+`<table>_p<remainder>`, see `is_partition`.
+
+item is hash partitioned and not range partitioned by time: it has no
+created_at, and its (owner_id, external_key) unique index must contain the
+partition key. so there are no partitions to create ahead of time, and no
+time-based retention to drop partitions for: an owner's items go with the
+owner, by the cascade from auth.users on the primary. vacuum and index bloat
+are bounded per partition instead, ITEM_PARTITIONS of them.
+"""
+
+import re
+
+_PARTITION_NAME = re.compile(r"^(?P<parent>\w+)_p\d+$")
+
+
+def is_partition(name: str, parents: set[str]) -> bool:
+    """whether `name` is a partition created here of one of `parents`"""
+    match = _PARTITION_NAME.match(name)
+    return match is not None and match["parent"] in parents
+
+
+def hash_partitions_ddl(
+    table: str, modulus: int, *, parent: str | None = None
+) -> list[str]:
+    """partitions of `table`, or of `parent` that is renamed to `table` later"""
+    return [
+        f"CREATE TABLE IF NOT EXISTS {table}_p{remainder} "
+        f"PARTITION OF {parent or table} "
+        f"FOR VALUES WITH (MODULUS {modulus}, REMAINDER {remainder})"
+        for remainder in range(modulus)
+    ]
@@ -0,0 +1,123 @@
+import hashlib
+import hmac
+import logging
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+from pyinstrument import Profiler
+from pyinstrument.renderers import SpeedscopeRenderer
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.auth import get_super_client, validate_token
+from app.core.config import settings
+from app.schemas.profile import ProfileSummary
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "x-profile"
+PROFILE_ID_HEADER = "x-profile-id"
+
+# most recent profiles, newest last, with their speedscope JSON
+profiles: deque[tuple[ProfileSummary, str]] = deque(maxlen=settings.PROFILE_HISTORY)
+
+
+def sign_profile_header(expires: int) -> str:
+    """X-Profile header value that enables profiling until `expires` (unix time)"""
+    signature = hmac.new(
+        settings.SECRET_KEY.encode(), str(expires).encode(), hashlib.sha256
+    ).hexdigest()
+    return f"{expires}.{signature}"
+
+
+def valid_profile_signature(value: str) -> bool:
+    expires, _, signature = value.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(value, sign_profile_header(int(expires)))
+
+
+async def is_superuser(headers: Headers) -> bool:
+    """whether the bearer token belongs to FIRST_SUPERUSER"""
+    scheme, _, token = headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    try:
+        user = await validate_token(token, await get_super_client())
+    except Exception as e:
+        logger.debug("profile request with invalid token: %s", e)
+        return False
+    return bool(user.email == settings.FIRST_SUPERUSER)
+
+
+async def profiling_allowed(headers: Headers) -> bool:
+    """signed X-Profile header, or X-Profile from the superuser"""
+    value = headers.get(PROFILE_HEADER)
+    if not value:
+        return False
+    return valid_profile_signature(value) or await is_superuser(headers)
+
+
+def get_profile(id: str) -> str | None:
+    for summary, speedscope in profiles:
+        if summary.id == id:
+            return speedscope
+    return None
+
+
+class ProfilingMiddleware:
+    """sample the stack of requests carrying an authorized X-Profile header
+
+    the profile is kept in `profiles` and its id returned in X-Profile-Id,
+    requests without the header only pay for the header lookup
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or not any(name == b"x-profile" for name, _ in scope["headers"])
+            or not await profiling_allowed(Headers(scope=scope))
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex
+        status_code = 500
+
+        async def send_with_id(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message).append(PROFILE_ID_HEADER, profile_id)
+            await send(message)
+
+        profiler = Profiler(
+            interval=settings.PROFILE_INTERVAL_SECONDS, async_mode="enabled"
+        )
+        created_at = datetime.now(timezone.utc)
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            session = profiler.stop()
+            summary = ProfileSummary(
+                id=profile_id,
+                method=scope["method"],
+                path=scope["path"],
+                status_code=status_code,
+                duration=session.duration,
+                created_at=created_at,
+            )
+            profiles.append((summary, profiler.output(SpeedscopeRenderer())))
+            logger.info(
+                "profiled %s %s in %.1fms as %s",
+                summary.method,
+                summary.path,
+                summary.duration * 1000,
+                profile_id,
+            )
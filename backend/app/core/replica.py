@@ -0,0 +1,143 @@
+import hashlib
+import itertools
+import logging
+import threading
+import time
+from collections.abc import Sequence
+
+from fastapi import Request
+from sqlalchemy import text
+from sqlmodel import create_engine
+
+from app.core.config import normalize_dsn, settings
+from app.core.deadline import statement_timeout_options
+from app.core.instrumentation import instrument_engine
+from app.core.tracing import TracedQueuePool
+
+logger = logging.getLogger(__name__)
+
+# seconds the replica is behind the primary, 0 when it replayed all received WAL
+LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+    "END"
+)
+
+
+def client_key(request: Request) -> str:
+    """identify the client for read-your-writes, by token or else by address"""
+    credential = request.headers.get("authorization")
+    if not credential:
+        credential = request.client.host if request.client else ""
+    return hashlib.blake2b(credential.encode(), digest_size=16).hexdigest()
+
+
+class Replica:
+    """a read replica with its own pool and last known health"""
+
+    def __init__(self, url: str) -> None:
+        self.engine = create_engine(
+            normalize_dsn(url),
+            poolclass=TracedQueuePool,
+            pool_pre_ping=True,
+            pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+            # standbys are read-only anyway, no transactions to begin and end
+            isolation_level="AUTOCOMMIT",
+            connect_args={"connect_timeout": 2, "options": statement_timeout_options()},
+        )
+        instrument_engine(self.engine)
+        self.healthy = True
+        self.lag = 0.0
+        self.checked_at = 0.0
+        self._checking = threading.Lock()
+
+    def __repr__(self) -> str:
+        url = self.engine.url
+        hosts = url.query.get("host")
+        if url.host is None and hosts:
+            # multi-host, the ports are part of the hosts
+            return f"Replica({hosts if isinstance(hosts, str) else ','.join(hosts)})"
+        return f"Replica({url.host}:{url.port})"
+
+    def check(self) -> None:
+        """refresh health and replication lag, only one caller at a time"""
+        if not self._checking.acquire(blocking=False):
+            return
+        try:
+            with self.engine.connect() as conn:
+                self.lag = float(conn.execute(LAG_QUERY).scalar_one())
+            if not self.healthy:
+                logger.info("%r is back", self)
+            self.healthy = True
+        except Exception as e:
+            self.eject(e)
+        finally:
+            self.checked_at = time.monotonic()
+            self._checking.release()
+
+    def eject(self, error: Exception) -> None:
+        if self.healthy:
+            logger.warning("ejecting %r: %s", self, error)
+        self.healthy = False
+        self.checked_at = time.monotonic()
+
+
+class ReplicaRouter:
+    """pick a replica for read-only sessions, or None to read from the primary
+
+    replicas are skipped while unhealthy or lagging more than `max_lag` seconds,
+    and clients that wrote in the last `pin_seconds` read from the primary
+    """
+
+    def __init__(
+        self,
+        urls: Sequence[str],
+        *,
+        selection: str = "round_robin",
+        max_lag: float = 10,
+        check_interval: float = 5,
+        pin_seconds: float = 5,
+    ) -> None:
+        self.replicas = [Replica(url) for url in urls]
+        self.selection = selection
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.pin_seconds = pin_seconds
+        self._next = itertools.count()
+        self._pinned: dict[str, float] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.replicas)
+
+    def pin(self, key: str) -> None:
+        """route the client to the primary for the next `pin_seconds`"""
+        now = time.monotonic()
+        if len(self._pinned) > 10_000:
+            self._pinned = {k: t for k, t in self._pinned.items() if t > now}
+        self._pinned[key] = now + self.pin_seconds
+
+    def is_pinned(self, key: str) -> bool:
+        until = self._pinned.get(key)
+        return until is not None and until > time.monotonic()
+
+    def available(self) -> list[Replica]:
+        now = time.monotonic()
+        for replica in self.replicas:
+            if now - replica.checked_at >= self.check_interval:
+                replica.check()
+        return [r for r in self.replicas if r.healthy and r.lag <= self.max_lag]
+
+    def choose(self, key: str | None = None) -> Replica | None:
+        if key is not None and self.is_pinned(key):
+            return None
+        replicas = self.available()
+        if not replicas:
+            return None
+        if self.selection == "least_loaded":
+            return min(replicas, key=lambda r: r.engine.pool.checkedout())  # type: ignore[attr-defined]
+        return replicas[next(self._next) % len(replicas)]
+
+    def dispose(self) -> None:
+        for replica in self.replicas:
+            replica.engine.dispose()
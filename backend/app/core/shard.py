@@ -0,0 +1,209 @@
+"""horizontal sharding of owner-scoped tables by owner_id
+
+every shard is a database with the same schema. an owner's rows live on the
+shard its id hashes to on a consistent-hash ring, so adding a shard moves only
+about 1/N of the owners. `ShardedSession` routes each statement: flushes by
+the instance's owner, queries and INSERTs by their `owner_id = ...` criterion
+or values, everything else goes to every shard with the results concatenated.
+"""
+
+import bisect
+import hashlib
+import heapq
+import itertools
+import uuid
+from collections.abc import Iterator, Sequence
+from typing import Any, TypeVar
+
+from sqlalchemy import ColumnElement, Select, make_url
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.horizontal_shard import (
+    ShardedSession as _ShardedSession,
+    set_shard_id,
+)
+from sqlalchemy.orm import ORMExecuteState
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.dml import Insert
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList
+from sqlmodel import Session, create_engine
+
+from app.core.config import normalize_dsn, settings
+from app.core.deadline import statement_timeout_options
+from app.core.instrumentation import instrument_engine
+from app.core.tracing import TracedQueuePool
+
+T = TypeVar("T")
+
+# the column owner-scoped tables are sharded by
+SHARD_KEY = "owner_id"
+
+
+def _hash(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+class Shard:
+    """a database holding the rows of the owners hashed to it"""
+
+    def __init__(self, url: str) -> None:
+        parsed = make_url(normalize_dsn(url))
+        kwargs: dict[str, Any] = {}
+        if parsed.get_backend_name() == "postgresql":
+            kwargs = {
+                "poolclass": TracedQueuePool,
+                "pool_timeout": settings.DB_POOL_TIMEOUT_SECONDS,
+                "connect_args": {"options": statement_timeout_options()},
+            }
+        self.engine = create_engine(parsed, **kwargs)
+        instrument_engine(self.engine)
+        # stable across restarts and reorderings, the ring is built from it
+        self.name = shard_name(parsed)
+
+    def __repr__(self) -> str:
+        return f"Shard({self.name})"
+
+
+def shard_name(url: URL) -> str:
+    if url.host is None and "host" in url.query:
+        # multi-host, the ports are part of the hosts
+        hosts = url.query["host"]
+        host = hosts if isinstance(hosts, str) else ",".join(hosts)
+        return f"{host}/{url.database or ''}"
+    return f"{url.host or ''}:{url.port or ''}/{url.database or ''}"
+
+
+class ShardMap:
+    """consistent-hash ring of shards, `virtual_nodes` points per shard"""
+
+    def __init__(self, urls: Sequence[str], *, virtual_nodes: int = 64) -> None:
+        self.shards = {shard.name: shard for shard in map(Shard, urls)}
+        ring = sorted(
+            (_hash(f"{name}#{i}".encode()), name)
+            for name in self.shards
+            for i in range(virtual_nodes)
+        )
+        self._points = [point for point, _ in ring]
+        self._names = [name for _, name in ring]
+
+    def __bool__(self) -> bool:
+        return bool(self.shards)
+
+    def __iter__(self) -> Iterator[Shard]:
+        return iter(self.shards.values())
+
+    def shard_id(self, owner_id: uuid.UUID | str) -> str:
+        """the shard owning `owner_id`, the next point clockwise on the ring"""
+        if not isinstance(owner_id, uuid.UUID):
+            owner_id = uuid.UUID(owner_id)
+        i = bisect.bisect(self._points, _hash(owner_id.bytes)) % len(self._points)
+        return self._names[i]
+
+    def session(self, **kwargs: Any) -> "ShardedSession":
+        return ShardedSession(
+            shard_chooser=self._shard_chooser,
+            identity_chooser=self._identity_chooser,
+            execute_chooser=self._execute_chooser,
+            shards={name: shard.engine for name, shard in self.shards.items()},
+            **kwargs,
+        )
+
+    def dispose(self) -> None:
+        for shard in self:
+            shard.engine.dispose()
+
+    def _shard_chooser(
+        self, mapper: Any, instance: Any, clause: Any = None, **kw: Any
+    ) -> str:
+        """shard of an instance being flushed"""
+        owner_id = getattr(instance, SHARD_KEY, None)
+        if owner_id is None:
+            raise ValueError(
+                f"no {SHARD_KEY} to choose a shard for {instance or clause!r}, "
+                "pass bind_arguments={'shard_id': ...}"
+            )
+        return self.shard_id(owner_id)
+
+    def _identity_chooser(self, mapper: Any, primary_key: Any, **kw: Any) -> list[str]:
+        """lookups by primary key alone may hit any shard"""
+        return list(self.shards)
+
+    def _execute_chooser(self, orm_context: ORMExecuteState) -> list[str]:
+        statement = orm_context.statement
+        if isinstance(statement, Insert):
+            owners = insert_owners(statement, orm_context.parameters)
+            shard_ids = {self.shard_id(owner_id) for owner_id in owners}
+            if len(shard_ids) != 1:
+                raise ValueError(
+                    f"INSERT rows must have a {SHARD_KEY} of a single shard, "
+                    f"got shards {sorted(shard_ids)}"
+                )
+            return list(shard_ids)
+        owner_id = criterion_owner(getattr(statement, "whereclause", None))
+        if owner_id is not None:
+            return [self.shard_id(owner_id)]
+        return list(self.shards)
+
+
+def _value(value: Any) -> Any:
+    return value.effective_value if isinstance(value, BindParameter) else value
+
+
+def insert_owners(statement: Insert, parameters: Any) -> list[Any]:
+    """owner ids of `INSERT ... VALUES` or of the executemany parameters"""
+    for column, value in (statement._values or {}).items():
+        if getattr(column, "key", column) == SHARD_KEY:
+            return [_value(value)]
+    if isinstance(parameters, dict):
+        parameters = [parameters]
+    return [row[SHARD_KEY] for row in parameters or () if SHARD_KEY in row]
+
+
+def criterion_owner(where: ColumnElement[Any] | None) -> Any:
+    """the value of an `owner_id = ...` criterion all rows must match"""
+    if where is None:
+        return None
+    # only top-level AND terms, one inside an OR does not narrow it down
+    terms = (
+        where.clauses
+        if isinstance(where, BooleanClauseList) and where.operator is operators.and_
+        else [where]
+    )
+    for term in terms:
+        if (
+            isinstance(term, BinaryExpression)
+            and term.operator is operators.eq
+            and getattr(term.left, "key", None) == SHARD_KEY
+            and isinstance(term.right, BindParameter)
+        ):
+            return term.right.effective_value
+    return None
+
+
+class ShardedSession(_ShardedSession, Session):
+    """SQLAlchemy's ShardedSession with sqlmodel's `exec`"""
+
+    def __init__(self, *, shards: dict[str, Any], **kwargs: Any) -> None:
+        super().__init__(shards=shards, **kwargs)
+        self.shard_ids = list(shards)
+
+    def gather(
+        self,
+        statement: Select[tuple[T]],
+        *,
+        order_by: Any,
+        skip: int = 0,
+        limit: int = 100,
+    ) -> list[T]:
+        """page through the rows of every shard, merged by `order_by`
+
+        each shard returns its first `skip + limit` rows, so deep pages cost
+        every shard the rows before them
+        """
+        statement = statement.order_by(order_by).limit(skip + limit)
+        key: str = order_by.key
+        pages = [
+            self.exec(statement.options(set_shard_id(shard_id))).all()  # type: ignore[call-overload]
+            for shard_id in self.shard_ids
+        ]
+        merged = heapq.merge(*pages, key=lambda row: getattr(row, key))
+        return list(itertools.islice(merged, skip, skip + limit))
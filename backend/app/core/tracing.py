@@ -0,0 +1,217 @@
+"""OpenTelemetry tracing of requests, auth, pool checkouts, SQL and httpx calls
+
+spans go through the global tracer provider, which stays a no-op unless
+TRACE_EXPORTER is set. W3C `traceparent` headers are continued on incoming
+requests and injected into outgoing httpx calls.
+"""
+
+import logging
+import threading
+from collections.abc import Sequence
+from typing import Any
+
+import httpx
+from opentelemetry import context, propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SimpleSpanProcessor,
+    SpanExporter,
+    SpanExportResult,
+)
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, Sampler, TraceIdRatioBased
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from sqlalchemy import Engine, event
+from sqlalchemy.pool import PoolProxiedConnection, QueuePool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+tracer = trace.get_tracer("app")
+
+# spans of the "memory" exporter, for tests and debugging
+memory_exporter = InMemorySpanExporter()
+
+
+class FileSpanExporter(SpanExporter):
+    """one JSON object per span and line"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        lines = [span.to_json(indent=None) for span in spans]
+        with self._lock, open(self.path, "a") as f:
+            f.write("\n".join(lines) + "\n")
+        return SpanExportResult.SUCCESS
+
+
+def make_sampler(rate: float) -> Sampler:
+    """keep `rate` of new traces, and follow the caller's decision otherwise"""
+    return ParentBased(TraceIdRatioBased(rate))
+
+
+def setup_tracing() -> None:
+    """install the tracer provider for TRACE_EXPORTER, nothing for "none" """
+    if settings.TRACE_EXPORTER == "none":
+        return
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": settings.PROJECT_NAME}),
+        sampler=make_sampler(settings.TRACE_SAMPLE_RATE),
+    )
+    if settings.TRACE_EXPORTER == "memory":
+        provider.add_span_processor(SimpleSpanProcessor(memory_exporter))
+    elif settings.TRACE_EXPORTER == "file":
+        # batches are written by a background thread, not on the event loop
+        provider.add_span_processor(
+            BatchSpanProcessor(FileSpanExporter(settings.TRACE_FILE_PATH))
+        )
+    else:
+        provider.add_span_processor(BatchSpanProcessor(ConsoleSpanExporter()))
+    trace.set_tracer_provider(provider)
+
+
+## SQL
+
+
+class TracedQueuePool(QueuePool):
+    """QueuePool with a span around every checkout, waiting included"""
+
+    def connect(self) -> PoolProxiedConnection:
+        with tracer.start_as_current_span("db.pool.checkout") as span:
+            span.set_attribute("db.client.connection.pool.size", self.size())
+            span.set_attribute(
+                "db.client.connection.pool.checked_out", self.checkedout()
+            )
+            return super().connect()
+
+
+def _before_cursor_execute(
+    conn: Any, cursor: Any, statement: str, parameters: Any, ctx: Any, executemany: bool
+) -> None:
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement else ""
+    span = tracer.start_span(
+        f"db {operation}",
+        kind=SpanKind.CLIENT,
+        attributes={
+            "db.system": "postgresql",
+            "db.operation.name": operation,
+            "db.query.text": statement,
+            "server.address": conn.engine.url.host or "",
+        },
+    )
+    if ctx is not None:
+        ctx._otel_span = span
+
+
+def _after_cursor_execute(
+    conn: Any, cursor: Any, statement: str, parameters: Any, ctx: Any, executemany: bool
+) -> None:
+    span = getattr(ctx, "_otel_span", None)
+    if span is not None:
+        if cursor.rowcount >= 0:
+            span.set_attribute("db.response.returned_rows", cursor.rowcount)
+        span.end()
+
+
+def _handle_error(exception_context: Any) -> None:
+    span = getattr(exception_context.execution_context, "_otel_span", None)
+    if span is not None:
+        span.record_exception(exception_context.original_exception)
+        span.set_status(Status(StatusCode.ERROR))
+        span.end()
+
+
+def trace_engine(engine: Engine) -> None:
+    """a client span per statement executed by the engine"""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+## HTTP
+
+
+class TracingTransport(httpx.AsyncBaseTransport):
+    """client span per request, with `traceparent` injected"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport) -> None:
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        with tracer.start_as_current_span(
+            f"{request.method}",
+            kind=SpanKind.CLIENT,
+            attributes={
+                "http.request.method": request.method,
+                "url.full": str(request.url.copy_with(query=None)),
+                "server.address": request.url.host,
+            },
+        ) as span:
+            propagate.inject(request.headers)
+            response = await self.transport.handle_async_request(request)
+            span.set_attribute("http.response.status_code", response.status_code)
+            if response.status_code >= 400:
+                span.set_status(Status(StatusCode.ERROR))
+            return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+## ASGI
+
+
+class TracingMiddleware:
+    """a server span per request, continuing an incoming `traceparent`"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        carrier = {
+            name.decode("latin-1"): value.decode("latin-1")
+            for name, value in scope["headers"]
+        }
+        token = context.attach(propagate.extract(carrier))
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            with tracer.start_as_current_span(
+                f"{scope['method']}",
+                kind=SpanKind.SERVER,
+                attributes={
+                    "http.request.method": scope["method"],
+                    "url.path": scope["path"],
+                },
+            ) as span:
+                try:
+                    await self.app(scope, receive, send_with_status)
+                finally:
+                    route = getattr(scope.get("route"), "path", None)
+                    if route:
+                        span.update_name(f"{scope['method']} {route}")
+                        span.set_attribute("http.route", route)
+                    span.set_attribute("http.response.status_code", status_code)
+                    if status_code >= 500:
+                        span.set_status(Status(StatusCode.ERROR))
+        finally:
+            context.detach(token)
@@ -0,0 +1,151 @@
+"""startup warm-up, so the first requests after a deploy don't pay for it
+
+runs in the background from the lifespan: fills the connection pools, runs the
+hot CRUD statements once on the read-write and read-only engines so their
+compiled forms are cached, encodes the OpenAPI schema and opens the Supabase
+auth connection. `/utils/ready` answers 503 until it is done.
+"""
+
+import json
+import logging
+import time
+import uuid
+from collections.abc import Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+
+import anyio
+from fastapi import FastAPI, Request, Response
+from sqlalchemy import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+
+from app import crud
+from app.core.auth import get_auth_http_client, get_super_client
+from app.core.config import settings
+from app.core.db import engine, read_engine, read_session, replicas
+from app.models.item import ItemCreate
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class WarmUpState:
+    ready: bool = False
+    seconds: float | None = None
+
+
+state = WarmUpState()
+
+_openapi_json: bytes | None = None
+
+
+def fill_pool(engine: Engine, connections: int) -> int:
+    """open up to `connections` pooled connections at once and return them idle"""
+    # connections beyond the pool size would be closed again on return
+    count: int = min(connections, engine.pool.size())  # type: ignore[attr-defined]
+    if count <= 0:
+        return 0
+    with ThreadPoolExecutor(count) as executor:
+        opened = list(executor.map(lambda _: engine.raw_connection(), range(count)))
+    for connection in opened:
+        connection.close()
+    return count
+
+
+def compile_crud(engine: Engine) -> None:
+    """run the CRUDBase statements of items in a transaction that is rolled back
+
+    selects land in the engine's compiled cache and the flush INSERT in the
+    mapper's, the create fails on the owner foreign key and nothing is kept
+    """
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        session = Session(bind=connection, join_transaction_mode="create_savepoint")
+        try:
+            owner_id = uuid.UUID(int=0)
+            crud.item.get(session, id=uuid.uuid4(), owner_id=owner_id)
+            crud.item.get_multi(session, owner_id=owner_id, limit=1)
+            try:
+                crud.item.create(
+                    session, owner_id=owner_id, obj_in=ItemCreate(title="warm-up")
+                )
+            except IntegrityError:
+                session.rollback()
+        finally:
+            session.close()
+            transaction.rollback()
+
+
+def compile_reads(engine: Engine) -> None:
+    """run the item reads of ReadSessionDep routes, the cache is per engine"""
+    with read_session(engine) as session:
+        owner_id = uuid.UUID(int=0)
+        crud.item.get(session, id=uuid.uuid4(), owner_id=owner_id)
+        crud.item.get_multi(session, owner_id=owner_id, limit=1)
+
+
+def openapi_json(app: FastAPI) -> bytes:
+    """the OpenAPI schema, encoded once"""
+    global _openapi_json
+    if _openapi_json is None:
+        _openapi_json = json.dumps(
+            app.openapi(), ensure_ascii=False, separators=(",", ":")
+        ).encode()
+    return _openapi_json
+
+
+def serve_cached_openapi(app: FastAPI) -> None:
+    """replace FastAPI's openapi route, which encodes the schema per request"""
+    url = app.openapi_url
+    if url is None:
+        return
+    app.router.routes = [
+        route for route in app.router.routes if getattr(route, "path", None) != url
+    ]
+
+    async def openapi(request: Request) -> Response:  # noqa: ARG001
+        return Response(openapi_json(app), media_type="application/json")
+
+    app.add_route(url, openapi, include_in_schema=False)
+
+
+async def open_auth_connection() -> None:
+    """create the Supabase client and open its connection to GoTrue"""
+    await get_super_client()
+    await get_auth_http_client().get(
+        f"{settings.SUPABASE_URL}/auth/v1/health",
+        headers={"apikey": settings.SUPABASE_KEY},
+    )
+
+
+async def warm_up(app: FastAPI) -> None:
+    start = time.perf_counter()
+    connections = settings.WARMUP_POOL_CONNECTIONS
+    in_thread = anyio.to_thread.run_sync
+    steps: list[tuple[str, Callable[[], Awaitable[object]]]] = [
+        ("pool", partial(in_thread, fill_pool, engine, connections)),
+        ("read pool", partial(in_thread, fill_pool, read_engine, connections)),
+        *(
+            (
+                f"{replica!r} pool",
+                partial(in_thread, fill_pool, replica.engine, connections),
+            )
+            for replica in replicas.replicas
+        ),
+        ("statements", partial(in_thread, compile_crud, engine)),
+        ("read statements", partial(in_thread, compile_reads, read_engine)),
+        ("openapi", partial(in_thread, openapi_json, app)),
+        ("auth", open_auth_connection),
+    ]
+    for name, step in steps:
+        # a failed step only costs its latency on the first requests
+        try:
+            with anyio.fail_after(settings.WARMUP_STEP_TIMEOUT_SECONDS):
+                await step()
+        except Exception as e:
+            logger.warning("warm-up of %s failed: %s", name, e)
+    state.seconds = time.perf_counter() - start
+    state.ready = True
+    logger.info("warm-up finished in %.2fs", state.seconds)
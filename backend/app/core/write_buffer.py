@@ -0,0 +1,189 @@
+"""group commit for high-rate creates
+
+creates from concurrent requests are queued and written by a single task as
+one multi-row `INSERT ... RETURNING` per batch, so many requests share one
+commit. a batch is flushed after `max_wait` seconds or `max_batch_size` rows,
+whichever comes first, and every waiting request gets its own row back.
+"""
+
+import asyncio
+import logging
+import uuid
+from collections import Counter
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any, Generic, TypeVar
+
+import anyio
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import Session, SQLModel
+
+from app.core.config import settings
+from app.core.db import engine
+from app.models.base import InDBBase
+from app.models.item import Item
+
+logger = logging.getLogger(__name__)
+
+ModelType = TypeVar("ModelType", bound=InDBBase)
+
+Entry = tuple[dict[str, Any], asyncio.Future[Any]]
+
+
+@dataclass
+class BatchStats:
+    batches: int = 0
+    rows: int = 0
+    # rows of batches that failed and were retried row by row
+    retried: int = 0
+    sizes: Counter[int] = field(default_factory=Counter)
+
+    def record(self, size: int) -> None:
+        self.batches += 1
+        self.rows += size
+        self.sizes[size] += 1
+
+    @property
+    def mean(self) -> float:
+        return self.rows / self.batches if self.batches else 0.0
+
+
+class WriteBuffer(Generic[ModelType]):
+    """queue creates of `model` and insert them in batches
+
+    `start` and `stop` must run on the event loop that serves the requests,
+    `stop` flushes what is still queued
+    """
+
+    def __init__(
+        self,
+        model: type[ModelType],
+        session_factory: Callable[[], Session],
+        *,
+        max_batch_size: int = 100,
+        max_wait: float = 0.005,
+    ) -> None:
+        self.model = model
+        self.session_factory = session_factory
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = BatchStats()
+        self._queue: asyncio.Queue[Entry | None] | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._queue is None or self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._queue = self._task = None
+
+    async def create(self, *, owner_id: uuid.UUID, obj_in: SQLModel) -> ModelType:
+        """queue the row and wait until its batch is committed"""
+        if self._queue is None or not self.running:
+            raise RuntimeError("write buffer is not running")
+        future: asyncio.Future[ModelType] = asyncio.get_running_loop().create_future()
+        values = dict(id=uuid.uuid4(), owner_id=owner_id, **obj_in.model_dump())
+        await self._queue.put((values, future))
+        return await future
+
+    async def _run(self) -> None:
+        assert self._queue is not None
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    entry = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        entry = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[Entry]) -> None:
+        rows = [values for values, _ in batch]
+        try:
+            results = await anyio.to_thread.run_sync(self._write, rows)
+        except Exception as e:
+            logger.exception("write buffer flush of %d rows failed", len(rows))
+            results = [e] * len(rows)
+        self.stats.record(len(rows))
+        logger.debug("write buffer flushed %d rows", len(rows))
+        for (_, future), result in zip(batch, results, strict=True):
+            # the request may have been cancelled meanwhile
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _write(self, rows: list[dict[str, Any]]) -> list[ModelType | Exception]:
+        statement = insert(self.model).returning(
+            self.model, sort_by_parameter_order=True
+        )
+        with self.session_factory() as session:
+            try:
+                objs = session.scalars(statement, rows).all()
+                # keep the returned values instead of reloading them after the commit
+                session.expunge_all()
+                session.commit()
+                return list(objs)
+            except DBAPIError as e:
+                session.rollback()
+                if len(rows) == 1:
+                    return [e]
+                logger.warning(
+                    "write buffer batch of %d rows failed, retrying row by row: %s",
+                    len(rows),
+                    e,
+                )
+            # one bad row fails the whole batch, only that row should fail
+            self.stats.retried += len(rows)
+            results: list[ModelType | Exception] = []
+            for row in rows:
+                try:
+                    obj = session.scalars(statement, [row]).one()
+                    session.expunge_all()
+                    session.commit()
+                    results.append(obj)
+                except DBAPIError as e:
+                    session.rollback()
+                    results.append(e)
+            return results
+
+
+item_buffer = WriteBuffer(
+    Item,
+    lambda: Session(engine),
+    max_batch_size=settings.WRITE_BUFFER_MAX_BATCH_SIZE,
+    max_wait=settings.WRITE_BUFFER_MAX_WAIT_MS / 1000,
+)
+
+
+def get_item_buffer() -> WriteBuffer[Item] | None:
+    """the item write buffer when WRITE_BUFFER_ENABLED, else creates commit per request"""
+    return item_buffer if item_buffer.running else None
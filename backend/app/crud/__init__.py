@@ -1,7 +1,9 @@
+from .crud_idempotency import idempotency_key, request_hash
 from .crud_item import item
+from .crud_item_stats import item_stats
 
 # For a new basic set of CRUD operations you could just do
-__all__ = ["item"]
+__all__ = ["item", "item_stats", "idempotency_key", "request_hash"]
 # from .base import CRUDBase
 # from app.models.item import Item
 # from app.schemas.item import ItemCreate, ItemUpdate
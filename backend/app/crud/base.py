@@ -2,8 +2,11 @@ import uuid
 from collections.abc import Sequence
 from typing import Generic, TypeVar
 
+from sqlalchemy.dialects.postgresql import insert
 from sqlmodel import Session, SQLModel, select
+from sqlmodel.sql.expression import SelectOfScalar
 
+from app.core.shard import ShardedSession
 from app.models.base import InDBBase
 
 ModelType = TypeVar("ModelType", bound=InDBBase)
@@ -22,35 +25,97 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         """
         self.model = model
 
-    def get(self, session: Session, *, id: uuid.UUID) -> ModelType | None:
+    def _select(self, owner_id: uuid.UUID | None) -> SelectOfScalar[ModelType]:
+        """records of `owner_id` if given, only the owner's partition is searched"""
+        statement = select(self.model)
+        if owner_id is not None:
+            statement = statement.where(self.model.owner_id == owner_id)
+        return statement
+
+    def get(
+        self, session: Session, *, id: uuid.UUID, owner_id: uuid.UUID | None = None
+    ) -> ModelType | None:
         """Get a single record by id"""
-        statement = select(self.model).where(self.model.id == id)
+        statement = self._select(owner_id).where(self.model.id == id)
         result = session.exec(statement)
         return result.one_or_none()
 
     def get_multi(
-        self, session: Session, *, skip: int = 0, limit: int = 100
+        self,
+        session: Session,
+        *,
+        owner_id: uuid.UUID | None = None,
+        skip: int = 0,
+        limit: int = 100,
     ) -> Sequence[ModelType]:
-        """Get multiple records with pagination"""
-        statement = select(self.model).offset(skip).limit(limit)
-        result = session.exec(statement)
+        """Get multiple records with pagination, merged by id across shards"""
+        statement = self._select(owner_id)
+        if isinstance(session, ShardedSession) and owner_id is None:
+            return session.gather(
+                statement, order_by=self.model.id, skip=skip, limit=limit
+            )
+        result = session.exec(statement.offset(skip).limit(limit))
         return result.all()
 
     def create(
-        self, session: Session, *, owner_id: uuid.UUID, obj_in: CreateSchemaType
+        self,
+        session: Session,
+        *,
+        owner_id: uuid.UUID,
+        obj_in: CreateSchemaType,
+        commit: bool = True,
     ) -> ModelType:
-        """Create new record"""
+        """Create new record, only flushed when `commit` is False"""
         db_obj = self.model(**dict(owner_id=owner_id, **obj_in.model_dump()))
         session.add(db_obj)
+        if not commit:
+            session.flush()
+            return db_obj
         session.commit()
         session.refresh(db_obj)
         return db_obj
 
+    def upsert(
+        self,
+        session: Session,
+        *,
+        owner_id: uuid.UUID,
+        obj_in: CreateSchemaType,
+        index_elements: Sequence[str],
+    ) -> ModelType:
+        """Create or update the record matching `index_elements` in one statement
+
+        `INSERT ... ON CONFLICT DO UPDATE ... RETURNING`, the conflict target
+        must be covered by a unique index
+        """
+        values = dict(owner_id=owner_id, **obj_in.model_dump())
+        insert_statement = insert(self.model).values(id=uuid.uuid4(), **values)
+        set_ = {
+            name: insert_statement.excluded[name]
+            for name in values
+            if name not in index_elements
+        }
+        statement = insert_statement.on_conflict_do_update(
+            index_elements=index_elements, set_=set_
+        ).returning(self.model)
+        db_obj: ModelType = session.scalars(
+            statement, execution_options={"populate_existing": True}
+        ).one()
+        # keep the returned values instead of reloading them after the commit
+        session.expunge(db_obj)
+        session.commit()
+        return db_obj
+
     def update(
-        self, session: Session, *, id: uuid.UUID, obj_in: UpdateSchemaType
+        self,
+        session: Session,
+        *,
+        id: uuid.UUID,
+        obj_in: UpdateSchemaType,
+        owner_id: uuid.UUID | None = None,
     ) -> ModelType | None:
         """Update existing record"""
-        db_obj = self.get(session, id=id)
+        db_obj = self.get(session, id=id, owner_id=owner_id)
         if db_obj:
             update_data = obj_in.model_dump(exclude_unset=True)
             db_obj.sqlmodel_update(update_data)
@@ -60,9 +125,11 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             session.refresh(db_obj)
         return db_obj
 
-    def remove(self, session: Session, *, id: uuid.UUID) -> ModelType | None:
+    def remove(
+        self, session: Session, *, id: uuid.UUID, owner_id: uuid.UUID | None = None
+    ) -> ModelType | None:
         """Remove a record"""
-        obj = self.get(session, id=id)
+        obj = self.get(session, id=id, owner_id=owner_id)
         if obj:
             session.delete(obj)
             session.commit()
@@ -0,0 +1,76 @@
+import hashlib
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session, SQLModel, col, select
+
+from app.core.config import settings
+from app.models.idempotency import IdempotencyKey
+
+
+def request_hash(obj_in: SQLModel) -> str:
+    return hashlib.sha256(obj_in.model_dump_json().encode()).hexdigest()
+
+
+class CRUDIdempotencyKey:
+    def _cutoff(self) -> datetime:
+        return datetime.now(timezone.utc) - timedelta(
+            hours=settings.IDEMPOTENCY_KEY_TTL_HOURS
+        )
+
+    def get(
+        self, session: Session, *, owner_id: uuid.UUID, key: str
+    ) -> IdempotencyKey | None:
+        """Get the stored response, unless it expired"""
+        statement = select(IdempotencyKey).where(
+            IdempotencyKey.owner_id == owner_id,
+            IdempotencyKey.key == key,
+            IdempotencyKey.created_at > self._cutoff(),
+        )
+        return session.exec(statement).one_or_none()
+
+    def create(
+        self,
+        session: Session,
+        *,
+        owner_id: uuid.UUID,
+        key: str,
+        request_hash: str,
+        status_code: int,
+        response: dict[str, Any],
+    ) -> bool:
+        """Store the response in the current transaction, not committed
+
+        an expired key is overwritten, False when a live one already exists,
+        e.g. stored meanwhile by a concurrent retry
+        """
+        values = {
+            "owner_id": owner_id,
+            "key": key,
+            "request_hash": request_hash,
+            "status_code": status_code,
+            "response": response,
+            "created_at": datetime.now(timezone.utc),
+        }
+        insert_statement = insert(IdempotencyKey).values(**values)
+        statement = insert_statement.on_conflict_do_update(
+            index_elements=["owner_id", "key"],
+            set_={name: insert_statement.excluded[name] for name in values},
+            where=col(IdempotencyKey.created_at) <= self._cutoff(),
+        ).returning(col(IdempotencyKey.key))
+        return session.execute(statement).first() is not None
+
+    def purge(self, session: Session) -> int:
+        """Delete the expired keys, lookups ignore them already"""
+        statement = delete(IdempotencyKey).where(
+            col(IdempotencyKey.created_at) <= self._cutoff()
+        )
+        deleted: int = session.execute(statement).rowcount  # type: ignore[attr-defined]
+        session.commit()
+        return deleted
+
+
+idempotency_key = CRUDIdempotencyKey()
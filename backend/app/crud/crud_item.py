@@ -1,4 +1,5 @@
 import uuid
+from collections.abc import Sequence
 
 from sqlmodel import Session
 
@@ -8,14 +9,36 @@ from app.models.item import Item, ItemCreate, ItemUpdate
 
 class CRUDItem(CRUDBase[Item, ItemCreate, ItemUpdate]):
     def create(
-        self, session: Session, *, owner_id: uuid.UUID, obj_in: ItemCreate
+        self,
+        session: Session,
+        *,
+        owner_id: uuid.UUID,
+        obj_in: ItemCreate,
+        commit: bool = True,
     ) -> Item:
-        return super().create(session, owner_id=owner_id, obj_in=obj_in)
+        return super().create(session, owner_id=owner_id, obj_in=obj_in, commit=commit)
+
+    def upsert(
+        self,
+        session: Session,
+        *,
+        owner_id: uuid.UUID,
+        obj_in: ItemCreate,
+        index_elements: Sequence[str] = ("owner_id", "external_key"),
+    ) -> Item:
+        return super().upsert(
+            session, owner_id=owner_id, obj_in=obj_in, index_elements=index_elements
+        )
 
     def update(
-        self, session: Session, *, id: uuid.UUID, obj_in: ItemUpdate
+        self,
+        session: Session,
+        *,
+        id: uuid.UUID,
+        obj_in: ItemUpdate,
+        owner_id: uuid.UUID | None = None,
     ) -> Item | None:
-        return super().update(session, id=id, obj_in=obj_in)
+        return super().update(session, id=id, obj_in=obj_in, owner_id=owner_id)
 
 
 item = CRUDItem(Item)
@@ -0,0 +1,69 @@
+import logging
+import uuid
+
+from sqlalchemy import text
+from sqlmodel import Session, select
+
+from app.models.item_stats import ItemStats, ItemStatsPublic
+
+logger = logging.getLogger(__name__)
+
+
+class CRUDItemStats:
+    def get(self, session: Session, *, owner_id: uuid.UUID) -> ItemStatsPublic:
+        """Get the stats of an owner, a primary key lookup"""
+        statement = select(ItemStats).where(ItemStats.owner_id == owner_id)
+        stats = session.exec(statement).one_or_none()
+        if stats is None:
+            return ItemStatsPublic()
+        return ItemStatsPublic.model_validate(stats, from_attributes=True)
+
+    def reconcile(self, session: Session, *, batch_size: int = 1000) -> int:
+        """Recount the items of every owner and fix drifted stats, committing per batch
+
+        a batch locks its stats rows before counting, so writes committed
+        meanwhile are either counted or applied by their triggers after it.
+        owners without a row get one with the recount time as their
+        last_activity_at, existing rows keep theirs
+        """
+        session.execute(
+            text(
+                "INSERT INTO item_stats (owner_id, item_count, last_activity_at) "
+                "SELECT DISTINCT owner_id, 0, now() FROM item i WHERE NOT EXISTS "
+                "(SELECT 1 FROM item_stats s WHERE s.owner_id = i.owner_id) "
+                "ORDER BY owner_id ON CONFLICT (owner_id) DO NOTHING"
+            )
+        )
+        session.commit()
+        fixed = 0
+        after = uuid.UUID(int=0)
+        while owners := list(
+            session.execute(
+                text(
+                    "SELECT owner_id FROM item_stats WHERE owner_id > :after "
+                    "ORDER BY owner_id LIMIT :batch_size FOR UPDATE"
+                ),
+                {"after": after, "batch_size": batch_size},
+            ).scalars()
+        ):
+            fixed += len(
+                session.execute(
+                    text(
+                        "UPDATE item_stats s SET item_count = c.n FROM ("
+                        "  SELECT o.owner_id, (SELECT count(*) FROM item"
+                        "  WHERE item.owner_id = o.owner_id) AS n"
+                        "  FROM unnest(CAST(:owners AS uuid[])) AS o(owner_id)"
+                        ") c WHERE s.owner_id = c.owner_id AND s.item_count <> c.n "
+                        "RETURNING s.owner_id"
+                    ),
+                    {"owners": owners},
+                ).all()
+            )
+            session.commit()
+            after = owners[-1]
+        if fixed:
+            logger.warning("fixed drifted item stats of %d owners", fixed)
+        return fixed
+
+
+item_stats = CRUDItemStats()
@@ -1,15 +1,30 @@
+import asyncio
 import logging
 from collections.abc import AsyncGenerator
-from typing import Any
 
 import uvicorn
 from fastapi import FastAPI
 from fastapi.concurrency import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
-from uvicorn.config import LOGGING_CONFIG
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
 
 from app.api.main import api_router
+from app.core.auth import close_super_client
 from app.core.config import settings
+from app.core.db import replicas, shards
+from app.core.deadline import (
+    DeadlineMiddleware,
+    pool_timeout_handler,
+    query_canceled_handler,
+)
+from app.core.instrumentation import QueryStatsMiddleware
+from app.core.item_stats import reconcile_periodically
+from app.core.log import AccessLogMiddleware, setup_logging, shutdown_logging
+from app.core.profiling import ProfilingMiddleware
+from app.core.tracing import TracingMiddleware, setup_tracing
+from app.core.warmup import serve_cached_openapi, warm_up
+from app.core.write_buffer import item_buffer
+from app.services.storage import close_storage
 from app.utils import custom_generate_unique_id
 
 logger = logging.getLogger("uvicorn")
@@ -18,12 +33,35 @@ logger = logging.getLogger("uvicorn")
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:  # noqa ARG001
     """life span events"""
+    setup_logging()
     try:
         logger.info("lifespan start")
+        if settings.WRITE_BUFFER_ENABLED and shards:
+            logger.warning("write buffer disabled, batches would span shards")
+        elif settings.WRITE_BUFFER_ENABLED:
+            await item_buffer.start()
+        # in the background, /utils/ready answers 503 until it is done
+        warm_up_task = asyncio.create_task(warm_up(app))
+        reconcile_task = (
+            asyncio.create_task(reconcile_periodically())
+            if settings.ITEM_STATS_RECONCILE_INTERVAL_SECONDS > 0
+            else None
+        )
         yield
+        warm_up_task.cancel()
+        if reconcile_task is not None:
+            reconcile_task.cancel()
     finally:
+        await item_buffer.stop()
+        replicas.dispose()
+        shards.dispose()
+        await close_storage()
+        await close_super_client()
         logger.info("lifespan exit")
+        shutdown_logging()
+
 
+setup_tracing()
 
 # init FastAPI with lifespan
 app = FastAPI(
@@ -45,30 +83,43 @@ if settings.all_cors_origins:
     )
 
 
+# Cancel requests, and their queries, past the deadline or after a disconnect
+app.add_middleware(DeadlineMiddleware)
+app.add_exception_handler(OperationalError, query_canceled_handler)
+app.add_exception_handler(PoolTimeoutError, pool_timeout_handler)
+
+
+# Count statements per request and flag N+1 patterns
+app.add_middleware(QueryStatsMiddleware)
+
+
+# Profile single requests on demand, outermost to cover the other middlewares
+if settings.PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
+
+# Request ids and sampled JSON access logs, outermost to time the whole request
+app.add_middleware(AccessLogMiddleware)
+
+
+# Root span per request, outermost so the access log carries its trace id
+app.add_middleware(TracingMiddleware)
+
+
 # Include the routers
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
 
+# Serve the OpenAPI schema as bytes encoded once
+serve_cached_openapi(app)
+
+
 @app.get("/", tags=["root"])
 async def read_root() -> dict[str, str]:
     return {"Hello": "World"}
 
 
-# Logger
-def timestamp_log_config(uvicorn_log_config: dict[str, Any]) -> dict[str, Any]:
-    """https://github.com/fastapi/fastapi/discussions/7457#discussioncomment-5565969"""
-    datefmt = "%d-%m-%Y %H:%M:%S"
-    formatters = uvicorn_log_config["formatters"]
-    formatters["default"]["fmt"] = "%(levelprefix)s [%(asctime)s] %(message)s"
-    formatters["access"]["fmt"] = (
-        '%(levelprefix)s [%(asctime)s] %(client_addr)s - "%(request_line)s" %(status_code)s'
-    )
-    formatters["access"]["datefmt"] = datefmt
-    formatters["default"]["datefmt"] = datefmt
-    return uvicorn_log_config
-
-
 if __name__ == "__main__":
-    uvicorn.run(
-        app, host="0.0.0.0", port=8000, log_config=timestamp_log_config(LOGGING_CONFIG)
-    )
+    setup_logging()
+    # access logs come from AccessLogMiddleware
+    uvicorn.run(app, host="0.0.0.0", port=8000, log_config=None, access_log=False)
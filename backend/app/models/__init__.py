@@ -1,4 +1,6 @@
+from .idempotency import IdempotencyKey
 from .item import Item
+from .item_stats import ItemStats
 from .user import User
 
-__all__ = ["User", "Item"]
+__all__ = ["User", "Item", "ItemStats", "IdempotencyKey"]
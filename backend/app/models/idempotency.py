@@ -0,0 +1,25 @@
+import uuid
+from datetime import datetime, timezone
+from typing import Any
+
+from sqlalchemy import Column, DateTime
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlmodel import Field, SQLModel
+
+
+class IdempotencyKey(SQLModel, table=True):
+    """response stored for an Idempotency-Key, replayed when the request is retried"""
+
+    __tablename__ = "idempotency_key"
+    owner_id: uuid.UUID = Field(
+        foreign_key="auth.users.id", primary_key=True, ondelete="CASCADE"
+    )
+    key: str = Field(primary_key=True, max_length=255)
+    # sha256 of the request body, a reused key with another body is rejected
+    request_hash: str = Field(max_length=64)
+    status_code: int
+    response: dict[str, Any] = Field(sa_column=Column(JSONB, nullable=False))
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc),
+        sa_column=Column(DateTime(timezone=True), nullable=False),
+    )
@@ -1,7 +1,10 @@
 import uuid
 
-from sqlmodel import Field, SQLModel
+from sqlalchemy import DDL, event
+from sqlmodel import Field, Index, SQLModel
 
+from app.core.config import settings
+from app.core.partitions import hash_partitions_ddl
 from app.models.base import InDBBase
 
 
@@ -9,6 +12,8 @@ from app.models.base import InDBBase
 class ItemBase(SQLModel):
     title: str = Field(min_length=1, max_length=255)
     description: str | None = Field(default=None, max_length=255)
+    # optional client-side id, unique per owner, for idempotent upserts
+    external_key: str | None = Field(default=None, max_length=255)
 
 
 # Properties to receive on item creation
@@ -22,8 +27,25 @@ class ItemUpdate(ItemBase):
 
 
 # Database model, database table inferred from class name
+# hash partitioned by owner_id, every partition holds the items of a share of
+# the owners. the primary key and unique indexes must include owner_id
 class Item(InDBBase, ItemBase, table=True):
-    pass
+    __table_args__ = (
+        Index("ix_item_owner_id_external_key", "owner_id", "external_key", unique=True),
+        {"postgresql_partition_by": "HASH (owner_id)"},
+    )
+    owner_id: uuid.UUID = Field(
+        foreign_key="auth.users.id", primary_key=True, ondelete="CASCADE"
+    )
+
+
+# the partitions are created with the table, e.g. by create_all in the tests
+for statement in hash_partitions_ddl("item", settings.ITEM_PARTITIONS):
+    event.listen(
+        Item.__table__,  # type: ignore[attr-defined]
+        "after_create",
+        DDL(statement).execute_if(dialect="postgresql"),  # type: ignore[no-untyped-call]
+    )
 
 
 # Properties to return via API, id is always required
@@ -0,0 +1,88 @@
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import DDL, BigInteger, Column, DateTime, event
+from sqlmodel import Field, SQLModel
+
+from app.models.item import Item
+
+
+class ItemStats(SQLModel, table=True):
+    """item count and last change of an owner, kept up to date by triggers on item"""
+
+    __tablename__ = "item_stats"
+    owner_id: uuid.UUID = Field(
+        foreign_key="auth.users.id", primary_key=True, ondelete="CASCADE"
+    )
+    item_count: int = Field(default=0, sa_column=Column(BigInteger, nullable=False))
+    # last item change seen by the triggers. items keep no timestamps, so rows
+    # created by the migration's backfill or by a reconcile hold the time of
+    # that recount until the owner's next change
+    last_activity_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc),
+        sa_column=Column(DateTime(timezone=True), nullable=False),
+    )
+
+
+# Properties to return via API
+class ItemStatsPublic(SQLModel):
+    item_count: int = 0
+    last_activity_at: datetime | None = None
+
+
+# statement level, so bulk inserts from the write buffer and upserts cost one
+# statement per owner and not per row. rows are locked in owner order against
+# deadlocks, deletes only update so a user's cascade never recreates the row
+ITEM_STATS_DDL = [
+    """
+    CREATE OR REPLACE FUNCTION item_stats_apply() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            UPDATE item_stats s
+            SET item_count = s.item_count - d.n, last_activity_at = now()
+            FROM (
+                SELECT owner_id, count(*) AS n FROM old_rows GROUP BY owner_id
+            ) d
+            WHERE s.owner_id = d.owner_id;
+        ELSIF TG_OP = 'INSERT' THEN
+            INSERT INTO item_stats AS s (owner_id, item_count, last_activity_at)
+            SELECT owner_id, count(*), now() FROM new_rows
+            GROUP BY owner_id ORDER BY owner_id
+            ON CONFLICT (owner_id) DO UPDATE
+            SET item_count = s.item_count + excluded.item_count,
+                last_activity_at = excluded.last_activity_at;
+        ELSE
+            INSERT INTO item_stats AS s (owner_id, item_count, last_activity_at)
+            SELECT owner_id, sum(n), now() FROM (
+                SELECT owner_id, 1 AS n FROM new_rows
+                UNION ALL
+                SELECT owner_id, -1 FROM old_rows
+            ) d
+            GROUP BY owner_id ORDER BY owner_id
+            ON CONFLICT (owner_id) DO UPDATE
+            SET item_count = s.item_count + excluded.item_count,
+                last_activity_at = excluded.last_activity_at;
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+    "CREATE TRIGGER item_stats_insert AFTER INSERT ON item "
+    "REFERENCING NEW TABLE AS new_rows "
+    "FOR EACH STATEMENT EXECUTE FUNCTION item_stats_apply()",
+    "CREATE TRIGGER item_stats_update AFTER UPDATE ON item "
+    "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows "
+    "FOR EACH STATEMENT EXECUTE FUNCTION item_stats_apply()",
+    "CREATE TRIGGER item_stats_delete AFTER DELETE ON item "
+    "REFERENCING OLD TABLE AS old_rows "
+    "FOR EACH STATEMENT EXECUTE FUNCTION item_stats_apply()",
+]
+
+# the triggers are created with item, e.g. by create_all in the tests
+for statement in ITEM_STATS_DDL:
+    event.listen(
+        Item.__table__,  # type: ignore[attr-defined]
+        "after_create",
+        DDL(statement).execute_if(dialect="postgresql"),  # type: ignore[no-untyped-call]
+    )
@@ -0,0 +1,16 @@
+from pydantic import BaseModel
+
+
+# out
+class Attachment(BaseModel):
+    name: str
+    # bytes
+    size: int
+    content_type: str | None = None
+
+
+# out
+class SignedURL(BaseModel):
+    url: str
+    # seconds until the URL expires, when known
+    expires_in: int | None = None
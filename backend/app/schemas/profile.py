@@ -0,0 +1,14 @@
+from datetime import datetime
+
+from pydantic import BaseModel
+
+
+# out
+class ProfileSummary(BaseModel):
+    id: str
+    method: str
+    path: str
+    status_code: int
+    # seconds
+    duration: float
+    created_at: datetime
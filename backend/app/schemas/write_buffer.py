@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+
+
+# out
+class WriteBufferStats(BaseModel):
+    running: bool
+    batches: int
+    rows: int
+    retried: int
+    mean_batch_size: float
+    # batch size -> number of batches
+    batch_sizes: dict[int, int]
@@ -0,0 +1,404 @@
+"""item attachments in Supabase Storage, streamed without buffering whole files
+
+`SupabaseStorage` talks to the Storage REST API with httpx, request bodies are
+forwarded chunk by chunk and large uploads use the resumable (TUS) endpoint so
+at most one chunk is held in memory. `LocalStorage` keeps objects on disk and
+stands in for Supabase in tests.
+"""
+
+import base64
+import logging
+import os
+import re
+import uuid
+from collections.abc import AsyncIterator
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Protocol
+from urllib.parse import quote
+
+import anyio
+import httpx
+from fastapi import HTTPException
+
+from app.core.config import settings
+from app.core.tracing import TracingTransport
+from app.schemas.attachment import Attachment
+
+logger = logging.getLogger(__name__)
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+@dataclass
+class Download:
+    """a streamed object, `status_code` is 206 for range requests"""
+
+    chunks: AsyncIterator[bytes]
+    status_code: int = 200
+    headers: dict[str, str] = field(default_factory=dict)
+
+
+class Storage(Protocol):
+    async def upload(
+        self,
+        path: str,
+        chunks: AsyncIterator[bytes],
+        *,
+        content_type: str,
+        size: int | None = None,
+    ) -> int:
+        """store the object and return its size"""
+        ...
+
+    async def download(self, path: str, *, range: str | None = None) -> Download: ...
+
+    async def list(self, prefix: str) -> list[Attachment]: ...
+
+    async def delete(self, path: str) -> None: ...
+
+    async def signed_upload_url(self, path: str) -> str: ...
+
+    async def signed_download_url(self, path: str, expires_in: int) -> str: ...
+
+    async def aclose(self) -> None: ...
+
+
+async def limit_size(chunks: AsyncIterator[bytes], limit: int) -> AsyncIterator[bytes]:
+    """pass chunks through, 413 once more than `limit` bytes arrived"""
+    received = 0
+    async for chunk in chunks:
+        received += len(chunk)
+        if received > limit:
+            raise HTTPException(status_code=413, detail="Attachment too large")
+        yield chunk
+
+
+async def rechunk(chunks: AsyncIterator[bytes], size: int) -> AsyncIterator[bytes]:
+    """regroup a stream into `size` byte chunks, the last one may be shorter"""
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= size:
+            yield bytes(buffer[:size])
+            del buffer[:size]
+    if buffer:
+        yield bytes(buffer)
+
+
+class SupabaseStorage:
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        bucket: str,
+        *,
+        chunk_size: int = 6 * 1024 * 1024,
+        resumable_threshold: int = 6 * 1024 * 1024,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ) -> None:
+        self.url = f"{url.rstrip('/')}/storage/v1"
+        self.bucket = bucket
+        self.chunk_size = chunk_size
+        self.resumable_threshold = resumable_threshold
+        self.client = httpx.AsyncClient(
+            base_url=self.url,
+            headers={"apikey": key, "Authorization": f"Bearer {key}"},
+            timeout=httpx.Timeout(settings.STORAGE_TIMEOUT_SECONDS),
+            transport=TracingTransport(transport or httpx.AsyncHTTPTransport()),
+        )
+
+    def _object(self, path: str) -> str:
+        return f"/object/{self.bucket}/{quote(path)}"
+
+    async def upload(
+        self,
+        path: str,
+        chunks: AsyncIterator[bytes],
+        *,
+        content_type: str,
+        size: int | None = None,
+    ) -> int:
+        if size is not None and size > self.resumable_threshold:
+            return await self._upload_resumable(path, chunks, content_type, size)
+
+        uploaded = 0
+
+        async def counted() -> AsyncIterator[bytes]:
+            nonlocal uploaded
+            async for chunk in chunks:
+                uploaded += len(chunk)
+                yield chunk
+
+        response = await self.client.post(
+            self._object(path),
+            content=counted(),
+            headers={"Content-Type": content_type, "x-upsert": "true"},
+        )
+        response.raise_for_status()
+        return uploaded
+
+    async def _upload_resumable(
+        self, path: str, chunks: AsyncIterator[bytes], content_type: str, size: int
+    ) -> int:
+        """TUS upload, one `chunk_size` PATCH at a time, retried from the server offset"""
+
+        def b64(value: str) -> str:
+            return base64.b64encode(value.encode()).decode()
+
+        tus = {"Tus-Resumable": "1.0.0"}
+        response = await self.client.post(
+            "/upload/resumable",
+            headers={
+                **tus,
+                "Upload-Length": str(size),
+                "Upload-Metadata": ",".join(
+                    f"{name} {b64(value)}"
+                    for name, value in (
+                        ("bucketName", self.bucket),
+                        ("objectName", path),
+                        ("contentType", content_type),
+                    )
+                ),
+                "x-upsert": "true",
+            },
+        )
+        response.raise_for_status()
+        location = response.headers["Location"]
+
+        offset = 0
+        async for chunk in rechunk(chunks, self.chunk_size):
+            sent = 0
+            for attempt in range(3):
+                try:
+                    response = await self.client.patch(
+                        location,
+                        content=chunk[sent:],
+                        headers={
+                            **tus,
+                            "Upload-Offset": str(offset + sent),
+                            "Content-Type": "application/offset+octet-stream",
+                        },
+                    )
+                except httpx.TransportError as e:
+                    # includes timeouts, the connection may break mid-chunk
+                    if attempt == 2:
+                        raise
+                    logger.warning("resumable upload of %s failed: %r", path, e)
+                else:
+                    if response.is_success:
+                        break
+                    if attempt == 2:
+                        response.raise_for_status()
+                    logger.warning("resumable upload of %s failed: %s", path, response)
+                # the server may have kept part of the chunk
+                head = await self.client.head(location, headers=tus)
+                head.raise_for_status()
+                sent = int(head.headers["Upload-Offset"]) - offset
+            offset += len(chunk)
+        return offset
+
+    async def download(self, path: str, *, range: str | None = None) -> Download:
+        request = self.client.build_request(
+            "GET",
+            f"/object/authenticated/{self.bucket}/{quote(path)}",
+            headers={"Range": range} if range else None,
+        )
+        response = await self.client.send(request, stream=True)
+        if response.status_code in (400, 404):
+            await response.aclose()
+            raise HTTPException(status_code=404, detail="Attachment not found")
+        if response.status_code == 416:
+            await response.aclose()
+            raise HTTPException(status_code=416, detail="Range not satisfiable")
+        if response.is_error:
+            await response.aclose()
+            response.raise_for_status()
+
+        async def chunks() -> AsyncIterator[bytes]:
+            try:
+                async for chunk in response.aiter_raw(self.chunk_size):
+                    yield chunk
+            finally:
+                await response.aclose()
+
+        headers = {
+            name: response.headers[name]
+            for name in (
+                "content-type",
+                "content-length",
+                "content-range",
+                "accept-ranges",
+                "etag",
+                "last-modified",
+            )
+            if name in response.headers
+        }
+        return Download(chunks(), response.status_code, headers)
+
+    async def list(self, prefix: str) -> list[Attachment]:
+        response = await self.client.post(
+            f"/object/list/{self.bucket}",
+            json={"prefix": prefix, "limit": 1000, "offset": 0},
+        )
+        response.raise_for_status()
+        return [
+            Attachment(
+                name=obj["name"],
+                size=(obj.get("metadata") or {}).get("size", 0),
+                content_type=(obj.get("metadata") or {}).get("mimetype"),
+            )
+            for obj in response.json()
+            if obj.get("id")  # folders have no id
+        ]
+
+    async def delete(self, path: str) -> None:
+        response = await self.client.delete(self._object(path))
+        if response.status_code in (400, 404):
+            raise HTTPException(status_code=404, detail="Attachment not found")
+        response.raise_for_status()
+
+    async def signed_upload_url(self, path: str) -> str:
+        response = await self.client.post(
+            f"/object/upload/sign/{self.bucket}/{quote(path)}",
+            headers={"x-upsert": "true"},
+        )
+        response.raise_for_status()
+        return f"{self.url}{response.json()['url']}"
+
+    async def signed_download_url(self, path: str, expires_in: int) -> str:
+        response = await self.client.post(
+            f"/object/sign/{self.bucket}/{quote(path)}", json={"expiresIn": expires_in}
+        )
+        if response.status_code in (400, 404):
+            raise HTTPException(status_code=404, detail="Attachment not found")
+        response.raise_for_status()
+        return f"{self.url}{response.json()['signedURL']}"
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+class LocalStorage:
+    """objects as files under `root`, for tests and local development"""
+
+    def __init__(self, root: str | Path, *, chunk_size: int = 64 * 1024) -> None:
+        self.root = Path(root).resolve()
+        self.chunk_size = chunk_size
+
+    def _file(self, path: str) -> Path:
+        file = (self.root / path).resolve()
+        if not file.is_relative_to(self.root):
+            raise HTTPException(status_code=400, detail="Invalid attachment path")
+        return file
+
+    async def upload(
+        self,
+        path: str,
+        chunks: AsyncIterator[bytes],
+        *,
+        content_type: str,  # noqa: ARG002
+        size: int | None = None,  # noqa: ARG002
+    ) -> int:
+        file = self._file(path)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        partial = file.with_name(f".{file.name}.{uuid.uuid4().hex}")
+        written = 0
+        try:
+            async with await anyio.open_file(partial, "wb") as f:
+                async for chunk in chunks:
+                    await f.write(chunk)
+                    written += len(chunk)
+            os.replace(partial, file)
+        finally:
+            partial.unlink(missing_ok=True)
+        return written
+
+    async def download(self, path: str, *, range: str | None = None) -> Download:
+        file = self._file(path)
+        if not file.is_file():
+            raise HTTPException(status_code=404, detail="Attachment not found")
+        size = file.stat().st_size
+        start, end, status_code = 0, size - 1, 200
+        headers = {"accept-ranges": "bytes", "content-type": "application/octet-stream"}
+        if range:
+            match = _RANGE.fullmatch(range.strip())
+            if not match or match.groups() == ("", ""):
+                raise HTTPException(status_code=416, detail="Range not satisfiable")
+            first, last = match.groups()
+            if first:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+            else:
+                start = max(size - int(last), 0)
+            if start > end:
+                raise HTTPException(status_code=416, detail="Range not satisfiable")
+            status_code = 206
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+        headers["content-length"] = str(end - start + 1)
+
+        async def chunks() -> AsyncIterator[bytes]:
+            remaining = end - start + 1
+            async with await anyio.open_file(file, "rb") as f:
+                await f.seek(start)
+                while remaining > 0:
+                    chunk = await f.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+
+        return Download(chunks(), status_code, headers)
+
+    async def list(self, prefix: str) -> list[Attachment]:
+        folder = self._file(prefix)
+        if not folder.is_dir():
+            return []
+        return [
+            Attachment(name=file.name, size=file.stat().st_size)
+            for file in sorted(folder.iterdir())
+            if file.is_file() and not file.name.startswith(".")
+        ]
+
+    async def delete(self, path: str) -> None:
+        file = self._file(path)
+        if not file.is_file():
+            raise HTTPException(status_code=404, detail="Attachment not found")
+        file.unlink()
+
+    async def signed_upload_url(self, path: str) -> str:
+        """local files need no signature, the client writes them directly"""
+        return self._file(path).as_uri()
+
+    async def signed_download_url(self, path: str, expires_in: int) -> str:  # noqa: ARG002
+        return self._file(path).as_uri()
+
+    async def aclose(self) -> None:
+        pass
+
+
+_storage: Storage | None = None
+
+
+def get_storage() -> Storage:
+    """the configured storage, shared so its HTTP connections are reused"""
+    global _storage
+    if _storage is None:
+        if settings.STORAGE_BACKEND == "local":
+            _storage = LocalStorage(settings.STORAGE_LOCAL_PATH)
+        else:
+            _storage = SupabaseStorage(
+                settings.SUPABASE_URL,
+                settings.SUPABASE_KEY,
+                settings.STORAGE_BUCKET,
+                chunk_size=settings.STORAGE_CHUNK_SIZE,
+                resumable_threshold=settings.STORAGE_RESUMABLE_THRESHOLD,
+            )
+    return _storage
+
+
+async def close_storage() -> None:
+    global _storage
+    if _storage is not None:
+        await _storage.aclose()
+        _storage = None
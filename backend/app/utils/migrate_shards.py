@@ -0,0 +1,53 @@
+"""apply Alembic revisions to every database of POSTGRES_SHARD_URIS
+
+    python -m app.utils.migrate_shards [revision]
+
+the primary is migrated by `alembic upgrade head` as before. shards are plain
+Postgres databases without Supabase's auth schema, so their tables get no
+foreign keys to auth.users and deleting a user does not cascade to them
+"""
+
+import logging
+import sys
+from collections.abc import Sequence
+from pathlib import Path
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import make_url
+
+from app.core.config import normalize_dsn, settings
+from app.core.shard import shard_name
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BACKEND = Path(__file__).resolve().parents[2]
+
+
+def migrate(urls: Sequence[str], revision: str = "head") -> None:
+    """upgrade one shard after the other, stopping at the first failure"""
+    for dsn in urls:
+        # psycopg 3 like the app, app.alembic.helpers relies on it
+        url = normalize_dsn(dsn)
+        config = Config(str(BACKEND / "alembic.ini"))
+        config.set_main_option("script_location", str(BACKEND / "app" / "alembic"))
+        config.attributes["url"] = url
+        # no auth.users foreign keys, see app.alembic.helpers.users_fk
+        config.attributes["shard"] = True
+        config.attributes["configure_logger"] = False
+        logger.info("Migrating shard %s to %s", shard_name(make_url(url)), revision)
+        command.upgrade(config, revision)
+
+
+def main() -> None:
+    revision = sys.argv[1] if len(sys.argv) > 1 else "head"
+    if not settings.POSTGRES_SHARD_URIS:
+        logger.info("No shards configured")
+        return
+    migrate(settings.POSTGRES_SHARD_URIS, revision)
+    logger.info("Shards migrated")
+
+
+if __name__ == "__main__":
+    main()
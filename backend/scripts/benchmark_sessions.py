@@ -0,0 +1,48 @@
+"""per-request overhead of SessionDep against the read-only ReadSessionDep
+
+runs what a GET /items/get-item/{id} does with either dependency: open the
+session, look an item up by id, close the session. needs the database of
+.env with migrations applied:
+
+    python scripts/benchmark_sessions.py [requests]
+"""
+
+import sys
+import time
+import uuid
+from collections.abc import Callable, Generator
+
+from fastapi import Request
+from sqlmodel import Session
+
+from app.core.db import get_db, get_read_db
+from app.crud import item
+
+REQUEST = Request({"type": "http", "headers": [], "client": ("127.0.0.1", 5000)})
+
+
+def run(
+    dependency: Callable[[Request], Generator[Session, None]], requests: int
+) -> float:
+    ids = [uuid.uuid4() for _ in range(requests)]
+    start = time.perf_counter()
+    for id in ids:
+        sessions = dependency(REQUEST)
+        session = next(sessions)
+        item.get(session, id=id)
+        sessions.close()
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main() -> None:
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    # connect and compile first, only the steady state is measured
+    run(get_db, 100)
+    run(get_read_db, 100)
+    print(f"{'us/request':<40} {'wall':>8}")
+    for name, dependency in (("SessionDep", get_db), ("ReadSessionDep", get_read_db)):
+        print(f"{name:<40} {run(dependency, requests):8.2f}")
+
+
+if __name__ == "__main__":
+    main()
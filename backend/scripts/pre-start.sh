@@ -13,6 +13,7 @@ python -m app.utils.test_pre_start
 
 # Run migrations
 alembic upgrade head
+python -m app.utils.migrate_shards
 
 # Create initial data in DB
 python -m app.utils.init_data
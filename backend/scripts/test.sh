@@ -3,6 +3,6 @@
 set -e
 set -x
 
-coverage run --source=app -m pytest
+coverage run --source=app -m pytest --supabase
 coverage report --show-missing
 coverage html --title "${@-coverage}"
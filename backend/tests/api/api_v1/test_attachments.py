@@ -0,0 +1,180 @@
+import uuid
+from collections.abc import Generator
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from gotrue import User
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.main import app
+from app.models import User as DBUser
+from app.models.item import Item
+from app.schemas.auth import Token
+from app.services.storage import LocalStorage, get_storage
+from tests.utils import create_access_token, get_auth_header
+
+
+@pytest.fixture(scope="function")
+def storage(tmp_path: Path) -> Generator[LocalStorage, None]:
+    storage = LocalStorage(tmp_path, chunk_size=4)
+    app.dependency_overrides[get_storage] = lambda: storage
+    yield storage
+    app.dependency_overrides.pop(get_storage)
+
+
+def attachments_url(item: Item, name: str = "") -> str:
+    return f"{settings.API_V1_STR}/items/{item.id}/attachments/{name}".rstrip("/")
+
+
+def test_upload_and_download(
+    client: TestClient, token: Token, test_item: Item, storage: LocalStorage
+) -> None:
+    """Test an attachment is streamed up, listed, downloaded and deleted"""
+    headers = get_auth_header(token.access_token)
+    body = b"0123456789" * 10
+    response = client.put(
+        attachments_url(test_item, "notes.txt"),
+        headers={**headers, "Content-Type": "text/plain"},
+        content=iter([body[:33], body[33:]]),
+    )
+    assert response.status_code == 200
+    assert response.json()["size"] == len(body)
+
+    response = client.get(attachments_url(test_item), headers=headers)
+    assert response.json() == [{"name": "notes.txt", "size": 100, "content_type": None}]
+
+    response = client.get(attachments_url(test_item, "notes.txt"), headers=headers)
+    assert response.status_code == 200
+    assert response.content == body
+
+    response = client.delete(attachments_url(test_item, "notes.txt"), headers=headers)
+    assert response.status_code == 204
+    response = client.get(attachments_url(test_item, "notes.txt"), headers=headers)
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize(
+    ("range", "content", "content_range"),
+    [
+        ("bytes=2-5", b"2345", "bytes 2-5/10"),
+        ("bytes=7-", b"789", "bytes 7-9/10"),
+        ("bytes=-3", b"789", "bytes 7-9/10"),
+        ("bytes=8-100", b"89", "bytes 8-9/10"),
+    ],
+)
+def test_download_range(
+    client: TestClient,
+    token: Token,
+    test_item: Item,
+    storage: LocalStorage,
+    range: str,
+    content: bytes,
+    content_range: str,
+) -> None:
+    """Test range requests return the requested bytes with a 206"""
+    headers = get_auth_header(token.access_token)
+    client.put(
+        attachments_url(test_item, "digits"), headers=headers, content=b"0123456789"
+    )
+
+    response = client.get(
+        attachments_url(test_item, "digits"), headers={**headers, "Range": range}
+    )
+    assert response.status_code == 206
+    assert response.content == content
+    assert response.headers["content-range"] == content_range
+
+
+def test_download_range_not_satisfiable(
+    client: TestClient, token: Token, test_item: Item, storage: LocalStorage
+) -> None:
+    """Test a range past the end of the attachment is a 416"""
+    headers = get_auth_header(token.access_token)
+    client.put(
+        attachments_url(test_item, "digits"), headers=headers, content=b"0123456789"
+    )
+
+    response = client.get(
+        attachments_url(test_item, "digits"), headers={**headers, "Range": "bytes=20-"}
+    )
+    assert response.status_code == 416
+
+
+def test_upload_too_large(
+    client: TestClient,
+    token: Token,
+    test_item: Item,
+    storage: LocalStorage,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test uploads over the limit are rejected with or without Content-Length"""
+    monkeypatch.setattr(settings, "STORAGE_MAX_UPLOAD_BYTES", 10)
+    headers = get_auth_header(token.access_token)
+
+    response = client.put(
+        attachments_url(test_item, "big"), headers=headers, content=b"x" * 11
+    )
+    assert response.status_code == 413
+    # without Content-Length the limit applies while streaming
+    response = client.put(
+        attachments_url(test_item, "big"),
+        headers=headers,
+        content=iter([b"x" * 6, b"x" * 6]),
+    )
+    assert response.status_code == 413
+    # the partial file is removed
+    assert not [path for path in storage.root.rglob("*") if path.is_file()]
+
+
+def test_attachments_of_other_user(
+    client: TestClient, db: Session, test_item: Item, storage: LocalStorage
+) -> None:
+    """Test another user's item attachments are not found"""
+    other = DBUser(id=uuid.uuid4(), email="other@example.com")
+    db.add(other)
+    db.flush()
+    token = create_access_token(
+        User(
+            id=str(other.id),
+            email=other.email,
+            aud="authenticated",
+            app_metadata={},
+            user_metadata={},
+            created_at=datetime.now(timezone.utc),
+        )
+    )
+
+    response = client.get(attachments_url(test_item), headers=get_auth_header(token))
+    assert response.status_code == 404
+
+
+def test_signed_urls(
+    client: TestClient, token: Token, test_item: Item, storage: LocalStorage
+) -> None:
+    """Test signed upload and download URLs point at the attachment"""
+    headers = get_auth_header(token.access_token)
+    response = client.post(
+        f"{attachments_url(test_item, 'report.pdf')}/upload-url", headers=headers
+    )
+    assert response.status_code == 200
+    assert response.json()["url"].endswith(f"{test_item.id}/report.pdf")
+
+    response = client.get(
+        f"{attachments_url(test_item, 'report.pdf')}/download-url", headers=headers
+    )
+    assert response.json()["expires_in"] == settings.STORAGE_SIGNED_URL_SECONDS
+
+
+def test_invalid_attachment_name(
+    client: TestClient, token: Token, test_item: Item, storage: LocalStorage
+) -> None:
+    """Test attachment names starting with a dot are rejected"""
+    response = client.put(
+        attachments_url(test_item, "..hidden"),
+        headers=get_auth_header(token.access_token),
+        content=b"x",
+    )
+    assert response.status_code == 400
@@ -1,27 +1,34 @@
+import asyncio
+import uuid
+
 from faker import Faker
 from fastapi.testclient import TestClient
+from gotrue import User
 
 from app.core.config import settings
+from app.core.write_buffer import get_item_buffer
+from app.main import app
 from app.models.item import Item, ItemCreate, ItemUpdate
 from app.schemas.auth import Token
-from tests.utils import get_auth_header
+from tests.utils import MaxQueries, create_access_token, get_auth_header
 
 fake = Faker()
 
 
-def test_create_item(client: TestClient, token: Token) -> None:
+def test_create_item(client: TestClient, token: Token, max_queries: MaxQueries) -> None:
     """Test create item endpoint"""
     # Prepare test data
     title = fake.sentence(nb_words=3)
     description = fake.text(max_nb_chars=200)
     item_in = ItemCreate(title=title, description=description)
 
-    # Make request
-    response = client.post(
-        f"{settings.API_V1_STR}/items/create-item",
-        headers=get_auth_header(token.access_token),
-        json=item_in.model_dump(),
-    )
+    # Make request, INSERT and refresh
+    with max_queries(2):
+        response = client.post(
+            f"{settings.API_V1_STR}/items/create-item",
+            headers=get_auth_header(token.access_token),
+            json=item_in.model_dump(),
+        )
 
     # Assert response
     assert response.status_code == 200
@@ -32,13 +39,39 @@ def test_create_item(client: TestClient, token: Token) -> None:
     assert "owner_id" in data
 
 
-def test_get_item(client: TestClient, token: Token, test_item: Item) -> None:
+def test_create_item_buffered(client: TestClient, token: Token) -> None:
+    """Test the sync route hands creates to the write buffer on the event loop"""
+    loops: list[asyncio.AbstractEventLoop] = []
+
+    class Buffer:
+        async def create(self, *, owner_id: uuid.UUID, obj_in: ItemCreate) -> Item:
+            loops.append(asyncio.get_running_loop())
+            return Item(owner_id=owner_id, **obj_in.model_dump())
+
+    app.dependency_overrides[get_item_buffer] = Buffer
+    try:
+        response = client.post(
+            f"{settings.API_V1_STR}/items/create-item",
+            headers=get_auth_header(token.access_token),
+            json={"title": "buffered"},
+        )
+    finally:
+        app.dependency_overrides.pop(get_item_buffer)
+    assert response.status_code == 200
+    assert response.json()["title"] == "buffered"
+    assert len(loops) == 1
+
+
+def test_get_item(
+    client: TestClient, token: Token, test_item: Item, max_queries: MaxQueries
+) -> None:
     """Test get item by id endpoint"""
     # Make request
-    response = client.get(
-        f"{settings.API_V1_STR}/items/get-item/{test_item.id}",
-        headers=get_auth_header(token.access_token),
-    )
+    with max_queries(1):
+        response = client.get(
+            f"{settings.API_V1_STR}/items/get-item/{test_item.id}",
+            headers=get_auth_header(token.access_token),
+        )
 
     # Assert response
     assert response.status_code == 200
@@ -49,13 +82,16 @@ def test_get_item(client: TestClient, token: Token, test_item: Item) -> None:
     assert data["owner_id"] == str(test_item.owner_id)
 
 
-def test_get_items(client: TestClient, token: Token, test_item: Item) -> None:
+def test_get_items(
+    client: TestClient, token: Token, test_item: Item, max_queries: MaxQueries
+) -> None:
     """Test get items list endpoint"""
     # Make request
-    response = client.get(
-        f"{settings.API_V1_STR}/items/get-items",
-        headers=get_auth_header(token.access_token),
-    )
+    with max_queries(1):
+        response = client.get(
+            f"{settings.API_V1_STR}/items/get-items",
+            headers=get_auth_header(token.access_token),
+        )
 
     # Assert response
     assert response.status_code == 200
@@ -68,19 +104,56 @@ def test_get_items(client: TestClient, token: Token, test_item: Item) -> None:
     assert str(test_item.id) in item_ids
 
 
-def test_update_item(client: TestClient, token: Token, test_item: Item) -> None:
+def test_items_scoped_to_owner(
+    client: TestClient, test_user: User, test_item: Item
+) -> None:
+    """Test item routes need a token and only see the caller's own items"""
+    url = f"{settings.API_V1_STR}/items"
+    assert client.get(f"{url}/get-item/{test_item.id}").status_code == 401
+    assert client.get(f"{url}/get-items").status_code == 401
+
+    other = test_user.model_copy(update={"id": str(uuid.uuid4())})
+    headers = get_auth_header(create_access_token(other))
+    assert client.get(f"{url}/get-item/{test_item.id}", headers=headers).json() is None
+    items = client.get(f"{url}/get-items", headers=headers).json()
+    assert str(test_item.id) not in [item["id"] for item in items]
+    response = client.put(
+        f"{url}/update-item/{test_item.id}", headers=headers, json={"title": "x"}
+    )
+    assert response.json() is None
+    assert client.delete(f"{url}/delete/{test_item.id}", headers=headers).json() is None
+
+
+def test_get_all_items(client: TestClient, test_user: User, test_item: Item) -> None:
+    """Test only the superuser lists the items of every owner"""
+    url = f"{settings.API_V1_STR}/items/get-all-items"
+    headers = get_auth_header(create_access_token(test_user))
+    assert client.get(url, headers=headers).status_code == 403
+
+    superuser = test_user.model_copy(
+        update={"id": str(uuid.uuid4()), "email": settings.FIRST_SUPERUSER}
+    )
+    response = client.get(url, headers=get_auth_header(create_access_token(superuser)))
+    assert response.status_code == 200
+    assert str(test_item.id) in [item["id"] for item in response.json()]
+
+
+def test_update_item(
+    client: TestClient, token: Token, test_item: Item, max_queries: MaxQueries
+) -> None:
     """Test update item endpoint"""
     # Prepare update data
     new_title = fake.sentence(nb_words=3)
     new_description = fake.text(max_nb_chars=200)
     item_update = ItemUpdate(title=new_title, description=new_description)
 
-    # Make request
-    response = client.put(
-        f"{settings.API_V1_STR}/items/update-item/{test_item.id}",
-        headers=get_auth_header(token.access_token),
-        json=item_update.model_dump(),
-    )
+    # Make request, SELECT, UPDATE and refresh
+    with max_queries(3):
+        response = client.put(
+            f"{settings.API_V1_STR}/items/update-item/{test_item.id}",
+            headers=get_auth_header(token.access_token),
+            json=item_update.model_dump(),
+        )
 
     # Assert response
     assert response.status_code == 200
@@ -91,13 +164,16 @@ def test_update_item(client: TestClient, token: Token, test_item: Item) -> None:
     assert data["owner_id"] == str(test_item.owner_id)
 
 
-def test_delete_item(client: TestClient, token: Token, test_item) -> None:
+def test_delete_item(
+    client: TestClient, token: Token, test_item, max_queries: MaxQueries
+) -> None:
     """Test delete item endpoint"""
-    # Make delete request
-    response = client.delete(
-        f"{settings.API_V1_STR}/items/delete/{test_item.id}",
-        headers=get_auth_header(token.access_token),
-    )
+    # Make delete request, SELECT and DELETE
+    with max_queries(2):
+        response = client.delete(
+            f"{settings.API_V1_STR}/items/delete/{test_item.id}",
+            headers=get_auth_header(token.access_token),
+        )
 
     # Assert delete response
     assert response.status_code == 200
@@ -111,3 +187,110 @@ def test_delete_item(client: TestClient, token: Token, test_item) -> None:
     )
     assert get_response.status_code == 200
     assert get_response.json() is None
+
+
+def test_upsert_item(client: TestClient, token: Token, max_queries: MaxQueries) -> None:
+    """Test upsert endpoint creates once and then updates in place"""
+    item_in = ItemCreate(title=fake.sentence(nb_words=3), external_key="sync-1")
+    headers = get_auth_header(token.access_token)
+
+    # INSERT ... ON CONFLICT DO UPDATE ... RETURNING
+    with max_queries(1):
+        response = client.put(
+            f"{settings.API_V1_STR}/items/upsert-item",
+            headers=headers,
+            json=item_in.model_dump(),
+        )
+    assert response.status_code == 200
+    created = response.json()
+
+    item_in.title = "updated"
+    with max_queries(1):
+        response = client.put(
+            f"{settings.API_V1_STR}/items/upsert-item",
+            headers=headers,
+            json=item_in.model_dump(),
+        )
+    assert response.json()["id"] == created["id"]
+    assert response.json()["title"] == "updated"
+
+    # external_key is required
+    response = client.put(
+        f"{settings.API_V1_STR}/items/upsert-item",
+        headers=headers,
+        json={"title": "no key"},
+    )
+    assert response.status_code == 422
+
+
+def test_duplicate_external_key(client: TestClient, token: Token) -> None:
+    """Test creating or updating to an external_key in use is a 409, not a 500"""
+    headers = get_auth_header(token.access_token)
+    url = f"{settings.API_V1_STR}/items"
+    response = client.post(
+        f"{url}/create-item", headers=headers, json={"title": "a", "external_key": "k"}
+    )
+    assert response.status_code == 200
+    response = client.post(
+        f"{url}/create-item", headers=headers, json={"title": "b", "external_key": "k"}
+    )
+    assert response.status_code == 409
+
+    response = client.post(f"{url}/create-item", headers=headers, json={"title": "c"})
+    response = client.put(
+        f"{url}/update-item/{response.json()['id']}",
+        headers=headers,
+        json={"external_key": "k"},
+    )
+    assert response.status_code == 409
+
+
+def test_create_item_idempotent(
+    client: TestClient, token: Token, max_queries: MaxQueries
+) -> None:
+    """Test retries with the same Idempotency-Key replay the first response"""
+    item_in = ItemCreate(title=fake.sentence(nb_words=3))
+    headers = {**get_auth_header(token.access_token), "Idempotency-Key": "retry-1"}
+
+    # SELECT key, INSERT item and INSERT key
+    with max_queries(3):
+        response = client.post(
+            f"{settings.API_V1_STR}/items/create-item",
+            headers=headers,
+            json=item_in.model_dump(),
+        )
+    assert response.status_code == 200
+    created = response.json()
+
+    # SELECT key
+    with max_queries(1):
+        response = client.post(
+            f"{settings.API_V1_STR}/items/create-item",
+            headers=headers,
+            json=item_in.model_dump(),
+        )
+    assert response.status_code == 200
+    assert response.json() == created
+    assert response.headers["Idempotent-Replayed"] == "true"
+
+    # the key is bound to the first request body
+    response = client.post(
+        f"{settings.API_V1_STR}/items/create-item",
+        headers=headers,
+        json={"title": "something else"},
+    )
+    assert response.status_code == 422
+
+
+def test_get_item_stats(
+    client: TestClient, token: Token, test_item: Item, max_queries: MaxQueries
+) -> None:
+    """Test stats are read from the per-owner summary row"""
+    with max_queries(1):
+        response = client.get(
+            f"{settings.API_V1_STR}/items/stats",
+            headers=get_auth_header(token.access_token),
+        )
+    assert response.status_code == 200
+    assert response.json()["item_count"] == 1
+    assert response.json()["last_activity_at"] is not None
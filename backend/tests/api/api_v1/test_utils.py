@@ -1,6 +1,11 @@
+import time
+
 from fastapi.testclient import TestClient
+from gotrue import User
 
 from app.core.config import settings
+from app.core.profiling import sign_profile_header
+from tests.utils import create_access_token, get_auth_header
 
 
 def test_get_item(client: TestClient) -> None:
@@ -11,3 +16,81 @@ def test_get_item(client: TestClient) -> None:
     # Assert response
     assert response.status_code == 200
     assert response.content
+
+
+def test_profile_request(client: TestClient) -> None:
+    """Test a signed X-Profile header profiles the request"""
+    header = sign_profile_header(int(time.time()) + 60)
+    response = client.get(
+        f"{settings.API_V1_STR}/utils/health-check/", headers={"X-Profile": header}
+    )
+    assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+
+    response = client.get(
+        f"{settings.API_V1_STR}/utils/profile", headers={"X-Profile": header}
+    )
+    assert response.status_code == 200
+    assert response.json()[0]["id"] == profile_id
+    assert response.json()[0]["path"] == f"{settings.API_V1_STR}/utils/health-check/"
+
+    response = client.get(
+        f"{settings.API_V1_STR}/utils/profile/{profile_id}",
+        headers={"X-Profile": header},
+    )
+    assert response.status_code == 200
+    assert response.json()["exporter"] == "pyinstrument"
+
+
+def test_profile_request_unsigned(client: TestClient) -> None:
+    """Test expired or forged X-Profile headers are ignored"""
+    expired = sign_profile_header(int(time.time()) - 1)
+    forged = f"{int(time.time()) + 60}.{'0' * 64}"
+    for header in (expired, forged):
+        response = client.get(
+            f"{settings.API_V1_STR}/utils/health-check/", headers={"X-Profile": header}
+        )
+        assert response.status_code == 200
+        assert "X-Profile-Id" not in response.headers
+
+        response = client.get(
+            f"{settings.API_V1_STR}/utils/profile", headers={"X-Profile": header}
+        )
+        assert response.status_code == 403
+
+
+def test_ready_after_warm_up(client: TestClient) -> None:
+    """Test readiness turns 200 once the startup warm-up finished"""
+    for _ in range(100):
+        response = client.get(f"{settings.API_V1_STR}/utils/ready")
+        if response.status_code == 200:
+            break
+        assert response.status_code == 503
+        time.sleep(0.1)
+    assert response.status_code == 200
+
+
+def test_openapi_encoded_once(client: TestClient) -> None:
+    """Test the OpenAPI schema is served from the cached encoding"""
+    first = client.get(f"{settings.API_V1_STR}/openapi.json")
+    second = client.get(f"{settings.API_V1_STR}/openapi.json")
+    assert first.status_code == 200
+    assert first.headers["content-type"] == "application/json"
+    assert first.content == second.content
+    assert first.json() == client.app.openapi()  # type: ignore[attr-defined]
+
+
+def test_write_buffer_stats_superuser_only(client: TestClient, test_user: User) -> None:
+    """Test the write buffer stats are only shown to the superuser"""
+    url = f"{settings.API_V1_STR}/utils/write-buffer"
+    assert client.get(url).status_code == 401
+
+    token = create_access_token(test_user)
+    response = client.get(url, headers=get_auth_header(token))
+    assert response.status_code == 403
+
+    superuser = test_user.model_copy(update={"email": settings.FIRST_SUPERUSER})
+    token = create_access_token(superuser)
+    response = client.get(url, headers=get_auth_header(token))
+    assert response.status_code == 200
+    assert response.json()["running"] is False
@@ -1,40 +1,130 @@
+import os
 import uuid
 from collections.abc import Generator
+from contextlib import contextmanager
+from datetime import datetime, timezone
 
 import pytest
 from faker import Faker
 from fastapi.testclient import TestClient
 from gotrue import User
-from sqlmodel import Session, delete
+from sqlalchemy import Engine, text
+from sqlmodel import Session, SQLModel, create_engine
 from supabase import Client, create_client
 
 from app import crud
+from app.core.auth import TokenDep, get_current_user
 from app.core.config import settings
-from app.core.db import engine, init_db
+from app.core.db import engine, get_db, get_read_db
+from app.core.instrumentation import QueryStats, count_queries, instrument_engine
+from app.core.log import set_user_id
 from app.main import app
+from app.models import User as DBUser
 from app.models.item import Item, ItemCreate
-from app.schemas.auth import Token
+from app.schemas.auth import Token, UserIn
+from tests.utils import MaxQueries, create_access_token, decode_access_token
 
 
-@pytest.fixture(scope="module")
-def db() -> Generator[Session, None]:
-    with Session(engine) as session:
-        init_db(session)
-        yield session
-        statement = delete(Item)
-        session.exec(statement)  # type: ignore
-        session.commit()
+def pytest_addoption(parser: pytest.Parser) -> None:
+    parser.addoption(
+        "--supabase",
+        action="store_true",
+        help="also run the tests that need a running Supabase stack",
+    )
+
+
+def pytest_collection_modifyitems(
+    config: pytest.Config, items: list[pytest.Item]
+) -> None:
+    if config.getoption("--supabase"):
+        return
+    skip = pytest.mark.skip(reason="needs a running Supabase stack, use --supabase")
+    for item in items:
+        if "supabase" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope="session")
+def anyio_backend() -> str:
+    """`pytest.mark.anyio` tests run on asyncio, like the app"""
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+def test_engine() -> Generator[Engine, None]:
+    """engine on a schema of its own per xdist worker, so `pytest -n auto` works"""
+    schema = f"test_{os.environ.get('PYTEST_XDIST_WORKER', 'main')}"
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+
+    test_engine = create_engine(
+        str(settings.SQLALCHEMY_DATABASE_URI),
+        connect_args={"options": f"-csearch_path={schema},public"},
+    )
+    instrument_engine(test_engine)
+    # auth.users belongs to Supabase, only the app tables are created, without
+    # checking for them first as migrated tables in public would be found
+    SQLModel.metadata.create_all(
+        test_engine,
+        tables=[t for t in SQLModel.metadata.sorted_tables if t.schema is None],
+        checkfirst=False,
+    )
+    yield test_engine
+    test_engine.dispose()
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+
+
+@pytest.fixture(scope="function")
+def db(test_engine: Engine) -> Generator[Session, None]:
+    """session in a transaction rolled back after the test
+
+    commits only release SAVEPOINTs, requests of the test share the session
+    """
+    with test_engine.connect() as connection:
+        transaction = connection.begin()
+        session = Session(bind=connection, join_transaction_mode="create_savepoint")
+        app.dependency_overrides[get_db] = lambda: session
+        app.dependency_overrides[get_read_db] = lambda: session
+        try:
+            yield session
+        finally:
+            app.dependency_overrides.pop(get_db)
+            app.dependency_overrides.pop(get_read_db)
+            session.close()
+            transaction.rollback()
+
+
+async def get_test_user(token: TokenDep) -> UserIn:
+    """validate tokens minted by `create_access_token` instead of asking GoTrue"""
+    claims = decode_access_token(token)
+    set_user_id(claims["sub"])
+    return UserIn(
+        id=claims["sub"],
+        email=claims["email"],
+        aud=claims["aud"],
+        role=claims["role"],
+        app_metadata={},
+        user_metadata={},
+        created_at=datetime.fromtimestamp(claims["iat"], timezone.utc),
+        access_token=token,
+    )
 
 
 @pytest.fixture(scope="module")
 def client() -> Generator[TestClient, None, None]:
+    app.dependency_overrides[get_current_user] = get_test_user
     with TestClient(app) as c:
         yield c
+    app.dependency_overrides.pop(get_current_user)
 
 
 @pytest.fixture(scope="session", autouse=True)
-def global_cleanup() -> Generator[None, None]:
+def global_cleanup(request: pytest.FixtureRequest) -> Generator[None, None]:
     yield
+    if not request.config.getoption("--supabase"):
+        return
     # Clean up all users
     super_client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
     users = super_client.auth.admin.list_users()
@@ -52,11 +142,19 @@ fake = Faker()
 
 
 @pytest.fixture(scope="function")
-def test_user(super_client: Client) -> Generator[User, None]:
-    response = super_client.auth.sign_up(
-        {"email": fake.email(), "password": "testpassword123"}
+def test_user(db: Session) -> Generator[User, None]:
+    """user row in auth.users, rolled back with the test transaction"""
+    db_user = DBUser(id=uuid.uuid4(), email=fake.email())
+    db.add(db_user)
+    db.flush()
+    yield User(
+        id=str(db_user.id),
+        email=db_user.email,
+        aud="authenticated",
+        app_metadata={},
+        user_metadata={},
+        created_at=datetime.now(timezone.utc),
     )
-    yield response.user
 
 
 @pytest.fixture(scope="function")
@@ -68,8 +166,31 @@ def test_item(db: Session, test_user: User) -> Generator[Item, None]:
 
 
 @pytest.fixture(scope="function")
-def token(super_client: Client) -> Generator[Token, None]:
-    response = super_client.auth.sign_up(
-        {"email": fake.email(), "password": "testpassword123"}
-    )
-    yield Token(access_token=response.session.access_token)
+def token(test_user: User) -> Generator[Token, None]:
+    yield Token(access_token=create_access_token(test_user))
+
+
+@pytest.fixture(scope="function")
+def max_queries(test_engine: Engine) -> MaxQueries:
+    """assert an endpoint runs at most `limit` statements
+
+    with max_queries(1):
+        client.get(...)
+    """
+
+    @contextmanager
+    def _max_queries(limit: int) -> Generator[QueryStats, None, None]:
+        with count_queries(test_engine) as stats:
+            yield stats
+        # savepoints only stand in for the commits of the test transaction
+        statements = {
+            statement: count
+            for statement, count in stats.statements.items()
+            if not statement.startswith(("SAVEPOINT", "RELEASE", "ROLLBACK TO"))
+        }
+        count = sum(statements.values())
+        assert count <= limit, (
+            f"expected at most {limit} queries, got {count}: {statements}"
+        )
+
+    return _max_queries
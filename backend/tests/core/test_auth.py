@@ -0,0 +1,98 @@
+import time
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+from fastapi import HTTPException
+from gotrue import User
+from gotrue.errors import AuthApiError, AuthRetryableError  # type: ignore
+
+from app.core import auth
+from app.core.auth import validate_token
+from app.core.breaker import CircuitBreaker, RetryBudget, State
+from tests.utils import create_access_token
+
+
+@pytest.fixture(autouse=True)
+def breaker(monkeypatch: pytest.MonkeyPatch) -> CircuitBreaker:
+    """a fresh breaker, budget and grace cache per test"""
+    breaker = CircuitBreaker("test", min_calls=2, is_failure=auth.is_outage)
+    monkeypatch.setattr(auth, "auth_breaker", breaker)
+    monkeypatch.setattr(auth, "auth_retry_budget", RetryBudget())
+    monkeypatch.setattr(auth, "grace_cache", auth.GraceCache(60, 10))
+    return breaker
+
+
+def client(*responses: Any) -> Any:
+    """super client answering get_user with `responses`, exceptions are raised"""
+    calls = iter(responses)
+
+    async def get_user(jwt: str) -> Any:  # noqa: ARG001
+        response = next(calls)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    return SimpleNamespace(auth=SimpleNamespace(get_user=get_user))
+
+
+@pytest.mark.anyio
+async def test_retry_outage(test_user: User) -> None:
+    """Test outages are retried and rejected tokens are not"""
+    answer = SimpleNamespace(user=test_user)
+    super_client = client(AuthRetryableError("down", 503), answer)
+    assert (await validate_token("token", super_client)).id == test_user.id
+
+    super_client = client(AuthApiError("invalid JWT", 401, "bad_jwt"), answer)
+    with pytest.raises(AuthApiError):
+        await validate_token("token", super_client)
+
+
+@pytest.mark.anyio
+async def test_open_breaker(breaker: CircuitBreaker) -> None:
+    """Test requests fail fast with a 503 while the breaker is open"""
+    outage = AuthRetryableError("down", 0)
+    with pytest.raises(HTTPException) as e:
+        await validate_token("token", client(outage, outage, outage))
+    assert breaker.state is State.OPEN
+    assert e.value.status_code == 503
+
+    with pytest.raises(HTTPException) as e:
+        await validate_token("token", client())
+    assert e.value.status_code == 503
+    assert e.value.headers == {"Retry-After": "10"}
+
+
+@pytest.mark.anyio
+async def test_grace(test_user: User, breaker: CircuitBreaker) -> None:
+    """Test recently validated tokens pass during an outage, for reads only"""
+    token = create_access_token(test_user)
+    await validate_token(token, client(SimpleNamespace(user=test_user)))
+    breaker._open()
+
+    user = await validate_token(token, client(), grace=True)
+    assert user.id == test_user.id
+    other = create_access_token(test_user, expires_in=60)
+    for rejected, grace in ((token, False), (other, True)):
+        with pytest.raises(HTTPException):
+            await validate_token(rejected, client(), grace=grace)
+
+
+@pytest.mark.anyio
+async def test_grace_until_token_expiry(
+    test_user: User, breaker: CircuitBreaker
+) -> None:
+    """Test the grace cache never serves a token after its exp"""
+    token = create_access_token(test_user, expires_in=10)
+    user = await validate_token(token, client(SimpleNamespace(user=test_user)))
+    breaker._open()
+    assert (await validate_token(token, client(), grace=True)).id == test_user.id
+
+    auth.grace_cache.wall_clock = lambda: time.time() + 10
+    with pytest.raises(HTTPException) as e:
+        await validate_token(token, client(), grace=True)
+    assert e.value.status_code == 503
+
+    # without an exp a token is not kept at all
+    auth.grace_cache.put("token", user)
+    assert auth.grace_cache.get("token") is None
@@ -0,0 +1,77 @@
+import pytest
+
+from app.core.breaker import CircuitBreaker, CircuitOpenError, RetryBudget, State
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+async def succeed() -> str:
+    return "ok"
+
+
+async def fail() -> str:
+    raise ConnectionError("down")
+
+
+async def reject() -> str:
+    raise PermissionError("bad token")
+
+
+@pytest.mark.anyio
+async def test_opens_at_failure_rate() -> None:
+    """Test the breaker opens once enough calls failed and then fails fast"""
+    breaker = CircuitBreaker(
+        "test",
+        failure_rate=0.5,
+        min_calls=4,
+        is_failure=lambda e: isinstance(e, ConnectionError),
+        clock=Clock(),
+    )
+    await breaker.call(succeed)
+    for func in (fail, reject, fail):
+        with pytest.raises((ConnectionError, PermissionError)):
+            await breaker.call(func)
+    # 2 of 4 calls failed, the rejection was an answer
+    assert breaker.state is State.OPEN
+
+    with pytest.raises(CircuitOpenError) as e:
+        await breaker.call(succeed)
+    assert e.value.retry_after == breaker.open_seconds
+
+
+@pytest.mark.anyio
+async def test_half_open_probe() -> None:
+    """Test a failed probe opens the breaker again and a successful one closes it"""
+    clock = Clock()
+    breaker = CircuitBreaker("test", min_calls=1, open_seconds=10, clock=clock)
+    with pytest.raises(ConnectionError):
+        await breaker.call(fail)
+    assert breaker.retry_after() == 10
+
+    clock.now = 10
+    assert breaker.retry_after() == 0
+    with pytest.raises(ConnectionError):
+        await breaker.call(fail)
+    assert breaker.state is State.OPEN
+    assert breaker.retry_after() == 10
+
+    clock.now = 20
+    assert await breaker.call(succeed) == "ok"
+    assert breaker.opened_at is None
+
+
+def test_retry_budget() -> None:
+    """Test retries are limited to the ratio of calls, up to max_tokens"""
+    budget = RetryBudget(ratio=0.5, max_tokens=2)
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
@@ -0,0 +1,55 @@
+from urllib.parse import quote
+
+import pytest
+from sqlalchemy import text
+
+from app.core.config import Settings, normalize_dsn, settings
+from app.core.replica import Replica
+from app.core.shard import Shard
+
+MULTI_HOST = "postgresql+psycopg://app@replica1:5432,replica2:5432/app"
+LIBPQ_MULTI_HOST = "postgresql+psycopg://app@/app?host=replica1:5432&host=replica2:5432"
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        f'["{MULTI_HOST}", "postgresql://app@replica3/app"]',
+        f"{MULTI_HOST}\n  postgresql://app@replica3/app",
+    ],
+)
+def test_dsn_list(monkeypatch: pytest.MonkeyPatch, value: str) -> None:
+    """Test DSN lists are read from JSON or whitespace, multi-host DSNs stay whole"""
+    monkeypatch.setenv("POSTGRES_REPLICA_URIS", value)
+    monkeypatch.setenv("POSTGRES_SHARD_URIS", MULTI_HOST)
+    settings = Settings()  # type: ignore[call-arg]
+    assert settings.POSTGRES_REPLICA_URIS == [
+        LIBPQ_MULTI_HOST,
+        "postgresql+psycopg://app@replica3/app",
+    ]
+    assert settings.POSTGRES_SHARD_URIS == [LIBPQ_MULTI_HOST]
+
+
+def test_normalize_dsn() -> None:
+    """Test only multi-host DSNs are rewritten, keeping their query"""
+    assert normalize_dsn(f"{MULTI_HOST}?sslmode=require") == (
+        f"{LIBPQ_MULTI_HOST}&sslmode=require"
+    )
+    assert normalize_dsn("sqlite:///shard_0.db") == "sqlite:///shard_0.db"
+    assert normalize_dsn(LIBPQ_MULTI_HOST) == LIBPQ_MULTI_HOST
+
+
+def test_multi_host_engines() -> None:
+    """Test replicas and shards connect through a multi-host DSN"""
+    host = f"{settings.POSTGRES_SERVER}:{settings.POSTGRES_PORT}"
+    dsn = (
+        f"postgresql://{quote(settings.POSTGRES_USER)}:"
+        f"{quote(settings.POSTGRES_PASSWORD)}@{host},{host}/{settings.POSTGRES_DB}"
+    )
+    replica, shard = Replica(dsn), Shard(dsn)
+    assert repr(replica) == f"Replica({host},{host})"
+    assert shard.name == f"{host},{host}/{settings.POSTGRES_DB}"
+    for engine in (replica.engine, shard.engine):
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT 1")).scalar() == 1
+        engine.dispose()
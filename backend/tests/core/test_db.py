@@ -0,0 +1,33 @@
+import pytest
+from fastapi import Request
+from psycopg.errors import ReadOnlySqlTransaction
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlmodel import select
+
+from app.core.db import get_read_db, read_engine
+
+REQUEST = Request({"type": "http", "headers": [], "client": ("127.0.0.1", 5000)})
+
+
+def test_read_session_connects_on_first_query() -> None:
+    """Test the read-only session checks out no connection until it queries"""
+    checked_out = read_engine.pool.checkedout()  # type: ignore[attr-defined]
+    sessions = get_read_db(REQUEST)
+    session = next(sessions)
+    assert read_engine.pool.checkedout() == checked_out  # type: ignore[attr-defined]
+
+    assert session.exec(select(1)).one() == 1
+    assert session.connection().connection.driver_connection.autocommit  # type: ignore[union-attr]
+    sessions.close()
+    assert read_engine.pool.checkedout() == checked_out  # type: ignore[attr-defined]
+
+
+def test_read_session_rejects_writes() -> None:
+    """Test read-only sessions refuse writes"""
+    sessions = get_read_db(REQUEST)
+    session = next(sessions)
+    with pytest.raises(DBAPIError) as e:
+        session.exec(text("CREATE TEMP TABLE t (id int)"))  # type: ignore[call-overload]
+    assert isinstance(e.value.orig, ReadOnlySqlTransaction)
+    sessions.close()
@@ -0,0 +1,156 @@
+import time
+from typing import Any
+
+import anyio
+import pytest
+from psycopg.errors import QueryCanceled
+from sqlalchemy import Engine, text
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session
+from starlette.types import Message, Receive, Scope, Send
+
+from app.core.config import settings
+from app.core.deadline import Deadline, DeadlineMiddleware, current_deadline
+
+SCOPE: Scope = {"type": "http", "method": "GET", "path": "/slow", "headers": []}
+
+
+def slow_app(engine: Engine, errors: list[Exception]) -> Any:
+    """runs a 5s query in the threadpool, as sync routes do"""
+
+    def query() -> None:
+        with Session(engine) as session:
+            try:
+                session.exec(text("SELECT pg_sleep(5)"))  # type: ignore[call-overload]
+            except OperationalError as e:
+                errors.append(e)
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        await anyio.to_thread.run_sync(query)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    return app
+
+
+def test_route_deadline_sets_statement_timeout(test_engine: Engine) -> None:
+    """Test a query outliving the current deadline is cancelled by statement_timeout"""
+    token = current_deadline.set(Deadline(0.2))
+    try:
+        start = time.monotonic()
+        with Session(test_engine) as session, pytest.raises(OperationalError) as e:
+            session.exec(text("SELECT pg_sleep(5)"))  # type: ignore[call-overload]
+    finally:
+        current_deadline.reset(token)
+    assert isinstance(e.value.orig, QueryCanceled)
+    assert time.monotonic() - start < 2
+
+
+@pytest.mark.anyio
+async def test_deadline_cancels_query(
+    test_engine: Engine, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test a request past REQUEST_TIMEOUT_SECONDS gets a 504 and its query is cancelled"""
+    monkeypatch.setattr(settings, "REQUEST_TIMEOUT_SECONDS", 0.2)
+    errors: list[Exception] = []
+    sent: list[Message] = []
+
+    async def receive() -> Message:
+        if not sent:
+            await anyio.sleep(10)
+        return {"type": "http.disconnect"}
+
+    async def send(message: Message) -> None:
+        sent.append(message)
+
+    start = time.monotonic()
+    await DeadlineMiddleware(slow_app(test_engine, errors))(dict(SCOPE), receive, send)
+
+    assert time.monotonic() - start < 2
+    assert sent[0]["status"] == 504
+    (error,) = errors
+    assert isinstance(error.orig, QueryCanceled)  # type: ignore[attr-defined]
+
+
+@pytest.mark.anyio
+async def test_disconnect_cancels_query(test_engine: Engine) -> None:
+    """Test a client disconnect cancels the running query and nothing is sent"""
+    errors: list[Exception] = []
+    sent: list[Message] = []
+    messages: list[Message] = [
+        {"type": "http.request", "body": b"", "more_body": False},
+        {"type": "http.disconnect"},
+    ]
+
+    async def receive() -> Message:
+        message = messages.pop(0)
+        if message["type"] == "http.disconnect":
+            await anyio.sleep(0.2)
+        return message
+
+    async def send(message: Message) -> None:
+        sent.append(message)
+
+    start = time.monotonic()
+    await DeadlineMiddleware(slow_app(test_engine, errors))(dict(SCOPE), receive, send)
+
+    assert time.monotonic() - start < 2
+    # nobody is left to answer
+    assert not sent
+    (error,) = errors
+    assert isinstance(error.orig, QueryCanceled)  # type: ignore[attr-defined]
+
+
+@pytest.mark.anyio
+async def test_started_response_is_not_cut_off(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test a body streamed past the deadline is sent to the end"""
+    monkeypatch.setattr(settings, "REQUEST_TIMEOUT_SECONDS", 0.1)
+    sent: list[Message] = []
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        for chunk in (b"a", b"b", b"c"):
+            await anyio.sleep(0.1)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def receive() -> Message:
+        await anyio.sleep(10)
+        return {"type": "http.disconnect"}
+
+    async def send(message: Message) -> None:
+        sent.append(message)
+
+    await DeadlineMiddleware(app)(dict(SCOPE), receive, send)
+
+    assert sent[0]["status"] == 200
+    assert b"".join(m.get("body", b"") for m in sent[1:]) == b"abc"
+    assert len(sent) == 5
+
+
+@pytest.mark.anyio
+async def test_body_is_not_read_ahead() -> None:
+    """Test the next body chunk is only read once the app took the previous one"""
+    received = 0
+    app_read = anyio.Event()
+
+    async def receive() -> Message:
+        nonlocal received
+        received += 1
+        return {"type": "http.request", "body": b"x", "more_body": True}
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        await receive()
+        await anyio.sleep(0.1)
+        app_read.set()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message: Message) -> None:
+        pass
+
+    await DeadlineMiddleware(app)(dict(SCOPE), receive, send)
+
+    assert app_read.is_set()
+    # the chunk taken by the app and the one waiting in the queue
+    assert received <= 3
@@ -0,0 +1,46 @@
+import uuid
+
+from sqlmodel import Session
+
+from app import crud
+from app.core.instrumentation import QueryStats, normalize_sql, query_stats
+
+
+def test_normalize_sql() -> None:
+    """Test statements of the same shape normalize to the same text"""
+    statement = normalize_sql(
+        "SELECT *\n  FROM item WHERE id IN (%(id_1)s, %(id_2)s) AND title = 'it''s' LIMIT 10"
+    )
+    assert statement == "SELECT * FROM item WHERE id IN (...) AND title = ? LIMIT ?"
+
+    statement = normalize_sql("INSERT INTO item (title) VALUES (%s), (%s), (%s)")
+    assert statement == "INSERT INTO item (title) VALUES (?), ..."
+
+
+def test_repeated_selects() -> None:
+    """Test only SELECTs over the threshold are flagged as N+1"""
+    stats = QueryStats()
+    for _ in range(3):
+        stats.record("SELECT * FROM item WHERE id = ?", 0.001)
+        stats.record("UPDATE item SET title = ?", 0.001)
+    stats.record("SELECT 1", 0.001)
+
+    assert stats.count == 7
+    assert stats.repeated(3) == [("SELECT * FROM item WHERE id = ?", 3)]
+    assert stats.repeated(4) == []
+
+
+def test_request_stats(db: Session) -> None:
+    """Test statements are counted into the current request stats"""
+    stats = QueryStats()
+    token = query_stats.set(stats)
+    try:
+        for _ in range(3):
+            crud.item.get(db, id=uuid.uuid4())
+    finally:
+        query_stats.reset(token)
+
+    ((statement, count),) = stats.repeated(3)
+    assert statement.startswith("SELECT item.")
+    assert count == 3
+    assert stats.duration > 0
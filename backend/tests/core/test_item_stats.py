@@ -0,0 +1,12 @@
+from sqlalchemy import Engine, text
+
+from app.core.item_stats import RECONCILE_LOCK, reconcile
+
+
+def test_reconcile_one_worker_at_a_time(test_engine: Engine) -> None:
+    """Test a reconcile is skipped while another worker holds the lock"""
+    with test_engine.connect() as other:
+        other.execute(text("SELECT pg_advisory_lock(:key)"), {"key": RECONCILE_LOCK})
+        assert reconcile(test_engine) is None
+        other.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": RECONCILE_LOCK})
+    assert reconcile(test_engine) == 0
@@ -0,0 +1,82 @@
+import json
+import logging
+import queue
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+from gotrue import User
+
+from app.core.config import settings
+from app.core.log import JSONFormatter, _QueueHandler
+from app.schemas.auth import Token
+from tests.utils import get_auth_header
+
+
+def access_records(caplog: pytest.LogCaptureFixture) -> list[logging.LogRecord]:
+    return [r for r in caplog.records if r.name == "app.access"]
+
+
+def test_json_formatter() -> None:
+    """Test records are formatted as JSON with context and traceback, after the queue"""
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.getLogger("test").makeRecord(
+            "test",
+            logging.ERROR,
+            __file__,
+            1,
+            "failed %s",
+            ("twice",),
+            sys.exc_info(),
+            extra={"request_id": "abc", "user_id": None},
+        )
+    # as the listener thread gets it from the queue
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    _QueueHandler(log_queue).handle(record)
+    data = json.loads(JSONFormatter().format(log_queue.get()))
+
+    assert data["message"] == "failed twice"
+    assert data["level"] == "ERROR"
+    assert data["request_id"] == "abc"
+    assert "user_id" not in data
+    assert "ValueError: boom" in data["exc_info"]
+
+
+def test_access_log(
+    client: TestClient, token: Token, test_user: User, caplog: pytest.LogCaptureFixture
+) -> None:
+    """Test a request is logged once with its id, user, operation and status"""
+    caplog.set_level(logging.INFO, logger="app.access")
+    response = client.post(
+        f"{settings.API_V1_STR}/items/create-item",
+        headers={**get_auth_header(token.access_token), "X-Request-ID": "req-1"},
+        json={"title": "logged"},
+    )
+    assert response.headers["X-Request-ID"] == "req-1"
+
+    (record,) = access_records(caplog)
+    assert record.request_id == "req-1"  # type: ignore[attr-defined]
+    assert record.user_id == test_user.id  # type: ignore[attr-defined]
+    assert record.operation_id == "items-create_item"  # type: ignore[attr-defined]
+    assert record.status_code == 200  # type: ignore[attr-defined]
+    assert record.duration_ms > 0  # type: ignore[attr-defined]
+
+
+def test_access_log_sampling(
+    client: TestClient,
+    caplog: pytest.LogCaptureFixture,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test sampled out requests are not logged, errors always are"""
+    monkeypatch.setattr(settings, "ACCESS_LOG_SAMPLE_RATE", 0.0)
+    caplog.set_level(logging.INFO, logger="app.access")
+
+    client.get("/")
+    assert not access_records(caplog)
+    # errors are always logged
+    client.get("/missing")
+    (record,) = access_records(caplog)
+    assert record.status_code == 404  # type: ignore[attr-defined]
+    assert record.request_id  # type: ignore[attr-defined]
@@ -0,0 +1,19 @@
+from app.core.partitions import hash_partitions_ddl, is_partition
+
+
+def test_hash_partitions_ddl() -> None:
+    """Test one partition per remainder, attached to the given parent"""
+    statements = hash_partitions_ddl("item", 2, parent="item_new")
+    assert statements == [
+        "CREATE TABLE IF NOT EXISTS item_p0 PARTITION OF item_new "
+        "FOR VALUES WITH (MODULUS 2, REMAINDER 0)",
+        "CREATE TABLE IF NOT EXISTS item_p1 PARTITION OF item_new "
+        "FOR VALUES WITH (MODULUS 2, REMAINDER 1)",
+    ]
+
+
+def test_is_partition() -> None:
+    """Test only partitions of the given tables are recognised"""
+    assert is_partition("item_p3", {"item"})
+    assert not is_partition("item_p3", {"user"})
+    assert not is_partition("item_photo", {"item"})
@@ -0,0 +1,70 @@
+import time
+
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.core.replica import ReplicaRouter
+
+# the primary stands in for replicas, it reports no replication lag
+REPLICA_URI = str(settings.SQLALCHEMY_DATABASE_URI)
+
+
+def test_round_robin() -> None:
+    """Test reads rotate over healthy replicas"""
+    router = ReplicaRouter([REPLICA_URI, REPLICA_URI])
+    first, second = router.replicas
+
+    assert [router.choose() for _ in range(4)] == [first, second, first, second]
+    assert first.lag == 0
+    with Session(first.engine) as session:
+        assert session.exec(select(1)).one() == 1
+    router.dispose()
+
+
+def test_least_loaded() -> None:
+    """Test reads go to the replica with fewer checked out connections"""
+    router = ReplicaRouter([REPLICA_URI, REPLICA_URI], selection="least_loaded")
+    first, second = router.replicas
+
+    with first.engine.connect():
+        assert router.choose() is second
+    router.dispose()
+
+
+def test_fallback_to_primary() -> None:
+    """Test unhealthy or lagging replicas are skipped"""
+    router = ReplicaRouter([REPLICA_URI], max_lag=5, check_interval=60)
+    (replica,) = router.replicas
+    assert router.choose() is replica
+
+    replica.lag = 10
+    assert router.choose() is None
+
+    replica.lag = 0
+    replica.eject(ConnectionError("replica down"))
+    assert router.choose() is None
+
+    # re-checked once the interval passed
+    replica.checked_at = time.monotonic() - 60
+    assert router.choose() is replica
+    router.dispose()
+
+
+def test_unreachable_replica() -> None:
+    """Test a replica that cannot be reached is ejected"""
+    router = ReplicaRouter(["postgresql://postgres@127.0.0.1:1/postgres"])
+    assert router.choose() is None
+    assert not router.replicas[0].healthy
+    router.dispose()
+
+
+def test_read_your_writes() -> None:
+    """Test clients that wrote recently read from the primary"""
+    router = ReplicaRouter([REPLICA_URI], pin_seconds=0.1)
+    router.pin("client")
+
+    assert router.choose("client") is None
+    assert router.choose("other") is router.replicas[0]
+    time.sleep(0.1)
+    assert router.choose("client") is router.replicas[0]
+    router.dispose()
@@ -0,0 +1,127 @@
+import os
+import uuid
+from collections import Counter
+from collections.abc import Generator
+
+import pytest
+from alembic.script import ScriptDirectory
+from sqlalchemy import func, insert, text
+from sqlmodel import Session, select
+
+from app import crud
+from app.core.db import engine
+from app.core.shard import ShardMap
+from app.models.item import Item, ItemCreate
+from app.utils.migrate_shards import BACKEND, migrate
+
+
+@pytest.fixture(scope="module")
+def shard_urls() -> Generator[list[str], None]:
+    """two scratch databases without an auth schema, migrated by app.utils.migrate_shards"""
+    worker = os.environ.get("PYTEST_XDIST_WORKER", "main")
+    names = [f"test_shard_{worker}_{i}" for i in range(2)]
+    # plain postgresql:// DSNs, as configured, are run with psycopg 3
+    urls = [
+        engine.url.set(drivername="postgresql", database=name).render_as_string(
+            hide_password=False
+        )
+        for name in names
+    ]
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name in names:
+            conn.exec_driver_sql(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+            conn.exec_driver_sql(f"CREATE DATABASE {name}")
+    migrate(urls)
+    yield urls
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name in names:
+            conn.exec_driver_sql(f"DROP DATABASE {name} WITH (FORCE)")
+
+
+@pytest.fixture(scope="module")
+def shards(shard_urls: list[str]) -> Generator[ShardMap, None]:
+    shards = ShardMap(shard_urls)
+    yield shards
+    shards.dispose()
+
+
+def owners_per_shard(shards: ShardMap) -> dict[str, uuid.UUID]:
+    """an owner on each shard"""
+    owners: dict[str, uuid.UUID] = {}
+    while len(owners) < len(shards.shards):
+        owner_id = uuid.uuid4()
+        owners.setdefault(shards.shard_id(owner_id), owner_id)
+    return owners
+
+
+def test_ring() -> None:
+    """Test owners spread evenly and a new shard only takes over its share"""
+    owner_ids = [uuid.uuid4() for _ in range(3000)]
+    urls = [f"sqlite:///shard_{i}.db" for i in range(4)]
+    three, four = ShardMap(urls[:3]), ShardMap(urls)
+
+    counts = Counter(three.shard_id(owner_id) for owner_id in owner_ids)
+    assert all(600 < count < 1400 for count in counts.values())
+
+    moved = [o for o in owner_ids if three.shard_id(o) != four.shard_id(o)]
+    assert len(moved) < 0.35 * len(owner_ids)
+    assert {four.shard_id(o) for o in moved} == {":/shard_3.db"}
+
+
+def test_migrate(shards: ShardMap) -> None:
+    """Test shards are migrated to head without foreign keys to auth.users"""
+    head = ScriptDirectory(str(BACKEND / "app" / "alembic")).get_current_head()
+    for shard in shards:
+        with shard.engine.connect() as conn:
+            version = conn.execute(text("SELECT version_num FROM alembic_version"))
+            assert version.scalar_one() == head
+            assert conn.execute(text("SELECT to_regnamespace('auth')")).scalar() is None
+            foreign_keys = conn.execute(
+                text("SELECT count(*) FROM pg_constraint WHERE contype = 'f'")
+            )
+            assert foreign_keys.scalar_one() == 0
+
+
+def test_owner_routing(shards: ShardMap) -> None:
+    """Test rows go to their owner's shard and reads gather from all of them"""
+    owners = owners_per_shard(shards)
+    with shards.session() as session:
+        created = {
+            shard_id: crud.item.create(
+                session, owner_id=owner_id, obj_in=ItemCreate(title=shard_id)
+            )
+            for shard_id, owner_id in owners.items()
+        }
+        upserted = crud.item.upsert(
+            session,
+            owner_id=next(iter(owners.values())),
+            obj_in=ItemCreate(title="upserted", external_key="key"),
+        )
+
+        for shard_id, db_item in created.items():
+            assert crud.item.get(session, id=db_item.id) == db_item
+            with Session(shards.shards[shard_id].engine) as shard_session:
+                assert (
+                    shard_session.get(Item, (db_item.id, db_item.owner_id)) is not None
+                )
+        with Session(shards.shards[next(iter(owners))].engine) as shard_session:
+            assert shard_session.get(Item, (upserted.id, upserted.owner_id)) is not None
+
+        everything = crud.item.get_multi(session, limit=10)
+        assert [i.id for i in everything] == sorted(
+            i.id for i in [*created.values(), upserted]
+        )
+        assert crud.item.get_multi(session, skip=1, limit=1) == everything[1:2]
+
+        # scoped by owner, only the owner's shard is asked
+        owner_id = next(iter(owners.values()))
+        statement = select(func.count()).where(Item.owner_id == owner_id)
+        assert session.exec(statement).one() == 2
+
+
+def test_insert_spanning_shards(shards: ShardMap) -> None:
+    """Test a bulk INSERT of several shards' owners is refused, not misrouted"""
+    owners = owners_per_shard(shards)
+    rows = [{"title": "t", "owner_id": owner_id} for owner_id in owners.values()]
+    with shards.session() as session, pytest.raises(ValueError):
+        session.execute(insert(Item), rows)
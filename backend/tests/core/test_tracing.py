@@ -0,0 +1,160 @@
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from gotrue import User
+from opentelemetry import trace
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.sampling import ALWAYS_ON, Decision
+from sqlmodel import create_engine, text
+
+from app.core.auth import validate_token
+from app.core.config import settings
+from app.core.tracing import (
+    FileSpanExporter,
+    TracedQueuePool,
+    TracingTransport,
+    make_sampler,
+    memory_exporter,
+    tracer,
+)
+from app.models.item import Item
+from app.schemas.auth import Token
+from tests.utils import get_auth_header
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+
+@pytest.fixture(scope="module", autouse=True)
+def provider() -> None:
+    """record every span in memory, the global provider can only be set once"""
+    provider = TracerProvider(sampler=ALWAYS_ON)
+    provider.add_span_processor(SimpleSpanProcessor(memory_exporter))
+    trace.set_tracer_provider(provider)
+
+
+@pytest.fixture(scope="function", autouse=True)
+def clear_spans() -> None:
+    memory_exporter.clear()
+
+
+def finished_spans() -> dict[str, ReadableSpan]:
+    return {span.name: span for span in memory_exporter.get_finished_spans()}
+
+
+def test_request_trace(client: TestClient, token: Token, test_item: Item) -> None:
+    """Test a request continues the incoming trace with its queries as child spans"""
+    response = client.get(
+        f"{settings.API_V1_STR}/items/get-item/{test_item.id}",
+        headers={
+            **get_auth_header(token.access_token),
+            "traceparent": f"00-{TRACE_ID}-00f067aa0ba902b7-01",
+        },
+    )
+    assert response.status_code == 200
+
+    finished = finished_spans()
+    server = finished[f"GET {settings.API_V1_STR}/items/get-item/{{id}}"]
+    # the startup warm-up may run queries of its own meanwhile
+    (select,) = (
+        span
+        for span in memory_exporter.get_finished_spans()
+        if span.name == "db SELECT" and span.context.trace_id == server.context.trace_id
+    )
+    # the incoming trace is continued
+    assert trace.format_trace_id(server.context.trace_id) == TRACE_ID
+    assert select.context.trace_id == server.context.trace_id
+    assert select.parent is not None and select.parent.span_id == server.context.span_id
+    assert server.attributes is not None
+    assert server.attributes["http.response.status_code"] == 200
+    assert server.kind == trace.SpanKind.SERVER
+
+
+def test_pool_checkout() -> None:
+    """Test waiting for a pooled connection is a span of its own"""
+    engine = create_engine(
+        str(settings.SQLALCHEMY_DATABASE_URI), poolclass=TracedQueuePool
+    )
+    with tracer.start_as_current_span("parent"), engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    engine.dispose()
+
+    finished = finished_spans()
+    assert finished["db.pool.checkout"].parent is not None
+    assert (
+        finished["db.pool.checkout"].parent.span_id
+        == finished["parent"].context.span_id
+    )
+
+
+@pytest.mark.anyio
+async def test_httpx_transport() -> None:
+    """Test outgoing requests get a client span and carry traceparent"""
+    traceparents = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        traceparents.append(request.headers.get("traceparent"))
+        return httpx.Response(404)
+
+    transport = TracingTransport(httpx.MockTransport(handler))
+    async with httpx.AsyncClient(transport=transport) as client:
+        with tracer.start_as_current_span("parent"):
+            await client.get("http://supabase/auth/v1/user?x=1")
+
+    span = finished_spans()["GET"]
+    assert span.attributes is not None
+    assert span.attributes["url.full"] == "http://supabase/auth/v1/user"
+    assert span.attributes["http.response.status_code"] == 404
+    assert span.status.status_code == trace.StatusCode.ERROR
+    # the callee continues our trace
+    trace_id = trace.format_trace_id(span.context.trace_id)
+    assert traceparents[0].startswith(f"00-{trace_id}-")
+
+
+@pytest.mark.anyio
+async def test_get_current_user_span(test_user: User) -> None:
+    """Test token validation is traced"""
+
+    async def get_user(jwt: str) -> SimpleNamespace:  # noqa: ARG001
+        return SimpleNamespace(user=test_user)
+
+    super_client = SimpleNamespace(auth=SimpleNamespace(get_user=get_user))
+    user = await validate_token("token", super_client)  # type: ignore[arg-type]
+    assert user.id == test_user.id
+    assert "get_current_user" in finished_spans()
+
+
+def test_sampler() -> None:
+    """Test new traces follow the ratio and sampled parents are always continued"""
+    parent = trace.set_span_in_context(
+        trace.NonRecordingSpan(
+            trace.SpanContext(
+                int(TRACE_ID, 16),
+                1,
+                is_remote=True,
+                trace_flags=trace.TraceFlags(trace.TraceFlags.SAMPLED),
+            )
+        )
+    )
+    sampler = make_sampler(0.0)
+    assert sampler.should_sample(None, 1, "new").decision == Decision.DROP
+    sampled = sampler.should_sample(parent, int(TRACE_ID, 16), "continued")
+    assert sampled.decision == Decision.RECORD_AND_SAMPLE
+
+
+def test_file_exporter(tmp_path: Path) -> None:
+    """Test spans are appended to the file as JSON lines"""
+    path = tmp_path / "traces.jsonl"
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(FileSpanExporter(str(path))))
+    with provider.get_tracer("test").start_as_current_span("first"):
+        pass
+    with provider.get_tracer("test").start_as_current_span("second"):
+        pass
+
+    lines = path.read_text().splitlines()
+    assert [json.loads(line)["name"] for line in lines] == ["first", "second"]
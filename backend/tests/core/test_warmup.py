@@ -0,0 +1,42 @@
+import httpx
+import pytest
+from sqlalchemy import Engine, func
+from sqlmodel import Session, select
+
+from app.core import auth
+from app.core.config import settings
+from app.core.warmup import compile_crud, fill_pool, open_auth_connection
+from app.models.item import Item
+
+
+def test_fill_pool(test_engine: Engine) -> None:
+    """Test the pool is filled up to its size and the connections returned"""
+    assert fill_pool(test_engine, 100) == test_engine.pool.size()  # type: ignore[attr-defined]
+    assert test_engine.pool.checkedin() >= test_engine.pool.size()  # type: ignore[attr-defined]
+
+
+def test_compile_crud_keeps_nothing(test_engine: Engine) -> None:
+    """Test the warm-up statements leave no rows behind"""
+    compile_crud(test_engine)
+    with Session(test_engine) as session:
+        assert session.exec(select(func.count()).select_from(Item)).one() == 0
+
+
+@pytest.mark.anyio
+async def test_open_auth_connection(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test the health check goes through the super client's auth connection"""
+    requests: list[httpx.Request] = []
+
+    def health(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(health))
+    monkeypatch.setattr(auth, "_auth_http_client", client)
+    monkeypatch.setattr(auth, "_super_client", None)
+    try:
+        await open_auth_connection()
+    finally:
+        await auth.close_super_client()
+    assert [str(r.url) for r in requests] == [f"{settings.SUPABASE_URL}/auth/v1/health"]
+    assert requests[0].headers["apikey"] == settings.SUPABASE_KEY
@@ -0,0 +1,82 @@
+import asyncio
+import uuid
+
+import pytest
+from gotrue import User
+from sqlalchemy import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+
+from app import crud
+from app.core.instrumentation import count_queries
+from app.core.write_buffer import WriteBuffer
+from app.models.item import Item, ItemCreate
+
+
+@pytest.fixture(scope="function")
+def buffer(db: Session) -> WriteBuffer[Item]:
+    """buffer writing through the test transaction"""
+    connection = db.connection()
+    return WriteBuffer(
+        Item,
+        lambda: Session(bind=connection, join_transaction_mode="create_savepoint"),
+        max_batch_size=5,
+        max_wait=0.05,
+    )
+
+
+@pytest.mark.anyio
+async def test_group_commit(
+    buffer: WriteBuffer[Item], db: Session, test_user: User, test_engine: Engine
+) -> None:
+    """Test concurrent creates are written in batches of at most max_batch_size"""
+    owner_id = uuid.UUID(test_user.id)
+    await buffer.start()
+    with count_queries(test_engine) as stats:
+        items = await asyncio.gather(
+            *(
+                buffer.create(owner_id=owner_id, obj_in=ItemCreate(title=f"item {i}"))
+                for i in range(7)
+            )
+        )
+    await buffer.stop()
+
+    # every request gets its own row back
+    assert [item.title for item in items] == [f"item {i}" for i in range(7)]
+    assert len({item.id for item in items}) == 7
+    assert crud.item.get(db, id=items[-1].id) is not None
+    # one INSERT per batch of at most max_batch_size rows
+    inserts = sum(
+        count
+        for statement, count in stats.statements.items()
+        if statement.startswith("INSERT")
+    )
+    assert inserts == 2
+    assert buffer.stats.sizes == {5: 1, 2: 1}
+
+
+@pytest.mark.anyio
+async def test_failed_row(buffer: WriteBuffer[Item], test_user: User) -> None:
+    """Test a row violating a constraint fails alone"""
+    owner_id = uuid.UUID(test_user.id)
+    await buffer.start()
+    results = await asyncio.gather(
+        buffer.create(owner_id=owner_id, obj_in=ItemCreate(title="first")),
+        buffer.create(owner_id=uuid.uuid4(), obj_in=ItemCreate(title="no owner")),
+        buffer.create(owner_id=owner_id, obj_in=ItemCreate(title="last")),
+        return_exceptions=True,
+    )
+    await buffer.stop()
+
+    first, failed, last = results
+    assert isinstance(first, Item) and first.title == "first"
+    assert isinstance(failed, IntegrityError)
+    assert isinstance(last, Item) and last.title == "last"
+    assert buffer.stats.retried == 3
+
+
+@pytest.mark.anyio
+async def test_not_running(buffer: WriteBuffer[Item]) -> None:
+    """Test creates are refused while the buffer is stopped"""
+    with pytest.raises(RuntimeError):
+        await buffer.create(owner_id=uuid.uuid4(), obj_in=ItemCreate(title="x"))
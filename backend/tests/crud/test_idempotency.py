@@ -0,0 +1,33 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from gotrue import User
+from sqlmodel import Session
+
+from app import crud
+from app.core.config import settings
+from app.models.idempotency import IdempotencyKey
+
+
+def test_purge(db: Session, test_user: User) -> None:
+    """Test expired keys are deleted and live ones kept"""
+    owner_id = uuid.UUID(test_user.id)
+    expired = datetime.now(timezone.utc) - timedelta(
+        hours=settings.IDEMPOTENCY_KEY_TTL_HOURS, minutes=1
+    )
+    for key, created_at in (("expired", expired), ("live", datetime.now(timezone.utc))):
+        db.add(
+            IdempotencyKey(
+                owner_id=owner_id,
+                key=key,
+                request_hash="0" * 64,
+                status_code=200,
+                response={},
+                created_at=created_at,
+            )
+        )
+    db.commit()
+
+    assert crud.idempotency_key.purge(db) == 1
+    assert db.get(IdempotencyKey, (owner_id, "expired")) is None
+    assert crud.idempotency_key.get(db, owner_id=owner_id, key="live") is not None
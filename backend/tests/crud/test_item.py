@@ -2,7 +2,7 @@ import uuid
 
 from faker import Faker
 from gotrue import User
-from sqlmodel import Session
+from sqlmodel import Session, select, text
 
 from app import crud
 from app.models.item import Item, ItemCreate, ItemUpdate
@@ -84,3 +84,33 @@ def test_delete_item(db: Session, test_item: Item) -> None:
     # delete empty items
     deleted_item = crud.item.remove(db, id=test_item.id)
     assert deleted_item is None
+
+
+def test_upsert_item(db: Session, test_user: User) -> None:
+    """Test upserting by external_key updates the same record"""
+    owner_id = uuid.UUID(test_user.id)
+    item_in = ItemCreate(title="first", external_key="sync-1")
+    created = crud.item.upsert(db, owner_id=owner_id, obj_in=item_in)
+
+    item_in = ItemCreate(title="second", external_key="sync-1")
+    updated = crud.item.upsert(db, owner_id=owner_id, obj_in=item_in)
+
+    assert updated.id == created.id
+    assert updated.title == "second"
+    stored_item = crud.item.get(db, id=created.id)
+    assert stored_item is not None
+    assert stored_item.title == "second"
+
+
+def test_get_item_of_owner(db: Session, test_item: Item) -> None:
+    """Test lookups by owner find only the owner's items, in a single partition"""
+    owner_id = test_item.owner_id
+    assert crud.item.get(db, id=test_item.id, owner_id=owner_id) == test_item
+    assert crud.item.get(db, id=test_item.id, owner_id=uuid.uuid4()) is None
+    assert crud.item.get_multi(db, owner_id=owner_id) == [test_item]
+
+    statement = select(Item).where(Item.id == test_item.id, Item.owner_id == owner_id)
+    plan = db.exec(
+        text(f"EXPLAIN {statement.compile(compile_kwargs={'literal_binds': True})}")  # type: ignore[call-overload]
+    ).all()
+    assert sum(" on item_p" in row[0] for row in plan) == 1
@@ -0,0 +1,44 @@
+import uuid
+
+from gotrue import User
+from sqlalchemy import insert, text
+from sqlmodel import Session
+
+from app import crud
+from app.models.item import Item, ItemCreate
+
+
+def test_stats_follow_writes(db: Session, test_user: User) -> None:
+    """Test creates, bulk inserts, upserts and deletes keep the count"""
+    owner_id = uuid.UUID(test_user.id)
+    assert crud.item_stats.get(db, owner_id=owner_id).item_count == 0
+
+    created = crud.item.create(db, owner_id=owner_id, obj_in=ItemCreate(title="a"))
+    db.execute(insert(Item), [{"title": "b", "owner_id": owner_id} for _ in range(3)])
+    for title in ("c", "c again"):
+        crud.item.upsert(
+            db, owner_id=owner_id, obj_in=ItemCreate(title=title, external_key="c")
+        )
+    assert crud.item_stats.get(db, owner_id=owner_id).item_count == 5
+
+    crud.item.remove(db, id=created.id, owner_id=owner_id)
+    stats = crud.item_stats.get(db, owner_id=owner_id)
+    assert stats.item_count == 4
+    assert stats.last_activity_at is not None
+
+
+def test_reconcile(db: Session, test_item: Item) -> None:
+    """Test drifted counts are corrected and missing owners added"""
+    owner_id = test_item.owner_id
+    db.execute(text("ALTER TABLE item DISABLE TRIGGER item_stats_insert"))
+    crud.item.create(db, owner_id=owner_id, obj_in=ItemCreate(title="unseen"))
+    db.execute(text("ALTER TABLE item ENABLE TRIGGER item_stats_insert"))
+    assert crud.item_stats.get(db, owner_id=owner_id).item_count == 1
+
+    assert crud.item_stats.reconcile(db, batch_size=1) == 1
+    assert crud.item_stats.get(db, owner_id=owner_id).item_count == 2
+    assert crud.item_stats.reconcile(db) == 0
+
+    db.execute(text("DELETE FROM item_stats"))
+    assert crud.item_stats.reconcile(db) == 1
+    assert crud.item_stats.get(db, owner_id=owner_id).item_count == 2
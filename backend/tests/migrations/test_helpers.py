@@ -0,0 +1,152 @@
+import uuid
+from collections.abc import Generator
+
+import pytest
+from alembic.operations import Operations
+from alembic.runtime.migration import MigrationContext
+from sqlalchemy import Connection, Engine, text
+from sqlalchemy.exc import ProgrammingError
+
+from app.alembic import helpers
+from app.alembic.helpers import (
+    BACKFILL_TABLE,
+    backfill,
+    create_index_concurrently,
+    drop_index_concurrently,
+    rebuild_table,
+)
+from app.core.config import settings
+from app.core.partitions import hash_partitions_ddl
+
+
+@pytest.fixture(scope="function")
+def migration(test_engine: Engine) -> Generator[Connection, None]:
+    """run helpers as a revision would, against a scratch table"""
+    with (
+        test_engine.connect() as conn,
+        Operations.context(MigrationContext.configure(conn)) as op,
+    ):
+        with op.get_context().begin_transaction():
+            conn.execute(
+                text("CREATE TABLE backfill_test (id uuid PRIMARY KEY, n int)")
+            )
+            conn.execute(
+                text(
+                    "INSERT INTO backfill_test "
+                    "SELECT gen_random_uuid() FROM generate_series(1, 25)"
+                )
+            )
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+            with op.get_context().begin_transaction():
+                conn.execute(text("DROP TABLE backfill_test"))
+                if conn.execute(
+                    text(f"SELECT to_regclass('{BACKFILL_TABLE}')")
+                ).scalar():
+                    conn.execute(
+                        text(f"DELETE FROM {BACKFILL_TABLE} WHERE name LIKE 'test_%'")
+                    )
+
+
+def test_backfill(migration: Connection) -> None:
+    """Test rows are updated in batches and progress is cleared when done"""
+    rows = backfill(
+        "test_backfill",
+        "backfill_test",
+        "n = 1",
+        where="n IS NULL",
+        batch_size=10,
+        pause=0,
+    )
+    assert rows == 25
+    assert (
+        migration.execute(
+            text("SELECT count(*) FROM backfill_test WHERE n = 1")
+        ).scalar()
+        == 25
+    )
+    # an upgrade after a downgrade backfills again
+    progress = migration.execute(
+        text(f"SELECT rows FROM {BACKFILL_TABLE} WHERE name = 'test_backfill'")
+    ).scalar()
+    assert progress is None
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_backfill_resume(
+    migration: Connection, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test a rerun continues after the last committed batch"""
+    # a name of its own, no progress left by other tests or runs
+    name = f"test_resume_{uuid.uuid4().hex[:8]}"
+
+    def interrupt(_: float) -> None:
+        raise Interrupted
+
+    # interrupted in the pause after the first 10 rows
+    monkeypatch.setattr(helpers.time, "sleep", interrupt)
+    with pytest.raises(Interrupted):
+        backfill(name, "backfill_test", "n = 2", batch_size=10, pause=0)
+    monkeypatch.undo()
+
+    # the rerun leaves the first 10 rows alone
+    rows = backfill(name, "backfill_test", "n = 3", batch_size=10, pause=0)
+    assert rows == 15
+    counts = migration.execute(
+        text("SELECT n, count(*) FROM backfill_test GROUP BY n ORDER BY n")
+    ).all()
+    assert [tuple(row) for row in counts] == [(2, 10), (3, 15)]
+
+
+def test_create_index_concurrently(migration: Connection) -> None:
+    """Test concurrent index builds run outside a transaction and can be rerun"""
+    name = f"ix_backfill_test_{uuid.uuid4().hex[:8]}"
+    for _ in range(2):
+        create_index_concurrently(name, "backfill_test", ["n"])
+    valid = migration.execute(
+        text(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name"
+        ),
+        {"name": name},
+    ).scalar()
+    assert valid is True
+    migration.commit()
+
+    drop_index_concurrently(name, "backfill_test")
+    assert (
+        migration.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar()
+        is None
+    )
+
+
+def test_rebuild_table(migration: Connection) -> None:
+    """Test a table is rebuilt as a partitioned one with its rows"""
+    partitions = hash_partitions_ddl("backfill_test", 2, parent="backfill_test_new")
+    rebuild_table("backfill_test", partition_by="HASH (id)", partitions=partitions)
+
+    kind = migration.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = 'backfill_test'::regclass")
+    ).scalar()
+    assert kind == "p"
+    counts = migration.execute(
+        text(
+            "SELECT count(*) FROM backfill_test_p0 UNION ALL SELECT count(*) FROM backfill_test_p1"
+        )
+    ).scalars()
+    assert sum(counts) == 25
+
+
+def test_statement_timeout_restored(migration: Connection) -> None:
+    """Test statement_timeout is restored when a concurrent index build fails"""
+    with pytest.raises(ProgrammingError):
+        create_index_concurrently("ix_backfill_test_missing", "backfill_test", ["x"])
+    timeout = migration.execute(
+        text("SELECT setting FROM pg_settings WHERE name = 'statement_timeout'")
+    ).scalar()
+    assert timeout == str(settings.MIGRATION_STATEMENT_TIMEOUT_MS)
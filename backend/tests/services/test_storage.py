@@ -0,0 +1,78 @@
+from collections.abc import AsyncIterator, Callable
+
+import httpx
+import pytest
+
+from app.services.storage import SupabaseStorage, rechunk
+
+
+async def stream(*chunks: bytes) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.mark.anyio
+async def test_rechunk() -> None:
+    """Test a stream is regrouped into fixed size chunks"""
+    chunks = [c async for c in rechunk(stream(b"abc", b"defgh", b"i"), 4)]
+    assert chunks == [b"abcd", b"efgh", b"i"]
+
+
+def server_error() -> httpx.Response:
+    return httpx.Response(500)
+
+
+def dropped_connection() -> httpx.Response:
+    raise httpx.ReadError("connection reset")
+
+
+def timeout() -> httpx.Response:
+    raise httpx.WriteTimeout("timed out")
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("fail", [server_error, dropped_connection, timeout])
+async def test_resumable_upload(fail: Callable[[], httpx.Response]) -> None:
+    """Test large uploads are sent per chunk and resumed from the server offset"""
+    received = bytearray()
+    patches: list[int] = []
+    failed = False
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal failed
+        if request.method == "POST":
+            assert request.url.path == "/storage/v1/upload/resumable"
+            assert request.headers["Upload-Length"] == "10"
+            return httpx.Response(201, headers={"Location": "/upload/resumable/abc"})
+        if request.method == "HEAD":
+            return httpx.Response(200, headers={"Upload-Offset": str(len(received))})
+        assert int(request.headers["Upload-Offset"]) == len(received)
+        body = request.read()
+        patches.append(len(body))
+        if len(received) == 4 and not failed:
+            # keep half the chunk, then fail
+            failed = True
+            received.extend(body[:2])
+            return fail()
+        received.extend(body)
+        return httpx.Response(204)
+
+    storage = SupabaseStorage(
+        "http://supabase",
+        "key",
+        "attachments",
+        chunk_size=4,
+        resumable_threshold=8,
+        transport=httpx.MockTransport(handler),
+    )
+    size = await storage.upload(
+        "owner/item/file",
+        stream(b"0123", b"456", b"789"),
+        content_type="application/octet-stream",
+        size=10,
+    )
+    await storage.aclose()
+
+    assert size == 10
+    assert bytes(received) == b"0123456789"
+    assert patches == [4, 4, 2, 2]
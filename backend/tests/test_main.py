@@ -1,5 +1,6 @@
 import logging
 
+import pytest
 from fastapi.testclient import TestClient
 
 from app.utils.init_data import main as init_db
@@ -9,6 +10,7 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+@pytest.mark.supabase
 def test_init_db() -> None:
     init_db()
 